@@ -0,0 +1,167 @@
+import asyncio
+import numpy as np
+import orjson
+from .artifacts import LRUCache, get_artifact
+
+EDGE_TYPES = ('contains', 'call', 'import')
+INDEX_LRU_SIZE = 16
+
+
+def _csr(n, src, dst, etype):
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32), etype[order], order.astype(np.int32)
+
+
+def _gather(indptr, frontier):
+    """Positions (dans indices) de toutes les arêtes sortant de frontier."""
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+
+class GraphIndex:
+    """
+    Index d'adjacence CSR (sortant et entrant) construit une fois par scan à
+    partir du JSON d3 de build_graph. Les requêtes ne renvoient que la tranche
+    demandée du graphe.
+    """
+
+    def __init__(self, graph_json):
+        self.ids = [n['id'] for n in graph_json['nodes']]
+        self.types = [n['type'] for n in graph_json['nodes']]
+        self.pos = {node_id: i for i, node_id in enumerate(self.ids)}
+        links = [l for l in graph_json['links'] if l['source'] in self.pos and l['target'] in self.pos]
+        n = len(self.ids)
+        src = np.fromiter((self.pos[l['source']] for l in links), dtype=np.int32, count=len(links))
+        dst = np.fromiter((self.pos[l['target']] for l in links), dtype=np.int32, count=len(links))
+        codes = {t: i for i, t in enumerate(EDGE_TYPES)}
+        etype = np.fromiter((codes.get(l['type'], len(EDGE_TYPES)) for l in links), dtype=np.int8, count=len(links))
+        self.n_edges = len(links)
+        self.out_ptr, self.out_idx, self.out_type, self.out_edge = _csr(n, src, dst, etype)
+        self.in_ptr, self.in_idx, self.in_type, self.in_edge = _csr(n, dst, src, etype)
+        self.src, self.dst, self.etype = src, dst, etype
+
+    def _node(self, i):
+        return {'id': self.ids[i], 'type': self.types[i]}
+
+    def _link(self, e):
+        return {'source': self.ids[self.src[e]], 'target': self.ids[self.dst[e]], 'type': EDGE_TYPES[self.etype[e]]}
+
+    def _type_mask(self, edge_types):
+        if not edge_types:
+            return None
+        return np.array([t in edge_types for t in EDGE_TYPES] + [False])
+
+    def _step(self, frontier, mask, direction):
+        """Voisins de frontier et identifiants des arêtes traversées."""
+        nbrs, edges = [], []
+        sides = []
+        if direction in ('out', 'both'):
+            sides.append((self.out_ptr, self.out_idx, self.out_type, self.out_edge))
+        if direction in ('in', 'both'):
+            sides.append((self.in_ptr, self.in_idx, self.in_type, self.in_edge))
+        for ptr, idx, typ, edge in sides:
+            p = _gather(ptr, frontier)
+            if mask is not None and len(p):
+                p = p[mask[typ[p]]]
+            nbrs.append(idx[p])
+            edges.append(edge[p])
+        return np.concatenate(nbrs), np.concatenate(edges)
+
+    def neighborhood(self, node_id, depth=1, edge_types=None, direction='both', limit=1000):
+        if node_id not in self.pos:
+            raise KeyError(node_id)
+        mask = self._type_mask(edge_types)
+        visited = np.zeros(len(self.ids), dtype=bool)
+        start = self.pos[node_id]
+        visited[start] = True
+        frontier = np.array([start], dtype=np.int64)
+        edge_ids = []
+        truncated = False
+        for _ in range(depth):
+            nbrs, edges = self._step(frontier, mask, direction)
+            edge_ids.append(edges)
+            new = np.unique(nbrs[~visited[nbrs]])
+            if visited.sum() + len(new) > limit:
+                new = new[:max(0, limit - int(visited.sum()))]
+                truncated = True
+            visited[new] = True
+            frontier = new
+            if truncated or not len(frontier):
+                break
+        kept = np.flatnonzero(visited)
+        edges = np.unique(np.concatenate(edge_ids)) if edge_ids else np.empty(0, dtype=np.int64)
+        edges = edges[visited[self.src[edges]] & visited[self.dst[edges]]]
+        return {
+            'nodes': [self._node(i) for i in kept],
+            'links': [self._link(e) for e in edges],
+            'truncated': truncated,
+        }
+
+    def path(self, source, target, edge_types=None, directed=True, max_depth=20):
+        """Plus court chemin (BFS par niveaux), None si aucun."""
+        for node_id in (source, target):
+            if node_id not in self.pos:
+                raise KeyError(node_id)
+        mask = self._type_mask(edge_types)
+        s, t = self.pos[source], self.pos[target]
+        parent_edge = np.full(len(self.ids), -1, dtype=np.int64)
+        visited = np.zeros(len(self.ids), dtype=bool)
+        visited[s] = True
+        frontier = np.array([s], dtype=np.int64)
+        direction = 'out' if directed else 'both'
+        for _ in range(max_depth):
+            if visited[t] or not len(frontier):
+                break
+            nbrs, edges = self._step(frontier, mask, direction)
+            fresh = ~visited[nbrs]
+            nbrs, edges = nbrs[fresh], edges[fresh]
+            nbrs, first = np.unique(nbrs, return_index=True)
+            parent_edge[nbrs] = edges[first]
+            visited[nbrs] = True
+            frontier = nbrs
+        if not visited[t]:
+            return None
+        nodes, links, cur = [t], [], t
+        while cur != s:
+            e = parent_edge[cur]
+            links.append(self._link(e))
+            cur = self.src[e] if self.dst[e] == cur else self.dst[e]
+            nodes.append(cur)
+        return {'nodes': [self._node(i) for i in reversed(nodes)], 'links': links[::-1]}
+
+    def list_nodes(self, node_type=None, query=None, offset=0, limit=100):
+        matches = [
+            i for i, (node_id, t) in enumerate(zip(self.ids, self.types))
+            if (node_type is None or t == node_type) and (not query or query in node_id)
+        ]
+        degree = (self.out_ptr[1:] - self.out_ptr[:-1]) + (self.in_ptr[1:] - self.in_ptr[:-1])
+        page = matches[offset:offset + limit]
+        return {
+            'total': len(matches),
+            'offset': offset,
+            'nodes': [dict(self._node(i), degree=int(degree[i])) for i in page],
+        }
+
+
+_indexes = LRUCache(INDEX_LRU_SIZE)
+
+
+async def get_index(scan_id: int) -> GraphIndex:
+    # Clé sur l'ETag: un artefact invalidé puis reconstruit donne un nouvel index
+    artifact = await get_artifact(scan_id)
+    if artifact is None:
+        return None
+    etag, body = artifact
+    index = _indexes.get((scan_id, etag))
+    if index is None:
+        graph_json = orjson.loads(body)['json']
+        index = await asyncio.to_thread(GraphIndex, graph_json)
+        _indexes.set((scan_id, etag), index)
+    return index
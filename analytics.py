@@ -0,0 +1,110 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOL = 1e-8
+PAGERANK_MAX_ITER = 100
+
+
+def file_edges(files, edges, kinds=('call', 'import')):
+    """
+    Projette les arêtes symbole -> symbole sur les fichiers
+    ('a.py::C.m' -> 'a.py'). Retourne deux tableaux d'indices (src, dst).
+    """
+    pos = {f: i for i, f in enumerate(files)}
+    src, dst = [], []
+    for s, t, kind in edges:
+        if kind not in kinds:
+            continue
+        a, b = pos.get(s.partition('::')[0]), pos.get(t.partition('::')[0])
+        if a is not None and b is not None and a != b:
+            src.append(a)
+            dst.append(b)
+    return np.asarray(src, dtype=np.int32), np.asarray(dst, dtype=np.int32)
+
+
+def adjacency(n, src, dst):
+    # Matrice binaire: arêtes dupliquées fusionnées
+    a = sp.csr_matrix((np.ones(len(src), dtype=np.float64), (src, dst)), shape=(n, n))
+    a.sum_duplicates()
+    a.data[:] = 1.0
+    return a
+
+
+def pagerank(a, damping=PAGERANK_DAMPING, tol=PAGERANK_TOL, max_iter=PAGERANK_MAX_ITER):
+    """PageRank par itération de puissance sur la matrice creuse (nœuds pendants répartis)."""
+    n = a.shape[0]
+    if not n:
+        return np.empty(0)
+    out_degree = np.asarray(a.sum(axis=1)).ravel()
+    dangling = out_degree == 0
+    inv = np.divide(1.0, out_degree, out=np.zeros(n), where=~dangling)
+    transition = sp.diags(inv) @ a
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        prev = rank
+        rank = damping * (transition.T @ prev + prev[dangling].sum() / n) + (1 - damping) / n
+        if np.abs(rank - prev).sum() < tol:
+            break
+    return rank
+
+
+def _percentile(values):
+    # Rang normalisé dans [0, 1], ex aequo au même rang
+    if len(values) < 2:
+        return np.zeros(len(values))
+    _, inverse = np.unique(values, return_inverse=True)
+    return inverse / max(inverse.max(), 1)
+
+
+def analyze(files, edges, complexity):
+    """
+    Métriques par fichier et statistiques du graphe d'un scan.
+    files: relpaths; edges: (source, target, type) de build_graph;
+    complexity: complexité cyclomatique par fichier (même ordre que files).
+    Retourne (rows, stats).
+    """
+    n = len(files)
+    if not n:
+        return [], {'n_files': 0}
+    a = adjacency(n, *file_edges(files, edges))
+    fan_out = np.diff(a.indptr)
+    fan_in = np.bincount(a.indices, minlength=n)
+    rank = pagerank(a)
+    # Cycles d'imports: composantes fortement connexes du graphe des imports
+    imports = adjacency(n, *file_edges(files, edges, kinds=('import',)))
+    _, labels = connected_components(imports, directed=True, connection='strong')
+    component_size = np.bincount(labels)
+    scc_size = component_size[labels]
+    complexity = np.asarray(complexity, dtype=np.int64)
+    # Score de risque: moyenne des rangs (complexité, couplage, centralité), +cycle
+    score = (_percentile(complexity) + _percentile(fan_in) + _percentile(fan_out) + _percentile(rank)) / 4
+    score = np.where(scc_size > 1, np.minimum(score + 0.1, 1.0), score)
+    rows = [
+        {
+            'file': files[i],
+            'score': round(float(score[i]), 4),
+            'complexity': int(complexity[i]),
+            'fan_in': int(fan_in[i]),
+            'fan_out': int(fan_out[i]),
+            'pagerank': float(rank[i]),
+            'scc_size': int(scc_size[i]),
+        }
+        for i in range(n)
+    ]
+    cycles = component_size[component_size > 1]
+    stats = {
+        'n_files': n,
+        'n_file_edges': int(a.nnz),
+        'n_import_edges': int(imports.nnz),
+        'density': float(a.nnz / (n * (n - 1))) if n > 1 else 0.0,
+        'import_cycles': int(len(cycles)),
+        'files_in_cycles': int(cycles.sum()),
+        'largest_cycle': int(cycles.max()) if len(cycles) else 0,
+        'max_fan_in': int(fan_in.max()),
+        'max_fan_out': int(fan_out.max()),
+        'total_complexity': int(complexity.sum()),
+        'mean_complexity': float(complexity.mean()),
+    }
+    return rows, stats
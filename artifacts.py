@@ -0,0 +1,196 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import lz4.frame
+import orjson
+import redis.asyncio as aioredis
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+from .builder import compute_graph, store_metrics
+from .recommender import generate_suggestions
+
+DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
+engine = sa.create_engine(DB_URL)
+Session = sessionmaker(bind=engine)
+REDIS_URL = os.getenv("REDIS_URL", "redis://cache:6379/0")
+redis_client = aioredis.Redis.from_url(REDIS_URL)
+
+LRU_SIZE = int(os.getenv("GRAPH_LRU_SIZE", 64))
+REDIS_TTL = int(os.getenv("GRAPH_CACHE_TTL", 7 * 24 * 3600))
+
+Base = declarative_base()
+
+class GraphArtifact(Base):
+    __tablename__ = 'graph_artifacts'
+    scan_id = sa.Column(sa.Integer, primary_key=True)
+    etag = sa.Column(sa.String(64))
+    body = sa.Column(sa.LargeBinary)  # réponse JSON complète, compressée LZ4
+    created_at = sa.Column(sa.DateTime, default=datetime.utcnow)
+Base.metadata.create_all(engine)
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+lru = LRUCache(LRU_SIZE)
+_builds = {}  # scan_id -> construction en cours, partagée par les requêtes concurrentes
+
+
+def _redis_key(scan_id):
+    return f"graph:{scan_id}"
+
+
+def _load_db(scan_id):
+    session = Session()
+    try:
+        row = session.get(GraphArtifact, scan_id)
+        return (row.etag, lz4.frame.decompress(row.body)) if row else None
+    finally:
+        session.close()
+
+
+def _store_db(scan_id, etag, body):
+    session = Session()
+    try:
+        session.merge(GraphArtifact(scan_id=scan_id, etag=etag, body=lz4.frame.compress(body)))
+        session.commit()
+    finally:
+        session.close()
+
+
+def _fetch_suggestions(scan_id):
+    session = Session()
+    try:
+        return session.execute(sa.text("SELECT type, suggestion FROM suggestions WHERE scan_id=:scan_id"), {"scan_id": scan_id}).fetchall()
+    finally:
+        session.close()
+
+
+def _scan_status(scan_id):
+    session = Session()
+    try:
+        return session.execute(sa.text("SELECT status FROM scans WHERE id=:scan_id"), {"scan_id": scan_id}).scalar()
+    finally:
+        session.close()
+
+
+async def build_artifact(scan_id: int, persist: bool = True):
+    """
+    Construit une seule fois graphe, DOT, JSON d3, métriques, statistiques
+    et suggestions d'un scan et les sérialise. Retourne (etag, body).
+    Sans persist (scan en cours), métriques calculées en mémoire: rien n'est
+    stocké ni généré par le LLM.
+    """
+    dot_str, json_dict, metrics, stats = await asyncio.to_thread(compute_graph, scan_id)
+    if persist:
+        await asyncio.to_thread(store_metrics, scan_id, metrics, stats)
+    suggestions = await asyncio.to_thread(_fetch_suggestions, scan_id)
+    # Génère suggestions si absentes
+    if not suggestions and persist:
+        await generate_suggestions(scan_id, json_dict)
+        suggestions = await asyncio.to_thread(_fetch_suggestions, scan_id)
+    body = orjson.dumps({
+        "dot": dot_str,
+        "json": json_dict,
+        "metrics": sorted(metrics, key=lambda m: -m["score"]),
+        "stats": stats,
+        "suggestions": [{"type": s[0], "suggestion": s[1]} for s in suggestions],
+    })
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    if persist:
+        await asyncio.to_thread(_store_db, scan_id, etag, body)
+    return etag, body
+
+
+async def get_artifact(scan_id: int):
+    """
+    Artefact d'un scan: LRU en mémoire -> Redis -> table graph_artifacts ->
+    construction (une seule à la fois par scan dans ce process: les requêtes
+    concurrentes attendent la même). None si le scan n'existe pas; celui
+    d'un scan non terminé est reconstruit et jamais mis en cache (même règle
+    que l'index lexical).
+    """
+    hit = lru.get(scan_id)
+    if hit:
+        return hit
+    key = _redis_key(scan_id)
+    cached = await redis_client.hmget(key, "etag", "body")
+    if cached[0] and cached[1]:
+        hit = (cached[0].decode(), lz4.frame.decompress(cached[1]))
+        lru.set(scan_id, hit)
+        return hit
+    build = _builds.get(scan_id)
+    if build is None:
+        build = asyncio.ensure_future(_load_or_build(scan_id))
+        _builds[scan_id] = build
+        build.add_done_callback(lambda _: _builds.pop(scan_id, None))
+    # shield: une requête annulée (client parti) n'annule pas celle des autres
+    return await asyncio.shield(build)
+
+
+async def _load_or_build(scan_id):
+    hit = lru.get(scan_id)
+    if hit:
+        return hit
+    hit = await asyncio.to_thread(_load_db, scan_id)
+    if hit is None:
+        status = await asyncio.to_thread(_scan_status, scan_id)
+        if status is None:
+            return None
+        if status != 'done':
+            return await build_artifact(scan_id, persist=False)
+        hit = await build_artifact(scan_id)
+    key = _redis_key(scan_id)
+    await redis_client.hset(key, mapping={"etag": hit[0], "body": lz4.frame.compress(hit[1])})
+    if REDIS_TTL:
+        await redis_client.expire(key, REDIS_TTL)
+    lru.set(scan_id, hit)
+    return hit
+
+
+async def invalidate(scan_id: int):
+    lru.pop(scan_id)
+    await redis_client.delete(_redis_key(scan_id))
+    await asyncio.to_thread(_delete_db, scan_id)
+
+
+def _delete_db(scan_id):
+    session = Session()
+    try:
+        session.query(GraphArtifact).filter_by(scan_id=scan_id).delete()
+        session.commit()
+    finally:
+        session.close()
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+    return '*' in tags or etag in tags
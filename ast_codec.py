@@ -0,0 +1,221 @@
+import struct
+import sys
+import json
+from array import array
+import lz4.frame
+
+# Binary layout (little-endian), one record per node in DFS pre-order:
+#   header     MAGIC, version, n_nodes, n_types, types_len
+#   types      per node type: u16 length + UTF-8 name, padded to 4 bytes
+#              (names are not joined: tree-sitter-go has a node of type '\n')
+#   u32/i32    parent, end, start_byte, end_byte, start_row, start_col, end_row, end_col
+#   u16        type_id
+#   u8         named
+# end[i] is the index just past the subtree of node i, so the children of i
+# are i+1, end[i+1], end[end[i+1]], ... up to end[i].
+MAGIC = b'RAST'
+VERSION = 2
+HEADER = struct.Struct('<4sHxxIII')
+NAME_LEN = struct.Struct('<H')
+U32_FIELDS = ('end', 'start_byte', 'end_byte', 'start_row', 'start_col', 'end_row', 'end_col')
+
+
+class _Builder:
+    def __init__(self):
+        self.type_ids = {}
+        self.type_id = array('H')
+        self.named = array('B')
+        self.parent = array('i')
+        self.cols = {name: array('I') for name in U32_FIELDS}
+
+    def add(self, type_name, named, parent, start_byte, end_byte, start_point, end_point):
+        i = len(self.type_id)
+        tid = self.type_ids.setdefault(type_name, len(self.type_ids))
+        self.type_id.append(tid)
+        self.named.append(1 if named else 0)
+        self.parent.append(parent)
+        c = self.cols
+        c['end'].append(i + 1)
+        c['start_byte'].append(start_byte)
+        c['end_byte'].append(end_byte)
+        c['start_row'].append(start_point[0])
+        c['start_col'].append(start_point[1])
+        c['end_row'].append(end_point[0])
+        c['end_col'].append(end_point[1])
+        return i
+
+    def close(self, i):
+        self.cols['end'][i] = len(self.type_id)
+
+    def tobytes(self):
+        names = b''.join(NAME_LEN.pack(len(name)) + name for name in (t.encode() for t in self.type_ids))
+        pad = b'\0' * (-len(names) % 4)
+        parts = [HEADER.pack(MAGIC, VERSION, len(self.type_id), len(self.type_ids), len(names)), names, pad]
+        arrays = [self.parent] + [self.cols[name] for name in U32_FIELDS] + [self.type_id, self.named]
+        for a in arrays:
+            if sys.byteorder != 'little':
+                a = array(a.typecode, a)
+                a.byteswap()
+            parts.append(a.tobytes())
+        return b''.join(parts)
+
+
+def encode_tree(node):
+    """Encode a tree-sitter node and its subtree iteratively (no recursion)."""
+    b = _Builder()
+    cursor = node.walk()
+    stack = []
+    while True:
+        n = cursor.node
+        i = b.add(n.type, n.is_named, stack[-1] if stack else -1,
+                  n.start_byte, n.end_byte, n.start_point, n.end_point)
+        if cursor.goto_first_child():
+            stack.append(i)
+            continue
+        while not cursor.goto_next_sibling():
+            if not stack:
+                return b.tobytes()
+            cursor.goto_parent()
+            b.close(stack.pop())
+
+
+def encode_dict(tree):
+    """Encode a legacy nested dict AST ({'type', 'start', 'end', 'children'})."""
+    b = _Builder()
+    stack = [(tree, -1, False)]
+    while stack:
+        d, parent, done = stack.pop()
+        if done:
+            b.close(parent)
+            continue
+        i = b.add(d['type'], True, parent, 0, 0, d['start'], d['end'])
+        stack.append((None, i, True))
+        for child in reversed(d['children']):
+            stack.append((child, i, False))
+    return b.tobytes()
+
+
+def _decode_types(raw, n_types, version):
+    if version == 1:
+        # Legacy: names joined by '\n'. The only name that contains it is '\n'
+        # itself, which splits into two consecutive empty strings.
+        names = raw.decode().split('\n') if n_types else []
+        if len(names) != n_types:
+            merged = []
+            for name in names:
+                if name == '' and merged and merged[-1] == '':
+                    merged[-1] = '\n'
+                else:
+                    merged.append(name)
+            names = merged
+    else:
+        names, off = [], 0
+        while off < len(raw):
+            (size,) = NAME_LEN.unpack_from(raw, off)
+            off += NAME_LEN.size
+            names.append(raw[off:off + size].decode())
+            off += size
+    if len(names) != n_types:
+        raise ValueError(f"Corrupt AST type table: {len(names)} names, expected {n_types}")
+    return names
+
+
+class CompactAST:
+    """
+    Zero-copy view over an encoded AST: every column is a memoryview cast
+    directly onto the decoded buffer.
+    """
+
+    def __init__(self, buf):
+        buf = memoryview(buf)
+        magic, version, n_nodes, n_types, types_len = HEADER.unpack_from(buf)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"Unsupported AST encoding: {bytes(magic)!r} v{version}")
+        off = HEADER.size
+        self.types = _decode_types(bytes(buf[off:off + types_len]), n_types, version)
+        off += types_len + (-types_len % 4)
+        self.n_nodes = n_nodes
+        self.parent, off = self._column(buf, off, 'i', 4)
+        for name in U32_FIELDS:
+            col, off = self._column(buf, off, 'I', 4)
+            setattr(self, name, col)
+        self.type_id, off = self._column(buf, off, 'H', 2)
+        self.named, off = self._column(buf, off, 'B', 1)
+
+    def _column(self, buf, off, typecode, size):
+        raw = buf[off:off + self.n_nodes * size]
+        if sys.byteorder != 'little' and size > 1:
+            col = array(typecode, raw)
+            col.byteswap()
+            return memoryview(col), off + len(raw)
+        return raw.cast(typecode), off + len(raw)
+
+    def __len__(self):
+        return self.n_nodes
+
+    def type(self, i):
+        return self.types[self.type_id[i]]
+
+    def start(self, i):
+        return self.start_row[i], self.start_col[i]
+
+    def stop(self, i):
+        return self.end_row[i], self.end_col[i]
+
+    def children(self, i):
+        c, end = i + 1, self.end[i]
+        while c < end:
+            yield c
+            c = self.end[c]
+
+    def descendants(self, i):
+        return range(i + 1, self.end[i])
+
+    def find(self, type_names, within=0):
+        """Indices of nodes under `within` whose type is in type_names."""
+        wanted = {tid for tid, name in enumerate(self.types) if name in type_names}
+        if not wanted or not self.n_nodes:
+            return []
+        type_id = self.type_id
+        return [i for i in range(within, self.end[within]) if type_id[i] in wanted]
+
+    def depth(self, i):
+        d = 0
+        while self.parent[i] >= 0:
+            i = self.parent[i]
+            d += 1
+        return d
+
+    def sexp(self, max_nodes=None):
+        """Compact s-expression of named nodes, e.g. (module (function_definition ...))."""
+        out = []
+        open_ends = []
+        limit = self.n_nodes if max_nodes is None else min(max_nodes, self.n_nodes)
+        for i in range(limit):
+            while open_ends and open_ends[-1] <= i:
+                open_ends.pop()
+                out.append(')')
+            if not self.named[i]:
+                continue
+            out.append(' (' if out else '(')
+            out.append(self.type(i))
+            open_ends.append(self.end[i])
+        out.append(')' * len(open_ends))
+        return ''.join(out)
+
+
+def is_compact(data):
+    return data[:4] == MAGIC
+
+
+def dumps(node):
+    """Encode and LZ4-compress a tree-sitter node."""
+    return lz4.frame.compress(encode_tree(node))
+
+
+def loads(compressed):
+    """Decompress a stored AST; legacy JSON chunks are converted on the fly."""
+    data = lz4.frame.decompress(compressed)
+    if not is_compact(data):
+        data = encode_dict(json.loads(data))
+    return CompactAST(data)
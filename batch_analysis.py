@@ -0,0 +1,375 @@
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+import redis.asyncio as aioredis
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+from celery import Celery
+from celery.signals import worker_process_shutdown
+from app.scanner.celeryconfig import broker_url, result_backend
+from app.graph.builder import build_graph
+from . import registry
+
+# Analyse d'un scan complet par BugHunter/VulnSeeker: une ligne `findings` par
+# (chunk de code, agent), d'abord file d'attente puis résultat. Les tâches
+# Celery réclament les lignes par score de risque décroissant; une ligne
+# terminée n'est jamais rejouée, une ligne réclamée par un worker mort est
+# reprise à l'expiration de son bail.
+DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
+engine = sa.create_engine(DB_URL)
+Session = sessionmaker(bind=engine)
+REDIS_URL = os.getenv("REDIS_URL", "redis://cache:6379/0")
+
+AGENTS = ('bug', 'vuln')
+CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", 8))  # chunks en cours par tâche
+WORKERS = int(os.getenv("ANALYSIS_WORKERS", 2))          # tâches Celery par analyse
+LEASE = int(os.getenv("ANALYSIS_LEASE", 900))            # secondes avant reprise d'une ligne réclamée
+MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", 3))
+RETRY_DELAY = int(os.getenv("ANALYSIS_RETRY_DELAY", 60))  # secondes, doublé à chaque échec
+PROGRESS_EVERY = 2.0  # secondes entre deux mises à jour de l'état Celery
+# Requêtes par seconde et par modèle, tous workers confondus
+RATE_LIMITS = {
+    model: float(rate)
+    for model, _, rate in (item.partition('=') for item in os.getenv("LLM_RATE_LIMITS", "gpt-4.1=8,mixtral-8x22b=20").split(',') if item)
+}
+
+Base = declarative_base()
+
+class AnalysisRun(Base):
+    __tablename__ = 'analysis_runs'
+    id = sa.Column(sa.Integer, primary_key=True)
+    scan_id = sa.Column(sa.Integer, index=True)
+    agents = sa.Column(sa.JSON)
+    status = sa.Column(sa.String(16), default='running')
+    total = sa.Column(sa.Integer)
+    created_at = sa.Column(sa.DateTime, default=datetime.utcnow)
+    finished_at = sa.Column(sa.DateTime)
+
+class Finding(Base):
+    __tablename__ = 'findings'
+    id = sa.Column(sa.Integer, primary_key=True)
+    run_id = sa.Column(sa.Integer, sa.ForeignKey('analysis_runs.id'))
+    scan_id = sa.Column(sa.Integer)
+    chunk_id = sa.Column(sa.Integer)  # code_chunks.id
+    relpath = sa.Column(sa.String)
+    start_line = sa.Column(sa.Integer)
+    end_line = sa.Column(sa.Integer)
+    agent = sa.Column(sa.String(16))
+    priority = sa.Column(sa.Float)  # metrics.score du fichier
+    status = sa.Column(sa.String(16), default='pending')  # pending, running, done, failed
+    attempts = sa.Column(sa.Integer, default=0)
+    claimed_at = sa.Column(sa.DateTime)
+    not_before = sa.Column(sa.DateTime)  # ligne en échec: pas de nouvelle tentative avant
+    finished_at = sa.Column(sa.DateTime)
+    # Réponse structurée (format assistant_format des prompts)
+    severity = sa.Column(sa.Float)
+    confidence = sa.Column(sa.Float)
+    explanation = sa.Column(sa.Text)
+    patch = sa.Column(sa.Text)
+    tests = sa.Column(sa.Text)
+    raw = sa.Column(sa.Text)
+    error = sa.Column(sa.Text)
+    __table_args__ = (
+        sa.UniqueConstraint('run_id', 'chunk_id', 'agent'),
+        sa.Index('ix_findings_run_status_priority', 'run_id', 'status', 'priority'),
+    )
+
+Base.metadata.create_all(engine)
+
+celery_app = Celery('analysis', broker=broker_url, backend=result_backend)
+celery_app.config_from_object('app.scanner.celeryconfig')
+
+
+class RateLimiter:
+    """Fenêtre d'une seconde par modèle dans Redis: quota partagé par tous les workers."""
+
+    def __init__(self, client, limits=RATE_LIMITS):
+        self.client = client
+        self.limits = limits
+
+    async def __call__(self, model):
+        limit = self.limits.get(model)
+        if not limit:
+            return
+        while True:
+            window = int(time.time())
+            key = f"ratelimit:{model}:{window}"
+            pipe = self.client.pipeline(transaction=False)
+            pipe.incr(key)
+            pipe.expire(key, 2)
+            count, _ = await pipe.execute()
+            if count <= limit:
+                return
+            await asyncio.sleep(window + 1 - time.time())
+
+
+JSON_OBJECT = re.compile(r'\{.*\}', re.S)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return "\n".join(str(v) for v in value)
+    return str(value)
+
+def parse_finding(response):
+    """Champs de la réponse JSON de l'agent; réponse brute conservée si elle ne se lit pas."""
+    match = JSON_OBJECT.search(response or "")
+    try:
+        data = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return {
+        'severity': _number(data.get('severity')),
+        'confidence': _number(data.get('confidence')),
+        'explanation': _text(data.get('explanation')),
+        'patch': _text(data.get('patch')),
+        'tests': _text(data.get('tests')),
+        'raw': response,
+    }
+
+
+def start(scan_id, agents=AGENTS):
+    """
+    Analyse du scan: reprend celle en cours pour les mêmes agents, sinon crée
+    les lignes findings (une par chunk et agent) côté serveur.
+    """
+    agents = sorted(agents)
+    with Session() as session:
+        run = session.execute(
+            sa.select(AnalysisRun).where(AnalysisRun.scan_id == scan_id, AnalysisRun.status == 'running')
+            .order_by(AnalysisRun.id.desc())
+        ).scalars().first()
+        if run is not None and sorted(run.agents) == agents:
+            return run.id
+        # Les priorités viennent de metrics, rempli par la construction du graphe
+        scored = session.execute(
+            sa.text("SELECT 1 FROM metrics WHERE scan_id = :scan_id LIMIT 1"), {"scan_id": scan_id}).first()
+        if scored is None:
+            build_graph(scan_id)
+        run = AnalysisRun(scan_id=scan_id, agents=agents, status='running')
+        session.add(run)
+        session.flush()
+        for agent in agents:
+            session.execute(sa.text(
+                "INSERT INTO findings (run_id, scan_id, chunk_id, relpath, start_line, end_line, agent, priority, status, attempts) "
+                "SELECT :run_id, c.scan_id, c.id, c.relpath, c.start_line, c.end_line, :agent, COALESCE(m.score, 0), 'pending', 0 "
+                "FROM code_chunks c LEFT JOIN metrics m ON m.scan_id = c.scan_id AND m.file = c.relpath "
+                "WHERE c.scan_id = :scan_id"
+            ), {"run_id": run.id, "agent": agent, "scan_id": scan_id})
+        run.total = session.execute(
+            sa.select(sa.func.count()).select_from(Finding).where(Finding.run_id == run.id)).scalar()
+        session.commit()
+        return run.id
+
+
+def _claim(run_id, n):
+    """
+    Réserve jusqu'à n lignes, score de risque décroissant: en attente (hors
+    délai de nouvelle tentative), ou réclamées par un worker dont le bail a
+    expiré. SKIP LOCKED: plusieurs tâches se partagent la file sans se bloquer.
+    """
+    now = datetime.utcnow()
+    with Session() as session:
+        rows = session.execute(
+            sa.select(Finding).where(
+                Finding.run_id == run_id,
+                sa.or_(sa.and_(Finding.status == 'pending',
+                               sa.or_(Finding.not_before.is_(None), Finding.not_before <= now)),
+                       sa.and_(Finding.status == 'running', Finding.claimed_at < now - timedelta(seconds=LEASE))))
+            .order_by(Finding.priority.desc(), Finding.id).limit(n).with_for_update(skip_locked=True)
+        ).scalars().all()
+        claimed = []
+        for row in rows:
+            if row.attempts >= MAX_ATTEMPTS:
+                row.status, row.error, row.finished_at = 'failed', row.error or 'lease expired', now
+                continue
+            row.status, row.claimed_at, row.attempts = 'running', now, row.attempts + 1
+            claimed.append(row)
+        texts = {}
+        if claimed:
+            texts = dict(session.execute(
+                sa.text("SELECT id, text FROM code_chunks WHERE id IN :ids").bindparams(sa.bindparam('ids', expanding=True)),
+                {"ids": [r.chunk_id for r in claimed]}).fetchall())
+        items = [(r.id, r.agent, r.scan_id, r.attempts, texts.get(r.chunk_id)) for r in claimed]
+        session.commit()
+    return items
+
+
+def _save(finding_id, values):
+    with Session() as session:
+        session.execute(sa.update(Finding).where(Finding.id == finding_id).values(**values))
+        session.commit()
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), LEASE)
+
+
+def _next_due(run_id):
+    """Secondes avant la prochaine ligne réclamable: délai de nouvelle tentative, au plus le bail."""
+    with Session() as session:
+        due = session.execute(
+            sa.select(sa.func.min(Finding.not_before)).where(Finding.run_id == run_id, Finding.status == 'pending')
+        ).scalar()
+    if due is None:
+        return LEASE
+    return max(1, min(LEASE, int((due - datetime.utcnow()).total_seconds()) + 1))
+
+
+async def _analyze(item):
+    finding_id, agent, scan_id, attempts, text = item
+    try:
+        if not text:
+            raise ValueError("chunk text missing")
+        response = await registry.get_agent(agent).run(text, scan_id)
+        values = dict(parse_finding(response), status='done', error=None, finished_at=datetime.utcnow())
+    except Exception as e:
+        # Rejouée tant qu'il reste des tentatives, après un délai exponentiel:
+        # sinon une panne ou un quota épuise aussitôt les tentatives des
+        # lignes les plus prioritaires, réclamées en premier
+        values = {'status': 'pending' if attempts < MAX_ATTEMPTS else 'failed', 'error': repr(e)[:2000]}
+        if values['status'] == 'failed':
+            values['finished_at'] = datetime.utcnow()
+        else:
+            values['not_before'] = datetime.utcnow() + timedelta(seconds=retry_delay(attempts))
+    await asyncio.to_thread(_save, finding_id, values)
+
+
+def progress(run_id):
+    with Session() as session:
+        run = session.get(AnalysisRun, run_id)
+        if run is None:
+            return None
+        counts = dict(session.execute(
+            sa.select(Finding.status, sa.func.count()).where(Finding.run_id == run_id).group_by(Finding.status)
+        ).all())
+    done = counts.get('done', 0) + counts.get('failed', 0)
+    return {
+        'run_id': run_id,
+        'scan_id': run.scan_id,
+        'status': run.status,
+        'total': run.total or 0,
+        **{s: counts.get(s, 0) for s in ('pending', 'running', 'done', 'failed')},
+        'percent': round(100 * done / run.total, 1) if run.total else 100.0,
+    }
+
+
+def _finish_if_complete(run_id):
+    with Session() as session:
+        left = session.execute(
+            sa.select(sa.func.count()).select_from(Finding)
+            .where(Finding.run_id == run_id, Finding.status.in_(('pending', 'running')))
+        ).scalar()
+        if not left:
+            session.execute(sa.update(AnalysisRun).where(AnalysisRun.id == run_id, AnalysisRun.status == 'running')
+                            .values(status='done', finished_at=datetime.utcnow()))
+            session.commit()
+        return not left
+
+
+async def drive(run_id, concurrency=CONCURRENCY, report=None):
+    """Traite la file d'une analyse avec au plus `concurrency` chunks en cours, jusqu'à épuisement."""
+    client = registry.chat_client()
+    if client.limiter is None:
+        client.limiter = RateLimiter(aioredis.Redis.from_url(REDIS_URL))
+    in_flight = set()
+    last_report = 0.0
+    while True:
+        free = concurrency - len(in_flight)
+        items = await asyncio.to_thread(_claim, run_id, free) if free else []
+        in_flight |= {asyncio.create_task(_analyze(item)) for item in items}
+        if not in_flight:
+            break
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()  # erreur d'écriture en base: la tâche échoue et sera redistribuée
+        if report and time.monotonic() - last_report > PROGRESS_EVERY:
+            last_report = time.monotonic()
+            report(await asyncio.to_thread(progress, run_id))
+    # D'autres tâches peuvent encore avoir des lignes en cours
+    await asyncio.to_thread(_finish_if_complete, run_id)
+    return await asyncio.to_thread(progress, run_id)
+
+
+_loop = None
+
+def _run(coro):
+    # Une boucle par process worker: les clients httpx/Redis partagés y restent attachés
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def close_clients(**kwargs):
+    # Clients httpx des agents, sur la boucle où ils ont été ouverts
+    if _loop is not None:
+        _loop.run_until_complete(registry.aclose())
+
+worker_process_shutdown.connect(close_clients)
+
+
+def analyze_scan(scan_id: int, agents=AGENTS, workers: int = WORKERS):
+    """Crée (ou reprend) l'analyse du scan et lance `workers` tâches sur sa file."""
+    run_id = start(scan_id, agents)
+    for _ in range(workers):
+        drive_analysis.delay(run_id)
+    return run_id
+
+
+def drive_analysis(self, run_id: int):
+    def report(state):
+        self.update_state(state='PROGRESS', meta=state)
+    state = _run(drive(run_id, report=report))
+    if state['status'] == 'running' and state['pending'] + state['running']:
+        # Lignes en attente de nouvelle tentative, ou réclamées par d'autres (ou
+        # par un worker mort, redistribution acks_late comprise): repasser
+        # quand elles redeviennent réclamables, sinon personne ne reprendrait
+        # celles qui ne se terminent jamais
+        drive_analysis.apply_async((run_id,), countdown=_next_due(run_id))
+    return state
+
+
+celery_app.task(name="analyze_scan")(analyze_scan)
+# acks_late: une tâche perdue avec son worker est redistribuée, et reprend la file
+drive_analysis = celery_app.task(name="drive_analysis", bind=True, acks_late=True, reject_on_worker_lost=True)(drive_analysis)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse d'un scan complet par les agents")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('start', help="Crée ou reprend l'analyse et la confie aux workers Celery")
+    p.add_argument('scan_id', type=int)
+    p.add_argument('--agents', nargs='+', default=list(AGENTS), choices=list(AGENTS))
+    p.add_argument('--workers', type=int, default=WORKERS)
+    p = sub.add_parser('run', help="Traite la file dans ce process (sans Celery)")
+    p.add_argument('scan_id', type=int)
+    p.add_argument('--agents', nargs='+', default=list(AGENTS), choices=list(AGENTS))
+    p.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    p = sub.add_parser('status', help="Avancement d'une analyse")
+    p.add_argument('run_id', type=int)
+    args = parser.parse_args()
+    if args.cmd == 'start':
+        print(analyze_scan(args.scan_id, args.agents, args.workers))
+    elif args.cmd == 'run':
+        run_id = start(args.scan_id, args.agents)
+        print(json.dumps(_run(drive(run_id, args.concurrency, report=lambda s: print(json.dumps(s))))))
+    else:
+        print(json.dumps(progress(args.run_id), indent=2))
+
+if __name__ == '__main__':
+    main()
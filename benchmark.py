@@ -2,26 +2,318 @@ import time
 import tempfile
 import os
 import shutil
-from app.scanner.core import ScannerEngine
+import sys
+import json
+import random
+import hashlib
+import argparse
+import platform
+import resource
+import tracemalloc
 
-def create_mock_repo(tmpdir, n_files=10000, lines_per_file=100):
-    os.makedirs(tmpdir, exist_ok=True)
+# Synthetic sources per language: {name}/{i} are filled per file
+PY_FUNC = '''
+def {name}_{i}(items, limit={i}):
+    total = 0
+    for item in items:
+        if item > limit:
+            total += helper_{j}(item)
+        elif item % 2:
+            total -= item
+    return total
+'''
+PY_CLASS = '''
+class {Name}{i}(Base):
+    def __init__(self, value):
+        self.value = value
+
+    def compute(self, other):
+        return [x * self.value for x in other if x]
+'''
+JS_FUNC = '''
+export function {name}{i}(items, limit = {i}) {{
+  let total = 0;
+  for (const item of items) {{
+    if (item > limit) {{ total += helper{j}(item); }} else {{ total -= item; }}
+  }}
+  return total;
+}}
+'''
+TS_CLASS = '''
+export class {Name}{i} implements Service {{
+  private cache: Map<string, number> = new Map();
+  constructor(private readonly limit: number = {i}) {{}}
+  compute(items: number[]): number {{
+    return items.filter((x) => x > this.limit).reduce((a, b) => a + helper{j}(b), 0);
+  }}
+}}
+'''
+GO_FUNC = '''
+func {Name}{i}(items []int, limit int) int {{
+	total := 0
+	for _, item := range items {{
+		if item > limit {{
+			total += helper{j}(item)
+		}}
+	}}
+	return total
+}}
+'''
+HEADERS = {
+    'py': 'import os\nimport sys\nfrom .base import Base\n',
+    'js': "import { helper0 } from './util.js';\n",
+    'ts': "import { Service } from './service';\n",
+    'go': 'package main\n\nimport "fmt"\n',
+}
+BODIES = {'py': [PY_FUNC, PY_CLASS], 'js': [JS_FUNC], 'ts': [TS_CLASS], 'go': [GO_FUNC]}
+
+
+def _source(rng, ext, n_defs):
+    parts = [HEADERS[ext]]
+    for i in range(n_defs):
+        tpl = rng.choice(BODIES[ext])
+        parts.append(tpl.format(name='fn', Name='Item', i=i, j=rng.randrange(10)))
+    return ''.join(parts)
+
+
+def _deep_python(depth):
+    lines = ['def deep(x):']
+    for d in range(depth):
+        lines.append('    ' * (d + 1) + f'if x > {d}:')
+    lines.append('    ' * (depth + 1) + 'return x')
+    return '\n'.join(lines) + '\n'
+
+
+def create_corpus(root, n_files=2000, seed=0, dup_ratio=0.2, deep_ratio=0.02, large_ratio=0.01):
+    """
+    Mixed-language corpus: mostly small/medium files, some deeply nested and
+    some large ones, a share of byte-identical duplicates, plus vendored and
+    minified files that discovery should skip.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    written = []
+    stats = {'files': 0, 'bytes': 0, 'duplicates': 0, 'deep': 0, 'large': 0}
     for i in range(n_files):
-        ext = ['py', 'js', 'ts', 'go'][i % 4]
-        with open(os.path.join(tmpdir, f'f{i}.{ext}'), 'w') as f:
-            for _ in range(lines_per_file):
-                f.write('print("hello world")\n')
+        ext = rng.choice(['py', 'py', 'js', 'ts', 'go'])
+        pkg = os.path.join(root, f'pkg{i % 50}', f'mod{i % 7}')
+        os.makedirs(pkg, exist_ok=True)
+        path = os.path.join(pkg, f'f{i}.{ext}')
+        roll = rng.random()
+        if written and roll < dup_ratio:
+            src = rng.choice(written)
+            shutil.copyfile(src, os.path.join(pkg, f'f{i}.' + src.rsplit('.', 1)[1]))
+            stats['duplicates'] += 1
+            continue
+        if ext == 'py' and roll < dup_ratio + deep_ratio:
+            code = _deep_python(rng.randint(200, 400))
+            stats['deep'] += 1
+        elif roll > 1 - large_ratio:
+            code = _source(rng, ext, rng.randint(1500, 2500))
+            stats['large'] += 1
+        else:
+            code = _source(rng, ext, rng.randint(3, 40))
+        with open(path, 'w') as f:
+            f.write(code)
+        written.append(path)
+    # Noise that discovery must prune
+    os.makedirs(os.path.join(root, 'node_modules', 'lib'), exist_ok=True)
+    for i in range(200):
+        with open(os.path.join(root, 'node_modules', 'lib', f'v{i}.js'), 'w') as f:
+            f.write(JS_FUNC.format(name='v', Name='V', i=i, j=0))
+    with open(os.path.join(root, 'pkg0', 'app.min.js'), 'w') as f:
+        f.write('var a=1;' * 5000)
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            stats['files'] += 1
+            stats['bytes'] += os.path.getsize(os.path.join(dirpath, name))
+    return stats
+
+
+class StageTimer:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.results = {}
+
+    def run(self, name, func, *args):
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        out = func(*args)
+        elapsed = time.perf_counter() - start
+        entry = {'seconds': round(elapsed, 4)}
+        if self.memory:
+            entry['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+        self.results[name] = entry
+        return out
+
+
+def run_stages(root, db_url, redis_client, memory=False):
+    # Imported here so DB_URL/REDIS_URL can point at local stand-ins first
+    import lz4.frame
+    import sqlalchemy as sa
+    from app.scanner import core, ast_codec, symbols, chunker, lexical
+    from app.scanner.cache import ASTCache
+    from app.scanner.writer import ChunkWriter
+    from app.scanner.discovery import iter_source_files
+
+    timer = StageTimer(memory)
+    files = timer.run('discovery', lambda: list(iter_source_files(root, core.LANGUAGES)))
+
+    def read():
+        out = []
+        for f in files:
+            with open(f, 'rb') as fh:
+                out.append((f, fh.read()))
+        return out
+    sources = timer.run('read', read)
+
+    core.init_parser_worker()
+    trees = timer.run('parse', lambda: [core._parsers[f.rsplit('.', 1)[1]].parse(code) for f, code in sources])
+    encoded = timer.run('serialize', lambda: [ast_codec.encode_tree(t.root_node) for t in trees])
+    blobs = timer.run('compress', lambda: [lz4.frame.compress(e) for e in encoded])
+    shas = [hashlib.sha256(b).hexdigest() for b in blobs]
+    # The rest of process_file, one stage each
+    exts = [f.rsplit('.', 1)[1] for f, _ in sources]
+    extracted = timer.run('symbols', lambda: [
+        symbols.extract(core._queries[ext], tree, code) for ext, tree, (_, code) in zip(exts, trees, sources)])
+    asts = [ast_codec.CompactAST(e) for e in encoded]
+    complexity = timer.run('complexity', lambda: [symbols.cyclomatic(ast) for ast in asts])
+    code_chunks = timer.run('chunk', lambda: [chunker.split(ast, code) for ast, (_, code) in zip(asts, sources)])
+    terms = timer.run('lexical', lambda: [lexical.pack(lexical.terms(code)) for _, code in sources])
+
+    if redis_client is not None:
+        cache = ASTCache(redis_client, namespace='bench')
+
+        def fill_cache():
+            for sha, blob in zip(shas, blobs):
+                cache.put(sha, blob)
+            cache.flush()
+        timer.run('cache', fill_cache)
+        timer.run('cache_warm', fill_cache)
+        timer.results['cache_warm']['stats'] = cache.stats()
+
+    db = sa.create_engine(db_url)
+    core.Base.metadata.create_all(db)
+
+    relpaths = [os.path.relpath(f, root) for f, _ in sources]
+
+    def write_db():
+        with ChunkWriter(db, core.ASTChunk.__table__, {'scan_id': 0}) as writer:
+            for i, (f, code) in enumerate(sources):
+                writer.write({
+                    'file_sha256': shas[i],
+                    'compressed_ast': blobs[i],
+                    'relpath': relpaths[i],
+                    'lang': core.LANGUAGES[exts[i]],
+                    'n_lines': code.count(b'\n'),
+                    'content_sha256': hashlib.sha256(code).hexdigest(),
+                    'complexity': complexity[i],
+                    'lexical': terms[i],
+                    'n_code_chunks': len(code_chunks[i]),
+                })
+    timer.run('db', write_db)
+
+    def write_rows(table, rows):
+        # One ChunkWriter per table, as in ScannerEngine.run
+        with ChunkWriter(db, table, {'scan_id': 0}) as writer:
+            for row in rows:
+                writer.write(row)
+    timer.run('db_symbols', write_rows, core.Symbol.__table__,
+              (dict(sym, relpath=rel) for rel, (syms, _) in zip(relpaths, extracted) for sym in syms))
+    timer.run('db_edges', write_rows, core.Edge.__table__,
+              (dict(edge, relpath=rel) for rel, (_, edges) in zip(relpaths, extracted) for edge in edges))
+    timer.run('db_code_chunks', write_rows, core.CodeChunk.__table__,
+              (dict(chunk, relpath=rel) for rel, chunks in zip(relpaths, code_chunks) for chunk in chunks))
+
+    raw_bytes = sum(len(code) for _, code in sources)
+    encoded_bytes = sum(len(e) for e in encoded)
+    compressed_bytes = sum(len(b) for b in blobs)
+    timer.results['discovery']['files'] = len(files)
+    timer.results['read']['bytes'] = raw_bytes
+    timer.results['serialize']['bytes'] = encoded_bytes
+    timer.results['compress']['bytes'] = compressed_bytes
+    timer.results['symbols']['symbols'] = sum(len(syms) for syms, _ in extracted)
+    timer.results['symbols']['edges'] = sum(len(edges) for _, edges in extracted)
+    timer.results['chunk']['chunks'] = sum(len(chunks) for chunks in code_chunks)
+    return timer.results
+
+
+def compare(report, baseline, threshold, min_seconds=0.1, min_delta=0.05):
+    """
+    Stages whose time grew by more than `threshold` (relative) vs baseline.
+    Stages under `min_seconds` on both sides, or slower by less than
+    `min_delta` seconds, are timer noise and never count.
+    """
+    regressions = []
+    for stage, entry in report['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if not old or not old.get('seconds'):
+            continue
+        if max(old['seconds'], entry['seconds']) < min_seconds or entry['seconds'] - old['seconds'] < min_delta:
+            continue
+        ratio = entry['seconds'] / old['seconds']
+        if ratio > 1 + threshold:
+            regressions.append({'stage': stage, 'before': old['seconds'], 'after': entry['seconds'], 'ratio': round(ratio, 2)})
+    return regressions
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Stage-level scanner benchmark")
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true', help='Record peak allocations per stage (slower)')
+    parser.add_argument('--db-url', help='Defaults to a temporary SQLite file')
+    parser.add_argument('--redis-url', help='Defaults to fakeredis (cache stages skipped if not installed)')
+    parser.add_argument('--output', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='Previous JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--min-seconds', type=float, default=0.1, help='Ignore stages faster than this on both runs')
+    parser.add_argument('--min-delta', type=float, default=0.05, help='Ignore slowdowns smaller than this (seconds)')
+    args = parser.parse_args()
+
     tmpdir = tempfile.mkdtemp()
     try:
-        create_mock_repo(tmpdir, n_files=10000, lines_per_file=100)
-        engine = ScannerEngine(repo_url='mock')
-        start = time.time()
-        scan_id = engine.run(tmpdir)
-        elapsed = time.time() - start
-        total_lines = 10000 * 100
-        print(f"Scanned {total_lines} lines in {elapsed:.2f} seconds ({total_lines/elapsed:.2f} lines/s)")
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        os.environ['DB_URL'] = db_url
+        skipped = []
+        if args.redis_url:
+            import redis
+            redis_client = redis.Redis.from_url(args.redis_url)
+        else:
+            try:
+                import fakeredis
+                redis_client = fakeredis.FakeRedis()
+            except ImportError:
+                # Optional: the cache stages need a Redis, real or fake
+                redis_client = None
+                skipped = ['cache', 'cache_warm']
+        root = os.path.join(tmpdir, 'repo')
+        corpus = create_corpus(root, n_files=args.files, seed=args.seed)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stages = run_stages(root, db_url, redis_client, memory=args.memory)
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': dict(corpus, seed=args.seed),
+            'stages': stages,
+            'total_seconds': round(sum(s['seconds'] for s in stages.values()), 4),
+            'max_rss_mb': round(max(rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) / 1024, 1),
+        }
+        if skipped:
+            report['skipped'] = {stage: 'fakeredis not installed, pass --redis-url' for stage in skipped}
+        if args.baseline:
+            with open(args.baseline) as f:
+                report['regressions'] = compare(report, json.load(f), args.threshold, args.min_seconds, args.min_delta)
+        out = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(out)
+        else:
+            print(out)
+        if report.get('regressions'):
+            sys.exit(1)
     finally:
         shutil.rmtree(tmpdir)
 
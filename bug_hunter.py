@@ -1,27 +1,23 @@
-import yaml
-import openai
-from langchain.llms import OpenAI, Together
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.retrievers import GoogleSearchAPIRetriever
-import os
+from app.ml import rag
+from . import registry, llm_cache
 
 class BugHunterAgent:
     def __init__(self):
-        with open(os.path.join(os.path.dirname(__file__), 'prompts', 'bug_hunter.yaml'), encoding='utf-8') as f:
-            self.prompt = yaml.safe_load(f)
-        self.llm = OpenAI(model="gpt-4.1", temperature=0.1)
-        self.fallback_llm = Together(model="mixtral-8x22b", api_key=os.getenv("TOGETHER_KEY"))
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self.retriever = GoogleSearchAPIRetriever(top_k=10, freshness_days=365, api_key=os.getenv("GOOGLE_KEY"))
+        # Prompt et client LLM partagés par le process (voir registry)
+        self.prompt = registry.prompt('bug_hunter')
+        self.llm = registry.chat_client()
 
-    async def run(self, code: str):
-        # RAG: recherche web + embeddings
-        docs = self.retriever.retrieve(query=code)
-        context = "\n".join([d['snippet'] for d in docs])
+    async def run(self, code: str, scan_id: int = None):
+        # Même code, même prompt, même modèle: réponse reprise du cache (autres scans, autres utilisateurs)
+        return await llm_cache.cached_run(
+            'bug_hunter', registry.prompt_version('bug_hunter'), self.llm.model, code,
+            lambda: self._analyze(code, scan_id), upgrade=self.llm.primary_healthy)
+
+    async def _analyze(self, code, scan_id):
+        # RAG: index local du scan; pas de web, le code ne sort pas
+        context = await rag.context_for(code, scan_id, web=False)
         user_prompt = self.prompt['user'].replace('{code}', code)
         full_prompt = f"{self.prompt['system']}\n{user_prompt}\nContexte:\n{context}"
-        try:
-            resp = self.llm(full_prompt)
-        except Exception:
-            resp = self.fallback_llm(full_prompt)
-        return resp
+        used = [self.llm.model]
+        resp = await self.llm.complete(full_prompt, temperature=0.1, on_model=used.append)
+        return resp, used[-1]
@@ -4,6 +4,11 @@ from sqlalchemy.orm import sessionmaker
 import json
 from graphviz import Digraph
 from collections import defaultdict
+import posixpath
+from datetime import datetime
+from app.scanner import ast_codec, migrations, symbols as scan_symbols
+from .analytics import analyze
+from .resolve import suffix_index, resolve_import
 
 DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
 engine = sa.create_engine(DB_URL)
@@ -18,45 +23,83 @@ class Metric(Base):
     scan_id = sa.Column(sa.Integer)
     file = sa.Column(sa.String)
     score = sa.Column(sa.Float)
+    complexity = sa.Column(sa.Integer)
+    fan_in = sa.Column(sa.Integer)
+    fan_out = sa.Column(sa.Integer)
+    pagerank = sa.Column(sa.Float)
+    scc_size = sa.Column(sa.Integer)  # taille du cycle d'imports contenant le fichier (1 = aucun)
+
+class GraphStats(Base):
+    __tablename__ = 'graph_stats'
+    scan_id = sa.Column(sa.Integer, primary_key=True)
+    stats = sa.Column(sa.JSON)
+    created_at = sa.Column(sa.DateTime, default=datetime.utcnow)
 Base.metadata.create_all(engine)
+migrations.upgrade(engine)  # colonnes ajoutées à metrics depuis sa création
+
+def build_graph(scan_id: int, persist: bool = True):
+    """
+    Construit le graphe pour un scan donné à partir des tables symbols/edges
+    remplies pendant le scan (aucun AST n'est décompressé), et enregistre ses
+    métriques si persist. Retourne (dot_str, json_dict)
+    """
+    dot_str, json_dict, rows, stats = compute_graph(scan_id)
+    if persist:
+        store_metrics(scan_id, rows, stats)
+    return dot_str, json_dict
 
-def build_graph(scan_id: int):
+def compute_graph(scan_id: int):
     """
-    Construit le graphe pour un scan donné.
-    Retourne (dot_str, json_dict)
+    Graphe et métriques d'un scan, sans rien écrire (scan en cours).
+    Retourne (dot_str, json_dict, rows, stats), rows/stats comme analyze.
     """
     session = Session()
-    # Récupère les AST compressés pour le scan
-    ast_chunks = session.execute(
-        sa.text("SELECT relpath, compressed_ast FROM ast_chunks WHERE scan_id=:scan_id"),
-        {"scan_id": scan_id}
-    ).fetchall()
-    nodes = set()
+    params = {"scan_id": scan_id}
+    chunks = session.execute(
+        sa.text("SELECT relpath, complexity FROM ast_chunks WHERE scan_id=:scan_id"), params).fetchall()
+    files = [r[0] for r in chunks]
+    symbols = session.execute(
+        sa.text("SELECT relpath, kind, name, qualname FROM symbols WHERE scan_id=:scan_id"), params).fetchall()
+    raw_edges = session.execute(
+        sa.text("SELECT relpath, src, dst, kind FROM edges WHERE scan_id=:scan_id"), params).fetchall()
+    nodes = {relpath: 'file' for relpath in files}
     edges = []
     d3_nodes = []
     d3_links = []
-    # Simulé: parse AST, extraire fichiers/classes/fonctions et relations
-    for row in ast_chunks:
-        relpath = row[0]
-        nodes.add((relpath, 'file'))
-        # Simule extraction classes/fonctions
-        for i in range(2):
-            cname = f"Class_{i}_{relpath}"
-            nodes.add((cname, 'class'))
-            edges.append((relpath, cname, 'contains'))
-            for j in range(2):
-                fname = f"func_{j}_{cname}"
-                nodes.add((fname, 'function'))
-                edges.append((cname, fname, 'contains'))
-                # Simule appel/call
-                if j == 1:
-                    edges.append((fname, f"func_0_{cname}", 'call'))
-        # Simule import
-        if relpath.endswith('1.py'):
-            edges.append((relpath, 'file2.py', 'import'))
+    local = {}
+    by_name = defaultdict(list)
+    for relpath, kind, name, qualname in symbols:
+        node_id = f"{relpath}::{qualname}"
+        nodes[node_id] = kind
+        local.setdefault((relpath, name), node_id)
+        by_name[name].append(node_id)
+    # contains: fichier -> définition de premier niveau, classe -> méthode
+    for relpath, kind, name, qualname in symbols:
+        parent = f"{relpath}::{qualname.rpartition('.')[0]}"
+        edges.append((parent if parent in nodes else relpath, f"{relpath}::{qualname}", 'contains'))
+    suffixes = suffix_index(files)
+    packages = defaultdict(list)
+    for relpath in files:
+        if relpath.endswith('.go'):
+            packages[posixpath.dirname(relpath)].append(relpath)
+    seen = set()
+    for relpath, src, dst, kind in raw_edges:
+        source = f"{relpath}::{src}" if src else relpath
+        if kind == 'call':
+            # même fichier d'abord, sinon nom unique dans le scan
+            target = local.get((relpath, dst))
+            if target is None and len(by_name.get(dst, ())) == 1:
+                target = by_name[dst][0]
+            targets = [target] if target else []
+        else:
+            targets = [t for t in resolve_import(relpath, dst, suffixes, packages) if t != relpath]
+        for target in targets:
+            if source in nodes and (source, target, kind) not in seen:
+                seen.add((source, target, kind))
+                edges.append((source, target, kind))
     # DOT
     dot = Digraph('G')
-    for n, t in nodes:
+    for n, t in nodes.items():
         shape = {'file': 'box', 'class': 'ellipse', 'function': 'diamond'}.get(t, 'oval')
         dot.node(n, shape=shape)
         d3_nodes.append({'id': n, 'type': t})
@@ -65,11 +108,34 @@ def build_graph(scan_id: int):
         d3_links.append({'source': src, 'target': tgt, 'type': typ})
     dot_str = dot.source
     json_dict = {'nodes': d3_nodes, 'links': d3_links}
-    # Calculs metrics (simulé)
-    for n, t in nodes:
-        if t == 'file':
-            score = 1.0  # Simulé: complexité
-            m = Metric(scan_id=scan_id, file=n, score=score)
-            session.add(m)
-    session.commit()
-    return dot_str, json_dict
+    # Métriques par fichier et stats du graphe
+    rows, stats = analyze(files, edges, _complexity(session, scan_id, chunks))
+    session.close()
+    return dot_str, json_dict, rows, stats
+
+def store_metrics(scan_id, rows, stats):
+    """Remplacent celles d'un build précédent."""
+    session = Session()
+    try:
+        session.query(Metric).filter_by(scan_id=scan_id).delete()
+        if rows:
+            session.execute(sa.insert(Metric), [dict(r, scan_id=scan_id) for r in rows])
+        session.merge(GraphStats(scan_id=scan_id, stats=stats))
+        session.commit()
+    finally:
+        session.close()
+
+def _complexity(session, scan_id, chunks):
+    """
+    Complexité calculée au scan; les chunks antérieurs (NULL) sont
+    recalculés depuis leur AST compressé.
+    """
+    missing = [relpath for relpath, value in chunks if value is None]
+    computed = {}
+    if missing:
+        rows = session.execute(
+            sa.text("SELECT relpath, compressed_ast FROM ast_chunks WHERE scan_id=:scan_id AND complexity IS NULL"),
+            {"scan_id": scan_id})
+        for relpath, blob in rows:
+            computed[relpath] = scan_symbols.cyclomatic(ast_codec.loads(blob))
+    return [value if value is not None else computed.get(relpath, 1) for relpath, value in chunks]
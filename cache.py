@@ -0,0 +1,128 @@
+import os
+import time
+from .telemetry import timed_write
+
+CACHE_TTL = int(os.getenv("AST_CACHE_TTL", 7 * 24 * 3600))  # 0 = no expiry
+CACHE_MAX_BYTES = int(os.getenv("AST_CACHE_MAX_BYTES", 0))  # 0 = no size budget
+CACHE_BATCH = int(os.getenv("AST_CACHE_BATCH", 500))
+EVICT_BATCH = 256
+
+
+class ASTCache:
+    """
+    Write-behind Redis cache for compressed ASTs.
+
+    Writes are buffered and flushed in pipelines: one round trip checks which
+    keys already exist, a second stores only the new ones (SET NX + TTL) and
+    refreshes the TTL of the rest. With a size budget, entries are tracked in
+    a sorted set by last access and the least recently used are evicted once
+    the budget is exceeded. Hit/miss/eviction counters live in a Redis hash so
+    they add up across workers.
+
+    `client` is any redis-py compatible client (fakeredis works for tests).
+    """
+
+    def __init__(self, client, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, batch_size=CACHE_BATCH, namespace='astcache'):
+        self.client = client
+        self.ttl = ttl or None
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.lru_key = f"{namespace}:lru"
+        self.sizes_key = f"{namespace}:sizes"
+        self.bytes_key = f"{namespace}:bytes"
+        self.stats_key = f"{namespace}:stats"
+        self._pending = {}
+
+    def put(self, key, value):
+        self._pending[key] = value
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return 0
+        with timed_write('redis'):
+            return self._flush()
+
+    def _flush(self):
+        items, self._pending = list(self._pending.items()), {}
+        pipe = self.client.pipeline(transaction=False)
+        for key, _ in items:
+            pipe.exists(key)
+        exists = pipe.execute()
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        new = []
+        for (key, value), present in zip(items, exists):
+            if present:
+                if self.ttl:
+                    pipe.expire(key, self.ttl)
+                if self.max_bytes:
+                    pipe.zadd(self.lru_key, {key: now}, xx=True)
+            else:
+                new.append((key, value, len(pipe)))
+                pipe.set(key, value, ex=self.ttl, nx=True)
+        results = pipe.execute()
+        # Only SETs that won count as writes (another worker may have raced us)
+        written = [(key, value) for key, value, pos in new if results[pos]]
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(self.stats_key, 'writes', len(written))
+        pipe.hincrby(self.stats_key, 'skipped', len(items) - len(written))
+        if self.max_bytes and written:
+            pipe.zadd(self.lru_key, {key: now for key, _ in written})
+            pipe.hset(self.sizes_key, mapping={key: len(value) for key, value in written})
+            pipe.incrby(self.bytes_key, sum(len(value) for _, value in written))
+        pipe.execute()
+        if self.max_bytes:
+            self._evict()
+        return len(written)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self.client.mget(keys)
+        hits = [k for k, v in zip(keys, values) if v is not None]
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(self.stats_key, 'hits', len(hits))
+        pipe.hincrby(self.stats_key, 'misses', len(keys) - len(hits))
+        if self.max_bytes and hits:
+            pipe.zadd(self.lru_key, {k: time.time() for k in hits}, xx=True)
+        pipe.execute()
+        return values
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def _evict(self):
+        used = int(self.client.get(self.bytes_key) or 0)
+        evicted = 0
+        while used > self.max_bytes:
+            victims = self.client.zrange(self.lru_key, 0, EVICT_BATCH - 1)
+            if not victims:
+                break
+            sizes = self.client.hmget(self.sizes_key, victims)
+            freed = 0
+            for n, size in enumerate(sizes, 1):
+                freed += int(size or 0)
+                if used - freed <= self.max_bytes:
+                    victims = victims[:n]
+                    break
+            pipe = self.client.pipeline(transaction=False)
+            pipe.delete(*victims)
+            pipe.zrem(self.lru_key, *victims)
+            pipe.hdel(self.sizes_key, *victims)
+            pipe.decrby(self.bytes_key, freed)
+            pipe.hincrby(self.stats_key, 'evictions', len(victims))
+            pipe.execute()
+            used -= freed
+            evicted += len(victims)
+        return evicted
+
+    def stats(self):
+        raw = self.client.hgetall(self.stats_key)
+        stats = {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in raw.items()}
+        for name in ('hits', 'misses', 'evictions', 'writes', 'skipped'):
+            stats.setdefault(name, 0)
+        if self.max_bytes:
+            stats['bytes'] = int(self.client.get(self.bytes_key) or 0)
+        return stats
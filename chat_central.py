@@ -1,14 +1,14 @@
 import asyncio
 import json
 import os
+from contextlib import aclosing
 import sqlalchemy as sa
 from fastapi import WebSocket, WebSocketDisconnect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
-from langchain.llms import OpenAI, Together
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.retrievers import GoogleSearchAPIRetriever
+from app.ml import rag
+from . import registry
 import threading
 import time
 
@@ -61,61 +61,74 @@ class Throttle:
 
 throttle = Throttle(rate=10)
 
+# Coût estimé par token
+COST_PER_TOKEN = {"gpt-4.1": 0.00001, "mixtral-8x22b": 0.000002}
+
 class ChatCentralAgent:
+    # Partagé par toutes les connexions (registry): aucun état par conversation ici
     def __init__(self):
-        self.llm = OpenAI(model="gpt-4.1", temperature=0.2)
-        self.fallback_llm = Together(model="mixtral-8x22b", api_key=os.getenv("TOGETHER_KEY"))
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self.retriever = GoogleSearchAPIRetriever(top_k=10, freshness_days=365, api_key=os.getenv("GOOGLE_KEY"))
-        self.session = Session()
-
-    async def run(self, session_id: str, message: str):
-        chat = self.session.query(Chat).filter_by(session_id=session_id).first()
-        if not chat:
-            chat = Chat(session_id=session_id)
-            self.session.add(chat)
-            self.session.commit()
-        msg = Message(chat_id=chat.id, sender="user", content=message)
-        self.session.add(msg)
-        self.session.commit()
-        # RAG
-        docs = self.retriever.retrieve(query=message)
-        context = "\n".join([d['snippet'] for d in docs])
+        self.llm = registry.chat_client()
+
+    def _open_exchange(self, session_id, message):
+        with Session() as session:
+            chat = session.query(Chat).filter_by(session_id=session_id).first()
+            if not chat:
+                chat = Chat(session_id=session_id)
+                session.add(chat)
+                session.commit()
+            chat_id = chat.id
+            session.add(Message(chat_id=chat_id, sender="user", content=message))
+            session.commit()
+        return chat_id
+
+    def _record_answer(self, chat_id, resp, model, n_tokens, cost):
+        with Session() as session:
+            session.add(Message(chat_id=chat_id, sender="ai", content=resp))
+            session.add(Usage(model=model, tokens=n_tokens, cost_usd=cost))
+            session.commit()
+
+    async def stream(self, session_id: str, message: str, scan_id: int = None):
+        """
+        Tokens de la réponse dès leur arrivée; l'échange est enregistré à la fin.
+        Base synchrone dans un thread: la boucle sert les autres connexions.
+        """
+        chat_id = await asyncio.to_thread(self._open_exchange, session_id, message)
+        # RAG: index local du scan, web seulement si la question le demande
+        context = await rag.context_for(message, scan_id, web='auto')
         prompt = f"{message}\nContexte:\n{context}"
-        model = "gpt-4.1"
-        if not throttle.allow(model):
+        if not throttle.allow(self.llm.model):
             await asyncio.sleep(0.1)
-        try:
-            resp = self.llm(prompt)
-            tokens = len(prompt.split()) + len(str(resp).split())
-            cost = tokens * 0.00001  # Estimation simple
-        except Exception:
-            model = "mixtral-8x22b"
-            if not throttle.allow(model):
-                await asyncio.sleep(0.1)
-            resp = self.fallback_llm(prompt)
-            tokens = len(prompt.split()) + len(str(resp).split())
-            cost = tokens * 0.000002
-        msg2 = Message(chat_id=chat.id, sender="ai", content=resp)
-        self.session.add(msg2)
-        self.session.add(Usage(model=model, tokens=tokens, cost_usd=cost))
-        self.session.commit()
-        return resp
+        used = [self.llm.model]
+        tokens = []
+        # aclosing: un client parti (aclose de ce générateur) coupe aussi le flux SSE amont
+        async with aclosing(self.llm.stream(prompt, temperature=0.2, on_model=used.append)) as upstream:
+            async for token in upstream:
+                tokens.append(token)
+                yield token
+        resp = "".join(tokens)
+        model = used[-1]
+        n_tokens = len(prompt.split()) + len(resp.split())
+        cost = n_tokens * COST_PER_TOKEN.get(model, 0.00001)  # Estimation simple
+        await asyncio.to_thread(self._record_answer, chat_id, resp, model, n_tokens, cost)
+
+    async def run(self, session_id: str, message: str, scan_id: int = None):
+        return "".join([token async for token in self.stream(session_id, message, scan_id)])
 
 # WebSocket endpoint (FastAPI example)
 from fastapi import APIRouter
 router = APIRouter()
 
 @router.websocket("/ws/chat/{session_id}")
-async def chat_ws(websocket: WebSocket, session_id: str):
+async def chat_ws(websocket: WebSocket, session_id: str, scan_id: int = None):
     await websocket.accept()
-    agent = ChatCentralAgent()
+    agent = registry.get_agent('chat')
     try:
         while True:
             data = await websocket.receive_text()
-            resp = await agent.run(session_id, data)
-            # Streaming chunk (simulate)
-            for chunk in [resp[i:i+50] for i in range(0, len(resp), 50)]:
-                await websocket.send_text(chunk)
+            # Chaque token part dès qu'il arrive du modèle; déconnexion en
+            # cours de réponse: aclose() annule la requête au modèle
+            async with aclosing(agent.stream(session_id, data, scan_id)) as tokens:
+                async for token in tokens:
+                    await websocket.send_text(token)
     except WebSocketDisconnect:
-        await websocket.close()
+        pass
@@ -0,0 +1,169 @@
+"""
+Function- and class-level chunks of source text for embeddings.
+
+The file is split along its AST: top-level definitions become their own
+chunks, oversized nodes are split into their children, and consecutive
+small statements are merged up to the token budget. Every chunk keeps its
+1-based line range in the file.
+"""
+import os
+import hashlib
+
+MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 512))
+CHARS_PER_TOKEN = 4  # rough estimate, good enough to stay under model limits
+
+# Definition nodes of the grammars we parse, and their symbol kind
+DEFINITIONS = {
+    'function_definition': 'function',
+    'class_definition': 'class',
+    'function_declaration': 'function',
+    'generator_function_declaration': 'function',
+    'method_definition': 'function',
+    'method_declaration': 'function',
+    'class_declaration': 'class',
+    'abstract_class_declaration': 'class',
+    'interface_declaration': 'class',
+    'type_declaration': 'class',
+    'type_spec': 'class',
+}
+# Nodes that wrap a definition (decorators, `export`)
+WRAPPERS = frozenset({'decorated_definition', 'export_statement'})
+# Bodies of definitions: what comes before them is the header (`def f(x):`)
+BODIES = frozenset({
+    'block', 'class_body', 'statement_block', 'interface_body', 'object_type',
+    'field_declaration_list', 'struct_type', 'interface_type',
+})
+NAME_TYPES = frozenset({'identifier', 'type_identifier', 'property_identifier', 'field_identifier'})
+
+
+def _definition(ast, i):
+    """Index of the definition node at i (unwrapping decorators/exports), or None."""
+    t = ast.type(i)
+    if t in DEFINITIONS:
+        return i
+    if t in WRAPPERS:
+        for c in ast.children(i):
+            if ast.type(c) in DEFINITIONS:
+                return c
+    return None
+
+
+def _name(ast, code, i):
+    for c in ast.children(i):
+        if ast.type(c) in NAME_TYPES:
+            return code[ast.start_byte[c]:ast.end_byte[c]].decode('utf-8', 'replace')
+    for c in ast.children(i):
+        if ast.type(c) in DEFINITIONS:
+            return _name(ast, code, c)
+    return ''
+
+
+def _header(ast, children):
+    # Number of leading children before the body (or wrapped definition)
+    for n, c in enumerate(children):
+        if ast.type(c) in BODIES or _definition(ast, c) is not None:
+            return n
+    return 0
+
+
+def _pieces(ast, code, budget):
+    """
+    Nodes in source order that fit the budget (or cannot be split further),
+    as (node, definition or None, scope, head). The root is always split so
+    that each definition gets its own chunk. scope is the innermost split
+    definition around the node (None at module level); head is set on the
+    first piece of a split definition, to the node where its header starts.
+    """
+    pieces = []
+    stack = [(0, None)]
+    head = None
+    while stack:
+        i, scope = stack.pop()
+        d = _definition(ast, i)
+        children = list(ast.children(i))
+        if i and (ast.end_byte[i] - ast.start_byte[i] <= budget or not children):
+            # Whitespace tokens (Go's '\n') would join the definitions around them
+            if ast.named[i] or code[ast.start_byte[i]:ast.end_byte[i]].strip():
+                pieces.append((i, d, scope, head))
+                head = None
+            continue
+        if i and d is not None:
+            # The header goes with the first piece of the body
+            n = _header(ast, children)
+            if n:
+                children = children[n:]
+                head = i if head is None else head
+            scope = i
+        # Children pushed in reverse so they pop in source order
+        stack.extend((c, scope) for c in reversed(children))
+    return pieces
+
+
+def _label(ast, code, i, d):
+    # Kind and name of the piece, or of the innermost definition around it
+    while d is None:
+        i = ast.parent[i]
+        if i < 0:
+            return 'module', ''
+        d = _definition(ast, i)
+    return DEFINITIONS[ast.type(d)], _name(ast, code, d)
+
+
+def _windows(lines, start, end, budget):
+    # Line windows of an oversized chunk (a long literal, a minified line, ...)
+    first, size = start, 0
+    for row in range(start, end + 1):
+        n = len(lines[row]) + 1
+        if size and size + n > budget:
+            yield first, row - 1
+            first, size = row, 0
+        size += n
+    yield first, end
+
+
+def split(ast, code, max_tokens=MAX_TOKENS):
+    """
+    Chunks of one file as dicts: start_line/end_line (1-based, inclusive),
+    kind, name, text, chunk_sha256 and n_tokens. `ast` is the file's
+    CompactAST, `code` its raw bytes.
+    """
+    if not len(ast):
+        return []
+    budget = max_tokens * CHARS_PER_TOKEN
+    lines = code.split(b'\n')
+    spans = []  # [start_row, end_row, size, is_definition, first piece, scope, header only]
+    for i, d, scope, head in _pieces(ast, code, budget):
+        first = head if head is not None else i
+        start, end = ast.start_row[first], ast.end_row[i]
+        size = ast.end_byte[i] - ast.start_byte[first]
+        cur = spans[-1] if spans else None
+        # Definitions start a chunk; statements of the same scope are merged up to the budget.
+        # A header (and its punctuation, `{`) is kept with whatever comes next.
+        if cur and (start <= cur[1] or cur[6] or (
+                head is None and d is None and not cur[3] and cur[5] == scope and cur[2] + size <= budget)):
+            cur[1] = max(cur[1], end)
+            cur[2] += size
+            cur[6] = cur[6] and not ast.named[i]
+        elif head is not None:
+            # First chunk of a split definition, labelled after it
+            spans.append([start, end, size, False, (head, _definition(ast, head)), scope, not ast.named[i]])
+        else:
+            spans.append([start, end, size, d is not None, (i, d), scope, False])
+    chunks = []
+    for start, end, size, _, (i, d), _, _ in spans:
+        kind, name = _label(ast, code, i, d)
+        for first, last in _windows(lines, start, end, budget) if size > budget else [(start, end)]:
+            # NUL bytes are not valid in a PostgreSQL text column
+            text = b'\n'.join(lines[first:last + 1]).decode('utf-8', 'replace').replace('\0', '')
+            if not text.strip():
+                continue
+            chunks.append({
+                'start_line': first + 1,
+                'end_line': last + 1,
+                'kind': kind,
+                'name': name,
+                'text': text,
+                'chunk_sha256': hashlib.sha256(text.encode()).hexdigest(),
+                'n_tokens': len(text) // CHARS_PER_TOKEN + 1,
+            })
+    return chunks
@@ -9,11 +9,12 @@ import git
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--repo', required=True, help='Git repo URL')
+    parser.add_argument('--full', action='store_true', help='Re-parse every file, even unchanged ones')
     args = parser.parse_args()
     tmpdir = tempfile.mkdtemp()
     try:
         git.Repo.clone_from(args.repo, tmpdir, depth=1, multi_options=['--filter=blob:none'])
-        engine = ScannerEngine(args.repo)
+        engine = ScannerEngine(args.repo, incremental=not args.full)
         scan_id = engine.run(tmpdir)
         print(json.dumps({'scan_id': scan_id}))
     finally:
@@ -1,19 +1,25 @@
 import os
-import tempfile
-import shutil
 import hashlib
-import multiprocessing as mp
-import lz4.frame
 import redis
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
-import git
-import glob
-import importlib
+import itertools
 import json
+import base64
+import time
+import threading
+import lz4.frame
+from datetime import datetime
 from tree_sitter import Language, Parser
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 from .celeryconfig import *
+from . import ast_codec, pool, symbols, lexical, chunker, migrations
+from .writer import ChunkWriter
+from .cache import ASTCache
+from .discovery import iter_source_files
+from . import telemetry
+from .telemetry import stage, timed_iter
 
 # --- SQLAlchemy setup ---
 DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
@@ -33,6 +39,16 @@ class Scan(Base):
     id = sa.Column(sa.Integer, primary_key=True)
     repo_url = sa.Column(sa.String, nullable=False)
     status = sa.Column(sa.String, default='done')
+    # Per-scan summary, filled in when the scan finishes
+    started_at = sa.Column(sa.DateTime, default=datetime.utcnow)
+    finished_at = sa.Column(sa.DateTime)
+    n_files = sa.Column(sa.Integer)
+    n_parsed = sa.Column(sa.Integer)
+    n_reused = sa.Column(sa.Integer)
+    raw_bytes = sa.Column(sa.BigInteger)
+    ast_bytes = sa.Column(sa.BigInteger)
+    compressed_bytes = sa.Column(sa.BigInteger)
+    timings = sa.Column(sa.JSON)
 
 class ASTChunk(Base):
     __tablename__ = 'ast_chunks'
@@ -43,8 +59,58 @@ class ASTChunk(Base):
     relpath = sa.Column(sa.String)
     lang = sa.Column(sa.String)
     n_lines = sa.Column(sa.Integer)
+    content_sha256 = sa.Column(sa.String, index=True)
+    complexity = sa.Column(sa.Integer)  # cyclomatic, see symbols.cyclomatic
+    lexical = sa.Column(sa.LargeBinary)  # packed term counts, see lexical.terms
+    n_code_chunks = sa.Column(sa.Integer)  # NULL: parsed before code_chunks existed
+
+class Symbol(Base):
+    __tablename__ = 'symbols'
+    id = sa.Column(sa.Integer, primary_key=True)
+    scan_id = sa.Column(sa.Integer, sa.ForeignKey('scans.id'), index=True)
+    relpath = sa.Column(sa.String)
+    kind = sa.Column(sa.String(16))
+    name = sa.Column(sa.String)
+    qualname = sa.Column(sa.String)
+    start_line = sa.Column(sa.Integer)
+    end_line = sa.Column(sa.Integer)
+    __table_args__ = (sa.Index('ix_symbols_scan_name', 'scan_id', 'name'),)
+
+class Edge(Base):
+    __tablename__ = 'edges'
+    id = sa.Column(sa.Integer, primary_key=True)
+    scan_id = sa.Column(sa.Integer, sa.ForeignKey('scans.id'), index=True)
+    relpath = sa.Column(sa.String)
+    src = sa.Column(sa.String)  # qualname in relpath, '' for module level
+    dst = sa.Column(sa.String)  # raw import path or callee name
+    kind = sa.Column(sa.String(16))
+    __table_args__ = (sa.Index('ix_edges_scan_kind', 'scan_id', 'kind'),)
+
+class CodeChunk(Base):
+    # Source text of one definition (or run of statements) within a token budget, see chunker
+    __tablename__ = 'code_chunks'
+    id = sa.Column(sa.Integer, primary_key=True)
+    scan_id = sa.Column(sa.Integer, sa.ForeignKey('scans.id'))
+    relpath = sa.Column(sa.String)
+    start_line = sa.Column(sa.Integer)
+    end_line = sa.Column(sa.Integer)
+    kind = sa.Column(sa.String(16))
+    name = sa.Column(sa.String)
+    chunk_sha256 = sa.Column(sa.String, index=True)
+    n_tokens = sa.Column(sa.Integer)
+    text = sa.Column(sa.Text)
+    __table_args__ = (sa.Index('ix_code_chunks_scan_relpath', 'scan_id', 'relpath'),)
+
+class LexicalIndexRow(Base):
+    # One BM25 index per scan, built from ast_chunks.lexical when the scan ends
+    __tablename__ = 'lexical_index'
+    scan_id = sa.Column(sa.Integer, sa.ForeignKey('scans.id'), primary_key=True)
+    body = sa.Column(sa.LargeBinary)
+    created_at = sa.Column(sa.DateTime, default=datetime.utcnow)
 
 Base.metadata.create_all(engine)
+# create_all never alters existing tables: columns added since are migrated here
+migrations.upgrade(engine)
 
 # --- Tree-sitter setup ---
 LANGUAGES = {
@@ -73,81 +139,334 @@ TS_LANGS = {
 celery_app = Celery('scanner', broker=broker_url, backend=result_backend)
 celery_app.config_from_object('app.scanner.celeryconfig')
 
+INCREMENTAL = os.getenv("SCAN_INCREMENTAL", "1") == "1"
+BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", 5000))  # lookup and commit batch
+
+def source_key(lang, content_sha):
+    # Redis key mapping raw file bytes to their AST sha, symbols and edges.
+    # Versioned with the AST encoding (chunks and complexity derive from it)
+    # and with symbol extraction.
+    return f"src:v{ast_codec.VERSION}.{symbols.VERSION}:{lang}:{content_sha}"
+
+ast_cache = ASTCache(redis_client)
+
+# --- Parse workers ---
+_parsers = {}
+_queries = {}
+
+def init_parser_worker():
+    """Pool initializer: one Parser and symbol query per language, kept for the worker's lifetime."""
+    for ext, language in TS_LANGS.items():
+        parser = Parser()
+        parser.set_language(language)
+        _parsers[ext] = parser
+    _queries.update(symbols.compile_queries(TS_LANGS))
+
+def process_file(args):
+    f, repo_path = args
+    relpath = os.path.relpath(f, repo_path)
+    ext = relpath.split('.')[-1]
+    lang = LANGUAGES.get(ext)
+    if not lang:
+        return None
+    with open(f, 'rb') as fh:
+        code = fh.read()
+    content_sha = hashlib.sha256(code).hexdigest()
+    t0 = time.perf_counter()
+    tree = _parsers[ext].parse(code)
+    t1 = time.perf_counter()
+    encoded = ast_codec.encode_tree(tree.root_node)
+    compressed = lz4.frame.compress(encoded)
+    t2 = time.perf_counter()
+    syms, edges = symbols.extract(_queries[ext], tree, code)
+    ast = ast_codec.CompactAST(encoded)
+    complexity = symbols.cyclomatic(ast)
+    code_chunks = chunker.split(ast, code)
+    terms = lexical.pack(lexical.terms(code))
+    t3 = time.perf_counter()
+    sha = hashlib.sha256(compressed).hexdigest()
+    n_lines = code.count(b'\n')
+    return {
+        'file_sha256': sha,
+        'compressed_ast': compressed,
+        'relpath': relpath,
+        'lang': lang,
+        'n_lines': n_lines,
+        'content_sha256': content_sha,
+        'complexity': complexity,
+        'lexical': terms,
+        'n_code_chunks': len(code_chunks),
+        # Popped by the engine before the ast_chunks write
+        'symbols': syms,
+        'edges': edges,
+        'code_chunks': code_chunks,
+        'stats': {
+            'parse_s': t1 - t0,
+            'encode_s': t2 - t1,
+            'extract_s': t3 - t2,
+            'raw_bytes': len(code),
+            'ast_bytes': len(encoded),
+            'compressed_bytes': len(compressed),
+        },
+    }
+
+def size_scan_pool(**kwargs):
+    # Each prefork child owns a parse pool: share the cores between them
+    pool.configure(celery_app.conf.worker_concurrency or 1)
+
+worker_init.connect(telemetry.start_metrics_server)
+worker_process_init.connect(telemetry.setup_worker_tracing)
+worker_process_init.connect(size_scan_pool)
+worker_process_shutdown.connect(pool.shutdown)
+
 class ScannerEngine:
-    def __init__(self, repo_url: str):
+    def __init__(self, repo_url: str, incremental: bool = INCREMENTAL, chunksize: int = pool.CHUNKSIZE):
         self.repo_url = repo_url
+        self.incremental = incremental
+        self.chunksize = chunksize
         self.session = Session()
+        self.timings = {}
+        self.totals = {}
+        self._submitted = 0
+        self._cancelled = threading.Event()
 
     def run(self, repo_path: str) -> int:
-        scan = Scan(repo_url=self.repo_url)
+        scan = Scan(repo_url=self.repo_url, status='running')
         self.session.add(scan)
         self.session.commit()
         scan_id = scan.id
-        files = self._collect_files(repo_path)
-        batches = [files[i:i+5000] for i in range(0, len(files), 5000)]
-        pool = mp.Pool(processes=mp.cpu_count())
-        for batch in batches:
-            results = pool.map(self._process_file, [(f, repo_path) for f in batch])
-            self._bulk_insert(scan_id, results)
-        pool.close()
-        pool.join()
-        self.session.commit()
+        self.totals = dict.fromkeys(('n_parsed', 'n_reused', 'raw_bytes', 'ast_bytes', 'compressed_bytes'), 0)
+        self._submitted = 0
+        self._cancelled.clear()
+        tasks = None
+        done = 0
+        try:
+            with stage('scan', self.timings, scan_id=scan_id, repo_url=self.repo_url):
+                files = timed_iter(self._collect_files(repo_path), 'discovery', self.timings)
+                tasks = self._iter_tasks(scan_id, repo_path, files)
+                defaults = {'scan_id': scan_id}
+                with stage('parse', self.timings), \
+                        ChunkWriter(engine, ASTChunk.__table__, defaults, batch_size=BATCH_SIZE) as writer, \
+                        ChunkWriter(engine, Symbol.__table__, defaults, batch_size=BATCH_SIZE) as symbol_writer, \
+                        ChunkWriter(engine, Edge.__table__, defaults, batch_size=BATCH_SIZE) as edge_writer, \
+                        ChunkWriter(engine, CodeChunk.__table__, defaults, batch_size=BATCH_SIZE) as code_writer:
+                    for result in pool.imap_unordered(process_file, tasks, init_parser_worker, self.chunksize):
+                        done += 1
+                        telemetry.POOL_QUEUE_DEPTH.set(self._submitted - done)
+                        if not result:
+                            continue
+                        self._account(result.pop('stats'), result['lang'])
+                        syms, edges = result.pop('symbols'), result.pop('edges')
+                        code_chunks = result.pop('code_chunks')
+                        relpath = result['relpath']
+                        writer.write(result)
+                        for sym in syms:
+                            symbol_writer.write(dict(sym, relpath=relpath))
+                        for edge in edges:
+                            edge_writer.write(dict(edge, relpath=relpath))
+                        for chunk in code_chunks:
+                            code_writer.write(dict(chunk, relpath=relpath))
+                        # Cache writes are batched here rather than issued per file by workers
+                        ast_cache.put(result['file_sha256'], result['compressed_ast'])
+                        ast_cache.put(
+                            source_key(result['lang'], result['content_sha256']),
+                            json.dumps({
+                                'ast': result['file_sha256'],
+                                'complexity': result['complexity'],
+                                'lexical': base64.b64encode(result['lexical']).decode(),
+                                'symbols': syms,
+                                'edges': edges,
+                                'chunks': code_chunks,
+                            }),
+                        )
+                tasks = None  # fully consumed
+                with stage('cache_flush', self.timings):
+                    ast_cache.flush()
+                with stage('lexical', self.timings):
+                    self._build_lexical(scan_id)
+        except Exception:
+            if tasks is not None:
+                self._cancel(tasks)
+            self._finish(scan, 'failed')
+            raise
+        self._finish(scan, 'done')
         return scan_id
 
+    def _cancel(self, tasks):
+        # Otherwise the warm pool keeps parsing what its feeder thread queued
+        # for this scan, and the feeder keeps attaching reused chunks to it.
+        self._cancelled.set()
+        pool.terminate()
+        tasks.close()
+
+    def _build_lexical(self, scan_id):
+        rows = self.session.execute(
+            sa.select(ASTChunk.relpath, ASTChunk.lexical).where(ASTChunk.scan_id == scan_id)
+        ).all()
+        self.session.merge(LexicalIndexRow(scan_id=scan_id, body=lexical.build(rows)))
+        self.session.commit()
+
+    def _account(self, stats, lang):
+        telemetry.observe_file(lang, stats)
+        self.totals['n_parsed'] += 1
+        for key in ('raw_bytes', 'ast_bytes', 'compressed_bytes'):
+            self.totals[key] += stats[key]
+        for key in ('parse_s', 'encode_s', 'extract_s'):
+            self.timings[f'worker_{key}'] = round(self.timings.get(f'worker_{key}', 0) + stats[key], 4)
+
+    def _finish(self, scan, status):
+        for key, value in self.totals.items():
+            setattr(scan, key, value)
+        scan.n_files = self.totals['n_parsed'] + self.totals['n_reused']
+        scan.status = status
+        scan.finished_at = datetime.utcnow()
+        scan.timings = dict(self.timings)
+        self.session.commit()
+        telemetry.SCANS_TOTAL.labels(status).inc()
+
     def _collect_files(self, repo_path):
-        exts = ('*.py', '*.js', '*.ts', '*.go')
-        files = []
-        for ext in exts:
-            files.extend(glob.glob(os.path.join(repo_path, '**', ext), recursive=True))
-        return files
-
-    def _process_file(self, args):
-        f, repo_path = args
-        relpath = os.path.relpath(f, repo_path)
-        ext = relpath.split('.')[-1]
-        lang = LANGUAGES.get(ext)
-        if not lang:
-            return None
-        parser = Parser()
-        parser.set_language(TS_LANGS[ext])
-        with open(f, 'rb') as fh:
-            code = fh.read()
-        tree = parser.parse(code)
-        ast_dict = self._tree_to_dict(tree.root_node, code)
-        ast_bytes = json.dumps(ast_dict).encode()
-        compressed = lz4.frame.compress(ast_bytes)
-        sha = hashlib.sha256(compressed).hexdigest()
-        redis_client.set(sha, compressed)
-        n_lines = code.count(b'\n')
-        return {
-            'file_sha256': sha,
-            'compressed_ast': compressed,
-            'relpath': relpath,
-            'lang': lang,
-            'n_lines': n_lines,
-        }
-
-    def _tree_to_dict(self, node, code):
-        d = {
-            'type': node.type,
-            'start': node.start_point,
-            'end': node.end_point,
-            'children': [self._tree_to_dict(c, code) for c in node.children]
-        }
-        return d
-
-    def _bulk_insert(self, scan_id, results):
-        objs = [ASTChunk(scan_id=scan_id, **r) for r in results if r]
-        self.session.bulk_save_objects(objs)
-
-def scan_repo(repo_url: str):
+        # Generator: parsing starts as soon as the first files are found
+        return iter_source_files(repo_path, LANGUAGES)
+
+    def _iter_tasks(self, scan_id, repo_path, files):
+        # Consumed by the pool's feeder thread: incremental lookups use their
+        # own connection rather than self.session.
+        if not self.incremental:
+            for f in files:
+                if self._cancelled.is_set():
+                    return
+                self._submitted += 1
+                yield f, repo_path
+            return
+        files = iter(files)
+        while True:
+            batch = list(itertools.islice(files, BATCH_SIZE))
+            if not batch or self._cancelled.is_set():
+                return
+            with stage('reuse', self.timings, files=len(batch)), engine.begin() as conn:
+                batch = self._reuse_unchanged(conn, scan_id, repo_path, batch)
+            for f in batch:
+                if self._cancelled.is_set():
+                    return
+                self._submitted += 1
+                yield f, repo_path
+
+    def _reuse_unchanged(self, conn, scan_id, repo_path, batch):
+        """
+        Attach already-parsed chunks to scan_id for files whose raw bytes are
+        known (ast_chunks first, then the Redis cache). Returns the files that
+        still have to be parsed.
+        """
+        entries = []
+        for f in batch:
+            relpath = os.path.relpath(f, repo_path)
+            lang = LANGUAGES.get(relpath.split('.')[-1])
+            if not lang:
+                continue
+            with open(f, 'rb') as fh:
+                code = fh.read()
+            entries.append((f, relpath, lang, hashlib.sha256(code).hexdigest(), code.count(b'\n')))
+        if not entries:
+            return []
+        rows = conn.execute(
+            sa.text(
+                "SELECT c.content_sha256, c.lang, MIN(c.id) FROM ast_chunks c JOIN scans s ON s.id = c.scan_id "
+                # Only finished scans: each table is written by its own ChunkWriter,
+                # so a running, failed or killed scan may hold a file's ast_chunks
+                # row without all of its symbols, edges and code_chunks.
+                # Chunks parsed before code_chunks existed are parsed again.
+                "WHERE c.content_sha256 IN :shas AND c.n_code_chunks IS NOT NULL AND s.status = 'done' "
+                "GROUP BY c.content_sha256, c.lang"
+            ).bindparams(sa.bindparam('shas', expanding=True)),
+            {'shas': list({e[3] for e in entries})}
+        ).fetchall()
+        known = {(r[0], r[1]): r[2] for r in rows}
+        copies = [
+            {'scan_id': scan_id, 'relpath': relpath, 'id': known[(sha, lang)]}
+            for _, relpath, lang, sha, _ in entries if (sha, lang) in known
+        ]
+        for _, _, lang, sha, _ in entries:
+            if (sha, lang) in known:
+                telemetry.FILES_TOTAL.labels(lang, 'reused').inc()
+        self.totals['n_reused'] += len(copies)
+        if copies:
+            # Copy server-side so the compressed AST never leaves the database
+            conn.execute(sa.text(
+                "INSERT INTO ast_chunks (scan_id, file_sha256, compressed_ast, relpath, lang, n_lines, content_sha256, complexity, lexical, n_code_chunks) "
+                "SELECT :scan_id, file_sha256, compressed_ast, :relpath, lang, n_lines, content_sha256, complexity, lexical, n_code_chunks "
+                "FROM ast_chunks WHERE id = :id"
+            ), copies)
+            # ... along with the symbols and edges extracted from that chunk
+            conn.execute(sa.text(
+                "INSERT INTO symbols (scan_id, relpath, kind, name, qualname, start_line, end_line) "
+                "SELECT :scan_id, :relpath, s.kind, s.name, s.qualname, s.start_line, s.end_line "
+                "FROM symbols s JOIN ast_chunks c ON s.scan_id = c.scan_id AND s.relpath = c.relpath "
+                "WHERE c.id = :id"
+            ), copies)
+            conn.execute(sa.text(
+                "INSERT INTO edges (scan_id, relpath, src, dst, kind) "
+                "SELECT :scan_id, :relpath, e.src, e.dst, e.kind "
+                "FROM edges e JOIN ast_chunks c ON e.scan_id = c.scan_id AND e.relpath = c.relpath "
+                "WHERE c.id = :id"
+            ), copies)
+            conn.execute(sa.text(
+                "INSERT INTO code_chunks (scan_id, relpath, start_line, end_line, kind, name, chunk_sha256, n_tokens, text) "
+                "SELECT :scan_id, :relpath, k.start_line, k.end_line, k.kind, k.name, k.chunk_sha256, k.n_tokens, k.text "
+                "FROM code_chunks k JOIN ast_chunks c ON k.scan_id = c.scan_id AND k.relpath = c.relpath "
+                "WHERE c.id = :id"
+            ), copies)
+        missing = [e for e in entries if (e[3], e[2]) not in known]
+        if not missing:
+            return []
+        records = ast_cache.get_many([source_key(lang, sha) for _, _, lang, sha, _ in missing])
+        # Older entries hold only the AST sha, or no code chunks: re-parse those
+        records = [json.loads(r) if r and r.startswith(b'{') else None for r in records]
+        records = [r if r and 'chunks' in r else None for r in records]
+        blobs = iter(ast_cache.get_many([r['ast'] for r in records if r]))
+        cached, cached_symbols, cached_edges, cached_chunks, todo = [], [], [], [], []
+        for (f, relpath, lang, sha, n_lines), record in zip(missing, records):
+            blob = next(blobs) if record else None
+            if blob is None:
+                todo.append(f)
+                continue
+            cached.append({
+                'scan_id': scan_id,
+                'file_sha256': record['ast'],
+                'compressed_ast': blob,
+                'relpath': relpath,
+                'lang': lang,
+                'n_lines': n_lines,
+                'content_sha256': sha,
+                'complexity': record.get('complexity'),
+                # Records written before the lexical index: file left out of it
+                'lexical': base64.b64decode(record['lexical']) if record.get('lexical') else None,
+                'n_code_chunks': len(record['chunks']),
+            })
+            cached_symbols.extend(dict(sym, scan_id=scan_id, relpath=relpath) for sym in record['symbols'])
+            cached_edges.extend(dict(edge, scan_id=scan_id, relpath=relpath) for edge in record['edges'])
+            cached_chunks.extend(dict(chunk, scan_id=scan_id, relpath=relpath) for chunk in record['chunks'])
+        for r in cached:
+            telemetry.FILES_TOTAL.labels(r['lang'], 'cached').inc()
+        self.totals['n_reused'] += len(cached)
+        if cached:
+            conn.execute(ASTChunk.__table__.insert(), cached)
+        if cached_symbols:
+            conn.execute(Symbol.__table__.insert(), cached_symbols)
+        if cached_edges:
+            conn.execute(Edge.__table__.insert(), cached_edges)
+        if cached_chunks:
+            conn.execute(CodeChunk.__table__.insert(), cached_chunks)
+        return todo
+
+def scan_repo(repo_url: str, incremental: bool = INCREMENTAL):
     # ...existing code to clone and scan...
     # For demo, just call CLI or ScannerEngine
     import tempfile, shutil, git
     tmpdir = tempfile.mkdtemp()
     try:
-        git.Repo.clone_from(repo_url, tmpdir, depth=1, multi_options=['--filter=blob:none'])
-        engine = ScannerEngine(repo_url)
+        engine = ScannerEngine(repo_url, incremental=incremental)
+        with stage('clone', engine.timings, repo_url=repo_url):
+            git.Repo.clone_from(repo_url, tmpdir, depth=1, multi_options=['--filter=blob:none'])
         scan_id = engine.run(tmpdir)
         return scan_id
     finally:
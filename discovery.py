@@ -0,0 +1,164 @@
+import os
+import re
+from fnmatch import translate
+
+DEFAULT_EXCLUDES = (
+    '.git', '.hg', '.svn', 'node_modules', 'vendor', 'third_party', 'bower_components',
+    'dist', 'build', 'out', 'target', 'coverage', '__pycache__', '.venv', 'venv', '.tox',
+    '.mypy_cache', '.pytest_cache', '.next', '.nuxt',
+)
+EXTRA_EXCLUDES = tuple(p for p in os.getenv("SCAN_EXCLUDE", "").split(',') if p)
+MAX_FILE_BYTES = int(os.getenv("SCAN_MAX_FILE_BYTES", 1024 * 1024))
+SNIFF_BYTES = 1024
+
+# Cheap name-based checks for minified / generated sources
+GENERATED_NAMES = (
+    '*.min.js', '*-min.js', '*.bundle.js', '*.chunk.js', '*.d.ts',
+    '*_pb2.py', '*_pb2_grpc.py', '*.pb.go', '*_gen.go', '*_generated.*', '*.generated.*',
+)
+GENERATED_MARKERS = (b'Code generated', b'DO NOT EDIT', b'@generated', b'auto-generated', b'autogenerated')
+MINIFIED_LINE_LEN = 500
+
+
+def _name_matcher(patterns):
+    # One compiled regex for a list of fnmatch-style basename patterns
+    if not patterns:
+        return lambda name: None
+    return re.compile('|'.join(f'(?:{translate(p)})' for p in patterns)).match
+
+
+def _translate(pat):
+    out, i, n = [], 0, len(pat)
+    while i < n:
+        if pat.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pat.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pat[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pat[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pat[i] == '[' and pat.find(']', i + 1) != -1:
+            j = pat.find(']', i + 1)
+            cls = pat[i + 1:j].replace('\\', '\\\\')
+            if cls.startswith('!'):
+                cls = '^' + cls[1:]
+            out.append(f'[{cls}]')
+            i = j + 1
+        else:
+            out.append(re.escape(pat[i]))
+            i += 1
+    return ''.join(out)
+
+
+class GitIgnore:
+    """Rules of one .gitignore file, matched against paths relative to its directory."""
+
+    def __init__(self, base, lines):
+        self.base = base
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            if '/' in line:
+                regex = '^' + _translate(line.lstrip('/')) + '$'
+            else:
+                regex = '^(?:.*/)?' + _translate(line) + '$'
+            self.rules.append((re.compile(regex), negate, dir_only))
+
+    @classmethod
+    def load(cls, base, path):
+        try:
+            with open(path, encoding='utf-8', errors='replace') as fh:
+                return cls(base, fh.readlines())
+        except OSError:
+            return None
+
+    def match(self, relpath, is_dir):
+        """True/False if a rule decides, None if no rule applies."""
+        result = None
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                result = not negate
+        return result
+
+
+def is_ignored(path, is_dir, ignores):
+    ignored = False
+    for gi in ignores:
+        decision = gi.match(os.path.relpath(path, gi.base).replace(os.sep, '/'), is_dir)
+        if decision is not None:
+            ignored = decision
+    return ignored
+
+
+def looks_generated(path):
+    """Peek at the head of the file: generated-code banners or minified lines."""
+    try:
+        with open(path, 'rb') as fh:
+            head = fh.read(SNIFF_BYTES)
+    except OSError:
+        return True
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return True
+    return len(head) == SNIFF_BYTES and head.count(b'\n') * MINIFIED_LINE_LEN < len(head)
+
+
+def iter_source_files(repo_path, extensions, excludes=DEFAULT_EXCLUDES + EXTRA_EXCLUDES,
+                      max_bytes=MAX_FILE_BYTES, use_gitignore=True, sniff=True):
+    """
+    Single os.scandir walk of repo_path yielding source files as they are
+    found. Excluded and .gitignore'd directories are pruned, not descended.
+    """
+    suffixes = tuple('.' + ext for ext in extensions)
+    excluded = _name_matcher(excludes)
+    generated = _name_matcher(GENERATED_NAMES)
+    stack = [(repo_path, [])]
+    while stack:
+        dirpath, ignores = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        if use_gitignore and any(e.name == '.gitignore' for e in entries):
+            gi = GitIgnore.load(dirpath, os.path.join(dirpath, '.gitignore'))
+            if gi:
+                ignores = ignores + [gi]
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            if excluded(name):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if not is_ignored(entry.path, True, ignores):
+                    subdirs.append(entry.path)
+                continue
+            if not name.endswith(suffixes) or not entry.is_file(follow_symlinks=False):
+                continue
+            if generated(name):
+                continue
+            if is_ignored(entry.path, False, ignores):
+                continue
+            size = entry.stat(follow_symlinks=False).st_size
+            if max_bytes and size > max_bytes:
+                continue
+            if sniff and looks_generated(entry.path):
+                continue
+            yield entry.path
+        for sub in reversed(subdirs):
+            stack.append((sub, ignores))
@@ -1,70 +1,201 @@
 import os
+import asyncio
+import random
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
 import faiss
 import numpy as np
 import httpx
 from datetime import datetime
+from app.ml import vector_index
+from app.scanner import migrations
 
 DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
 engine = sa.create_engine(DB_URL)
 Session = sessionmaker(bind=engine)
-FAISS_DIR = os.path.join(os.path.dirname(__file__), 'faiss_index')
-os.makedirs(FAISS_DIR, exist_ok=True)
-INDEX_PATH = os.path.join(FAISS_DIR, 'ast.index')
+INDEX_PATH = vector_index.INDEX_PATH
 
-EMBEDDING_DIM = 3072  # text-embedding-3-large
+# text-embedding-3-large: 3072, ou moins via le paramètre `dimensions` de l'API
+# (troncature renormalisée). Changer la dimension impose de ré-encoder.
+FULL_DIM = 3072
+EMBEDDING_DIM = int(os.getenv("EMBED_DIMENSIONS", 0)) or FULL_DIM
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+# Surchargeable pour pointer sur un serveur local (app.ml.mock_openai)
+EMBEDDING_URL = os.getenv("EMBEDDING_URL", "https://api.openai.com/v1/embeddings")
+BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 128))      # entrées par requête
+CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 8))      # requêtes en vol
+CHECKPOINT = int(os.getenv("EMBED_CHECKPOINT", 4096))     # chunks par commit DB + FAISS
+MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 6))
+MAX_CHARS = int(os.getenv("EMBED_MAX_CHARS", 24000))      # garde-fou, les chunks restent sous CHUNK_MAX_TOKENS
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
 
-class Embedding(sa.ext.declarative.declarative_base()):
+class Embedding(declarative_base()):
     __tablename__ = 'embeddings'
     id = sa.Column(sa.Integer, primary_key=True)
-    chunk_id = sa.Column(sa.Integer)
+    chunk_id = sa.Column(sa.Integer)  # premier code_chunks rencontré avec ce contenu
     scan_id = sa.Column(sa.Integer)
-    vector = sa.Column(sa.ARRAY(sa.Float))
+    # Un vecteur par contenu: les chunks des scans suivants s'y rattachent par chunk_sha256
+    chunk_sha256 = sa.Column(sa.String, unique=True)
+    # Vecteurs historiques d'un fichier entier (doc_type 'ast', chunk_id -> ast_chunks)
+    file_sha256 = sa.Column(sa.String, unique=True)
+    vector = sa.Column(sa.ARRAY(sa.Float))  # stockage historique (EMBED_VECTOR_STORAGE=array)
+    vector_blob = sa.Column(sa.LargeBinary)  # float32/float16 little-endian
+    vector_dtype = sa.Column(sa.String(8))
     doc_type = sa.Column(sa.String(16))
     created_at = sa.Column(sa.DateTime, default=datetime.utcnow)
 
-def embed_all():
-    session = Session()
-    # Récupère tous les AST chunks non encodés
-    ast_chunks = session.execute(sa.text("SELECT id, relpath, compressed_ast, scan_id FROM ast_chunks LEFT JOIN embeddings ON ast_chunks.id = embeddings.chunk_id WHERE embeddings.id IS NULL")).fetchall()
-    if not ast_chunks:
-        print("Aucun chunk à encoder.")
-        return
-    # Prépare FAISS
+# Colonnes ajoutées depuis la création de la table (chunk_sha256, file_sha256, vector_blob...)
+migrations.upgrade(engine)
+
+def request_payload(texts, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIM):
+    # Requêtes RAG et corpus doivent avoir le même modèle et la même dimension
+    payload = {"input": texts, "model": model}
+    if dimensions != FULL_DIM:
+        payload["dimensions"] = dimensions
+    return payload
+
+class EmbeddingClient:
+    """
+    Un seul client httpx (pool de connexions) partagé par toutes les requêtes,
+    au plus `concurrency` requêtes en vol, retry avec backoff sur 429/5xx.
+    """
+
+    def __init__(self, url=EMBEDDING_URL, model=EMBEDDING_MODEL, concurrency=CONCURRENCY, max_retries=MAX_RETRIES, dimensions=EMBEDDING_DIM):
+        self.url = url
+        self.model = model
+        self.dimensions = dimensions
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {os.getenv('OPENAI_KEY')}"},
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    def _delay(self, attempt, resp=None):
+        retry_after = resp.headers.get("retry-after") if resp is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(2 ** attempt, 60) * (0.5 + random.random() / 2)
+
+    async def embed(self, texts):
+        """Vecteurs (float32, dans l'ordre de texts) pour un lot d'entrées."""
+        payload = request_payload(texts, self.model, self.dimensions)
+        for attempt in range(self.max_retries + 1):
+            resp = None
+            async with self.semaphore:
+                try:
+                    resp = await self.client.post(self.url, json=payload)
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    if resp.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                        resp.raise_for_status()
+                        data = sorted(resp.json()["data"], key=lambda d: d["index"])
+                        return np.array([d["embedding"] for d in data], dtype=np.float32)
+            # Attente hors sémaphore: les autres requêtes continuent
+            await asyncio.sleep(self._delay(attempt, resp))
+
+def _text(chunk_text):
+    # Source d'une fonction/classe (app.scanner.chunker). Ne dépend que du
+    # contenu: le vecteur est partagé par tous les chunks de même chunk_sha256.
+    return chunk_text[:MAX_CHARS]
+
+def _pending(session, after_id, limit):
+    """
+    Un chunk de code par contenu (chunk_sha256) sans vecteur, le plus ancien.
+    Keyset: reprend après le dernier chunk traité, sans tout charger en mémoire.
+    """
+    return session.execute(sa.text(
+        "SELECT c.id, c.chunk_sha256, c.text, c.scan_id FROM code_chunks c "
+        "WHERE c.id > :after "
+        "AND NOT EXISTS (SELECT 1 FROM embeddings e WHERE e.chunk_sha256 = c.chunk_sha256) "
+        "AND NOT EXISTS (SELECT 1 FROM code_chunks d WHERE d.chunk_sha256 = c.chunk_sha256 AND d.id < c.id) "
+        "ORDER BY c.id LIMIT :limit"
+    ), {"after": after_id, "limit": limit}).fetchall()
+
+def _load_index(session):
+    """
+    Index FAISS à jour avec la table embeddings: une exécution interrompue
+    entre le commit DB et l'écriture de l'index est rattrapée ici.
+    """
     if os.path.exists(INDEX_PATH):
         index = faiss.read_index(INDEX_PATH)
+        if isinstance(index, faiss.IndexFlat):
+            # Ancien index positionnel (position = id - 1): reconstruit avec les ids
+            index = vector_index.rebuild(session, EMBEDDING_DIM, 'flat')
+            _write_index(index)
     else:
-        index = faiss.IndexFlatL2(EMBEDDING_DIM)
-    vectors = []
-    ids = []
-    for row in ast_chunks:
-        chunk_id, relpath, compressed_ast, scan_id = row[:4]
-        # Décompresse et prépare le texte (ici simplifié)
-        import lz4.frame, json
-        ast_dict = json.loads(lz4.frame.decompress(compressed_ast))
-        text = relpath + "\n" + str(ast_dict)
-        # Appel OpenAI embedding
-        async def get_embedding(text):
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    "https://api.openai.com/v1/embeddings",
-                    headers={"Authorization": f"Bearer {os.getenv('OPENAI_KEY')}"},
-                    json={"input": text, "model": "text-embedding-3-large"}
-                )
-                return resp.json()["data"][0]["embedding"]
-        import asyncio
-        vector = asyncio.run(get_embedding(text))
-        vectors.append(np.array(vector, dtype=np.float32))
-        ids.append(chunk_id)
-        # Stocke en DB
-        emb = Embedding(chunk_id=chunk_id, scan_id=scan_id, vector=vector, doc_type="ast")
-        session.add(emb)
-    if vectors:
-        index.add(np.stack(vectors))
-        faiss.write_index(index, INDEX_PATH)
-    session.commit()
-    print(f"Embeddings FAISS mis à jour ({len(vectors)} chunks)")
+        index = vector_index.create(EMBEDDING_DIM)
+        if not index.is_trained:
+            # IVF-PQ et PCA s'entraînent sur un corpus existant: `python -m app.ml.vector_index rebuild`.
+            # Le flat d'attente est sans PCA, sinon il serait lui aussi à entraîner.
+            print(f"Index {vector_index.index_spec()} non entraîné, index flat en attendant un rebuild")
+            index = vector_index.create(EMBEDDING_DIM, 'flat', pca_dim=0)
+    if index.d != EMBEDDING_DIM:
+        raise ValueError(f"Index de dimension {index.d}, EMBED_DIMENSIONS={EMBEDDING_DIM}: ré-encoder puis rebuild")
+    missing = session.execute(
+        sa.text(f"SELECT id, {vector_index.VECTOR_COLUMNS} FROM embeddings ORDER BY id OFFSET :n"),
+        {"n": index.ntotal}).fetchall()
+    if missing:
+        index.add_with_ids(
+            vector_index.decode_vectors([r[1:] for r in missing], EMBEDDING_DIM),
+            np.array([r[0] for r in missing], dtype=np.int64))
+        _write_index(index)
+    return index
+
+def _write_index(index):
+    # Rename atomique: un crash ne laisse jamais un index tronqué, et les
+    # ResidentIndex des processus de recherche basculent sur la nouvelle version
+    vector_index.write_index(index, INDEX_PATH)
+
+async def embed_all_async(batch_size=BATCH_SIZE, checkpoint=CHECKPOINT):
+    session = Session()
+    index = _load_index(session)
+    total = 0
+    after_id = 0
+    try:
+        async with EmbeddingClient() as client:
+            while True:
+                rows = _pending(session, after_id, checkpoint)
+                if not rows:
+                    break
+                after_id = rows[-1][0]
+                texts = [_text(r[2]) for r in rows]
+                batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+                vectors = np.concatenate(await asyncio.gather(*(client.embed(b) for b in batches)))
+                # Checkpoint: DB d'abord (source de vérité pour la reprise), puis FAISS
+                ids = session.execute(sa.insert(Embedding).returning(Embedding.id, sort_by_parameter_order=True), [
+                    {"chunk_id": r[0], "chunk_sha256": r[1], "scan_id": r[3], "doc_type": "code", **vector_index.encode_vector(v)}
+                    for r, v in zip(rows, vectors)
+                ]).scalars().all()
+                session.commit()
+                # Identifiants FAISS = embeddings.id
+                index.add_with_ids(vectors, np.array(ids, dtype=np.int64))
+                _write_index(index)
+                total += len(rows)
+                print(f"{total} contenus encodés")
+    finally:
+        session.close()
+    return total
+
+def embed_all():
+    total = asyncio.run(embed_all_async())
+    if not total:
+        print("Aucun nouveau contenu à encoder.")
+        return
+    print(f"Embeddings FAISS mis à jour ({total} nouveaux contenus)")
 
 if __name__ == '__main__':
     embed_all()
\ No newline at end of file
@@ -1,26 +1,15 @@
-import yaml
-import openai
-from langchain.llms import OpenAI, Together
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.retrievers import GoogleSearchAPIRetriever
-import os
+from app.ml import rag
+from . import registry
 
 class IntentGuruAgent:
     def __init__(self):
-        with open(os.path.join(os.path.dirname(__file__), 'prompts', 'intent_guru.yaml'), encoding='utf-8') as f:
-            self.prompt = yaml.safe_load(f)
-        self.llm = OpenAI(model="gpt-4.1", temperature=0.1)
-        self.fallback_llm = Together(model="mixtral-8x22b", api_key=os.getenv("TOGETHER_KEY"))
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self.retriever = GoogleSearchAPIRetriever(top_k=10, freshness_days=365, api_key=os.getenv("GOOGLE_KEY"))
+        # Prompt et client LLM partagés par le process (voir registry)
+        self.prompt = registry.prompt('intent_guru')
+        self.llm = registry.chat_client()
 
-    async def run(self, query: str):
-        docs = self.retriever.retrieve(query=query)
-        context = "\n".join([d['snippet'] for d in docs])
+    async def run(self, query: str, scan_id: int = None):
+        # RAG: index local du scan, web seulement si la question le demande
+        context = await rag.context_for(query, scan_id, web='auto')
         user_prompt = self.prompt['user'].replace('{query}', query)
         full_prompt = f"{self.prompt['system']}\n{user_prompt}\nContexte:\n{context}"
-        try:
-            resp = self.llm(full_prompt)
-        except Exception:
-            resp = self.fallback_llm(full_prompt)
-        return resp
+        return await self.llm.complete(full_prompt, temperature=0.1)
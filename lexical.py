@@ -0,0 +1,137 @@
+"""
+Lexical code search: BM25 over identifiers and identifier trigrams.
+
+Scan side: term counts are extracted per file by the parse workers
+(`terms`), stored packed on the chunk (`pack`) and assembled into one
+inverted index per scan at the end of the scan (`build`). Query side:
+`LexicalIndex.loads(body).search(query)` scores in-process with NumPy.
+"""
+import io
+import re
+import json
+from collections import Counter
+from itertools import chain
+import lz4.frame
+import numpy as np
+
+IDENT = re.compile(rb'[A-Za-z_][A-Za-z0-9_]+')
+SUBWORD = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+TRIGRAM_PREFIX = '3:'
+TRIGRAM_WEIGHT = 0.3  # trigram matches rank below exact identifier matches
+MAX_TRIGRAM_IDENTS = 2000  # distinct identifiers per file that contribute trigrams
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _words(ident):
+    # getHTTPResponse_code -> gethttpresponse_code, get, http, response, code
+    subs = (s.lower() for part in ident.split('_') for s in SUBWORD.findall(part) if len(s) > 1)
+    return list(dict.fromkeys([ident.lower(), *subs]))
+
+
+def _trigrams(word):
+    return [TRIGRAM_PREFIX + word[i:i + 3] for i in range(len(word) - 2)]
+
+
+def terms(code):
+    """Term frequencies of one file: identifiers, their sub-words and trigrams."""
+    idents = Counter(m.decode('ascii') for m in IDENT.findall(code))
+    counts = Counter()
+    for ident, n in idents.items():
+        for w in _words(ident):
+            counts[w] += n
+    for ident, _ in idents.most_common(MAX_TRIGRAM_IDENTS):
+        for t in _trigrams(ident.lower()):
+            counts[t] += 1
+    return dict(counts)
+
+
+def query_terms(text):
+    counts = Counter()
+    for m in IDENT.findall(text.encode('utf-8', 'ignore')):
+        ident = m.decode('ascii')
+        counts.update(_words(ident))
+        counts.update(_trigrams(ident.lower()))
+    return counts
+
+
+def pack(term_counts):
+    return lz4.frame.compress(json.dumps(term_counts, separators=(',', ':')).encode())
+
+
+def unpack(blob):
+    return json.loads(lz4.frame.decompress(blob))
+
+
+def build(docs):
+    """
+    Inverted index of a scan from (relpath, packed terms) rows, serialized
+    as LZ4-compressed npz: CSR postings per term plus document lengths.
+    """
+    relpaths, per_doc = [], []
+    for relpath, blob in docs:
+        relpaths.append(relpath)
+        per_doc.append(unpack(blob) if blob else {})
+    # Keep the per-posting loops in C (dict/map/fromiter): millions of postings per scan
+    vocab = list(dict.fromkeys(chain.from_iterable(per_doc)))
+    term_id = dict(zip(vocab, range(len(vocab))))
+    lengths = np.fromiter(map(len, per_doc), dtype=np.int64, count=len(per_doc))
+    n_postings = int(lengths.sum())
+    term = np.fromiter(map(term_id.__getitem__, chain.from_iterable(per_doc)), dtype=np.int32, count=n_postings)
+    tf = np.fromiter(chain.from_iterable(d.values() for d in per_doc), dtype=np.float32, count=n_postings)
+    doc = np.repeat(np.arange(len(per_doc), dtype=np.int32), lengths)
+    # BM25 length counts identifiers and sub-words, not trigrams
+    is_word = np.fromiter((not t.startswith(TRIGRAM_PREFIX) for t in vocab), dtype=bool, count=len(vocab))
+    doc_len = np.bincount(doc, weights=tf * is_word[term], minlength=len(per_doc)).astype(np.float32)
+    order = np.argsort(term, kind='stable')
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term, minlength=len(vocab)), out=indptr[1:])
+    buf = io.BytesIO()
+    np.savez(buf, indptr=indptr, doc=doc[order], tf=tf[order], doc_len=doc_len,
+             vocab=_strings(vocab), relpaths=_strings(relpaths))
+    return lz4.frame.compress(buf.getvalue())
+
+
+def _strings(items):
+    # Newline-joined UTF-8, avoids pickled object arrays
+    return np.frombuffer('\n'.join(items).encode(), dtype=np.uint8)
+
+
+def _unstrings(arr):
+    text = arr.tobytes().decode()
+    return text.split('\n') if text else []
+
+
+class LexicalIndex:
+    def __init__(self, indptr, doc, tf, doc_len, vocab, relpaths):
+        self.indptr, self.doc, self.tf, self.doc_len = indptr, doc, tf, doc_len
+        self.term_id = {t: i for i, t in enumerate(vocab)}
+        self.relpaths = list(relpaths)
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    @classmethod
+    def loads(cls, body):
+        data = np.load(io.BytesIO(lz4.frame.decompress(body)))
+        return cls(data['indptr'], data['doc'], data['tf'], data['doc_len'],
+                   _unstrings(data['vocab']), _unstrings(data['relpaths']))
+
+    def search(self, query, k=10):
+        """[(relpath, score)] by BM25, best first."""
+        n_docs = len(self.relpaths)
+        if not n_docs:
+            return []
+        scores = np.zeros(n_docs, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / max(self.avg_len, 1.0))
+        for t, qtf in query_terms(query).items():
+            i = self.term_id.get(t)
+            if i is None:
+                continue
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            docs, tf = self.doc[lo:hi], self.tf[lo:hi]
+            idf = np.log(1 + (n_docs - (hi - lo) + 0.5) / ((hi - lo) + 0.5))
+            weight = TRIGRAM_WEIGHT if t.startswith(TRIGRAM_PREFIX) else 1.0
+            scores[docs] += weight * qtf * idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        k = min(k, n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.relpaths[i], float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,156 @@
+import os
+import json
+import asyncio
+import random
+import time
+from contextlib import aclosing
+import httpx
+
+# API chat completions compatible OpenAI (Together expose la même), surchargeable
+# pour pointer sur un serveur local (app.ml.mock_openai)
+LLM_URL = os.getenv("LLM_URL", "https://api.openai.com/v1/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4.1")
+FALLBACK_URL = os.getenv("LLM_FALLBACK_URL", "https://api.together.xyz/v1/chat/completions")
+FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "mixtral-8x22b")
+CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 64))  # requêtes en vol, tous agents confondus
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Après une bascule sur le secours, le modèle principal est considéré indisponible pendant ce délai
+PRIMARY_COOLDOWN = float(os.getenv("LLM_PRIMARY_COOLDOWN", 60))
+
+
+_http = None
+
+
+def http_client():
+    """
+    Pool httpx du process: requêtes LLM, embeddings des questions RAG et
+    recherche web passent par les mêmes connexions (keep-alive).
+    """
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY),
+            timeout=httpx.Timeout(TIMEOUT, connect=10.0),
+        )
+    return _http
+
+
+async def aclose():
+    global _http
+    client, _http = _http, None
+    if client is not None:
+        await client.aclose()
+
+
+class Endpoint:
+    def __init__(self, url, model, api_key):
+        self.url = url
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+
+
+class ChatClient:
+    """
+    Client LLM non bloquant: un pool httpx partagé, réponses en flux (SSE)
+    token par token, retry puis bascule sur le modèle de secours tant
+    qu'aucun token n'a été émis. Sans état par requête: un seul client peut
+    servir tous les agents (voir registry).
+    """
+
+    def __init__(self, temperature=0.1, model=LLM_MODEL, fallback_model=FALLBACK_MODEL,
+                 concurrency=CONCURRENCY, max_retries=MAX_RETRIES, client=None):
+        self.temperature = temperature
+        self.endpoints = [Endpoint(LLM_URL, model, os.getenv("OPENAI_KEY"))]
+        if fallback_model:
+            self.endpoints.append(Endpoint(FALLBACK_URL, fallback_model, os.getenv("TOGETHER_KEY")))
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Pool du process par défaut (voir http_client)
+        self.client = client or http_client()
+        self.model = model
+        self.primary_down_until = 0.0
+        # Optionnel: `await limiter(modèle)` avant chaque requête (quota partagé entre process)
+        self.limiter = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.client is _http:
+            await aclose()
+        else:
+            await self.client.aclose()
+
+    def _payload(self, endpoint, prompt, temperature):
+        messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+        temperature = self.temperature if temperature is None else temperature
+        return {"model": endpoint.model, "messages": messages, "temperature": temperature, "stream": True}
+
+    async def _stream(self, endpoint, prompt, temperature):
+        if self.limiter is not None:
+            await self.limiter(endpoint.model)
+        async with self.semaphore, self.client.stream(
+                "POST", endpoint.url, headers=endpoint.headers, json=self._payload(endpoint, prompt, temperature)) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+                resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                choices = json.loads(data).get("choices") or [{}]
+                token = choices[0].get("delta", {}).get("content")
+                if token:
+                    yield token
+
+    def _retryable(self, exc):
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code in RETRY_STATUS
+        return isinstance(exc, httpx.TransportError)
+
+    def primary_healthy(self):
+        """Faux tant que la dernière requête a dû basculer sur le modèle de secours (PRIMARY_COOLDOWN)."""
+        return time.monotonic() >= self.primary_down_until
+
+    async def stream(self, prompt, temperature=None, on_model=None):
+        """
+        Tokens de la réponse au fil de l'eau. prompt: texte ou liste de messages;
+        on_model(nom) est appelé avec le modèle qui répond, avant le premier token.
+        """
+        for n, endpoint in enumerate(self.endpoints):
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    # aclosing: fermer ce générateur ferme aussi la réponse HTTP en cours
+                    async with aclosing(self._stream(endpoint, prompt, temperature)) as tokens:
+                        async for token in tokens:
+                            if not started:
+                                if n == 0:
+                                    self.primary_down_until = 0.0
+                                if on_model:
+                                    on_model(endpoint.model)
+                            started = True
+                            yield token
+                    return
+                except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                    # Une réponse entamée ne peut pas être rejouée sans doublons
+                    if started:
+                        raise
+                    last = n == len(self.endpoints) - 1
+                    if not self._retryable(e) or attempt == self.max_retries:
+                        if n == 0:
+                            self.primary_down_until = time.monotonic() + PRIMARY_COOLDOWN
+                        if last:
+                            raise
+                        break
+                await asyncio.sleep(min(2 ** attempt, 10) * (0.5 + random.random() / 2))
+
+    async def complete(self, prompt, temperature=None, on_model=None):
+        return "".join([token async for token in self.stream(prompt, temperature, on_model)])
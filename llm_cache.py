@@ -0,0 +1,133 @@
+import os
+import json
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+import redis
+import redis.asyncio as aioredis
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+# Réponses des agents d'analyse par contenu: même code, même version de
+# prompt, même modèle => même réponse, quel que soit le scan ou l'utilisateur.
+DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
+engine = sa.create_engine(DB_URL)
+Session = sessionmaker(bind=engine)
+REDIS_URL = os.getenv("REDIS_URL", "redis://cache:6379/0")
+redis_client = aioredis.Redis.from_url(REDIS_URL)
+
+TTL = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))              # Postgres, 0 = sans expiration
+REDIS_TTL = int(os.getenv("LLM_CACHE_REDIS_TTL", 24 * 3600))       # copie chaude
+MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", 200000))            # 0 = sans limite
+MAX_RESPONSE_BYTES = int(os.getenv("LLM_CACHE_MAX_RESPONSE_BYTES", 64 * 1024))
+PRUNE_EVERY = int(os.getenv("LLM_CACHE_PRUNE_EVERY", 500))         # écritures entre deux purges
+
+Base = declarative_base()
+
+class LLMResponse(Base):
+    __tablename__ = 'llm_responses'
+    key = sa.Column(sa.String(64), primary_key=True)
+    agent = sa.Column(sa.String(32))
+    prompt_version = sa.Column(sa.String(64))
+    model = sa.Column(sa.String(64))       # modèle demandé (fait partie de la clé)
+    served_by = sa.Column(sa.String(64))   # modèle qui a répondu
+    fallback = sa.Column(sa.Boolean, default=False)  # à régénérer quand le modèle principal répond
+    code_sha256 = sa.Column(sa.String(64))
+    response = sa.Column(sa.Text)
+    created_at = sa.Column(sa.DateTime, default=datetime.utcnow, index=True)
+    expires_at = sa.Column(sa.DateTime, index=True)
+
+Base.metadata.create_all(engine)
+
+_writes = 0
+
+
+def cache_key(agent, prompt_version, model, code):
+    code_sha = hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+    key = hashlib.sha256(f"{agent}\0{prompt_version}\0{model}\0{code_sha}".encode()).hexdigest()
+    return key, code_sha
+
+
+def _redis_key(key):
+    return f"llmcache:{key}"
+
+
+def _load(key):
+    with Session() as session:
+        row = session.get(LLMResponse, key)
+        if row is None or (row.expires_at and row.expires_at < datetime.utcnow()):
+            return None
+        return {"response": row.response, "served_by": row.served_by, "fallback": bool(row.fallback)}
+
+
+def _store(row):
+    global _writes
+    with Session() as session:
+        session.merge(row)
+        session.commit()
+        _writes += 1
+        if _writes % PRUNE_EVERY == 0:
+            prune(session)
+
+
+def prune(session):
+    """Supprime les réponses expirées puis les plus anciennes au-delà de MAX_ROWS."""
+    session.execute(sa.delete(LLMResponse).where(LLMResponse.expires_at < datetime.utcnow()))
+    if MAX_ROWS:
+        cutoff = session.execute(
+            sa.select(LLMResponse.created_at).order_by(LLMResponse.created_at.desc()).offset(MAX_ROWS).limit(1)
+        ).scalar()
+        if cutoff is not None:
+            session.execute(sa.delete(LLMResponse).where(LLMResponse.created_at <= cutoff))
+    session.commit()
+
+
+async def get(key):
+    """Entrée en cache (Redis, puis Postgres) ou None."""
+    try:
+        cached = await redis_client.get(_redis_key(key))
+    except redis.RedisError:
+        cached = None
+    if cached:
+        return json.loads(cached)
+    entry = await asyncio.to_thread(_load, key)
+    if entry is not None:
+        await _set_redis(key, entry)
+    return entry
+
+
+async def _set_redis(key, entry):
+    try:
+        await redis_client.set(_redis_key(key), json.dumps(entry), ex=REDIS_TTL or None)
+    except redis.RedisError:
+        pass  # Postgres reste la référence
+
+
+async def put(key, agent, prompt_version, model, code_sha, response, served_by):
+    if len(response.encode()) > MAX_RESPONSE_BYTES:
+        return
+    entry = {"response": response, "served_by": served_by, "fallback": served_by != model}
+    now = datetime.utcnow()
+    await asyncio.to_thread(_store, LLMResponse(
+        key=key, agent=agent, prompt_version=prompt_version, model=model, served_by=served_by,
+        fallback=entry["fallback"], code_sha256=code_sha, response=response,
+        created_at=now, expires_at=now + timedelta(seconds=TTL) if TTL else None))
+    await _set_redis(key, entry)
+
+
+async def cached_run(agent, prompt_version, model, code, run, upgrade=None):
+    """
+    Réponse en cache pour (agent, version du prompt, modèle, code), sinon
+    `await run()` -> (réponse, modèle ayant répondu) mise en cache. Une
+    réponse du modèle de secours (fallback) est servie comme les autres;
+    elle n'est régénérée, et remplacée, que si `upgrade()` est vrai (modèle
+    principal de nouveau disponible).
+    """
+    key, code_sha = cache_key(agent, prompt_version, model, code)
+    entry = await get(key)
+    if entry is not None and not (entry["fallback"] and upgrade is not None and upgrade()):
+        return entry["response"]
+    response, served_by = await run()
+    await put(key, agent, prompt_version, model, code_sha, response, served_by)
+    return response
@@ -1,11 +1,13 @@
 # Backend FastAPI minimal app
-from fastapi import FastAPI, APIRouter, Request
-from app.graph.builder import build_graph
-from app.graph.recommender import generate_suggestions
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Request, Response, HTTPException, Query
+from app.graph.artifacts import get_artifact, etag_matches
+from app.graph.adjacency import get_index, EDGE_TYPES
 import sqlalchemy as sa
 import os
 from sqlalchemy.orm import sessionmaker
 from app.ml.finetune import get_status
+from app.ml import llm
 from prometheus_fastapi_instrumentator import Instrumentator
 from app.middleware.limiter import register_limiter, limiter
 from app.middleware.audit import audit_log
@@ -15,7 +17,13 @@ from grafana_loki import LokiHandler
 import logging
 from loguru import logger
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Pool httpx partagé (agents, RAG), ouvert à la première requête LLM
+    await llm.aclose()
+
+app = FastAPI(lifespan=lifespan)
 register_limiter(app)
 Instrumentator().instrument(app).expose(app)
 
@@ -39,24 +47,88 @@ def read_root():
     return {"msg": "Hello from FastAPI!"}
 
 @router.get("/graph/{scan_id}")
-async def get_graph(scan_id: int):
+async def get_graph(scan_id: int, request: Request):
     """
     Retourne le graphe (DOT, JSON d3), les métriques et les suggestions pour un scan donné.
+    Calculé une fois par scan, servi depuis le cache (ETag / 304).
+    """
+    artifact = await get_artifact(scan_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail=f"Scan inconnu: {scan_id}")
+    etag, body = artifact
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def _index_or_404(scan_id):
+    index = await get_index(scan_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail=f"Scan inconnu: {scan_id}")
+    return index
+
+def _edge_types(edge_types):
+    if not edge_types:
+        return None
+    types = {t.strip() for t in edge_types.split(',') if t.strip()}
+    unknown = types - set(EDGE_TYPES)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Types d'arêtes inconnus: {sorted(unknown)}")
+    return types
+
+@router.get("/graph/{scan_id}/neighborhood")
+async def graph_neighborhood(
+    scan_id: int,
+    node: str,
+    depth: int = Query(1, ge=1, le=5),
+    edge_types: str = None,
+    direction: str = Query("both", pattern="^(in|out|both)$"),
+    limit: int = Query(500, ge=1, le=5000),
+):
+    """
+    Voisinage d'un nœud jusqu'à `depth` sauts, filtré par type d'arête
+    (contains, call, import, séparés par des virgules).
+    """
+    index = await _index_or_404(scan_id)
+    try:
+        return index.neighborhood(node, depth, _edge_types(edge_types), direction, limit)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Nœud inconnu: {node}")
+
+@router.get("/graph/{scan_id}/path")
+async def graph_path(
+    scan_id: int,
+    source: str,
+    target: str,
+    edge_types: str = None,
+    directed: bool = True,
+    max_depth: int = Query(20, ge=1, le=100),
+):
+    """
+    Plus court chemin entre deux nœuds; 404 si aucun chemin.
+    """
+    index = await _index_or_404(scan_id)
+    try:
+        path = index.path(source, target, _edge_types(edge_types), directed, max_depth)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Nœud inconnu: {e.args[0]}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Aucun chemin")
+    return path
+
+@router.get("/graph/{scan_id}/nodes")
+async def graph_nodes(
+    scan_id: int,
+    type: str = None,
+    q: str = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Liste paginée des nœuds (filtre par type et sous-chaîne de l'identifiant).
     """
-    dot_str, json_dict = build_graph(scan_id)
-    session = Session()
-    metrics = session.execute(sa.text("SELECT file, score FROM metrics WHERE scan_id=:scan_id"), {"scan_id": scan_id}).fetchall()
-    suggestions = session.execute(sa.text("SELECT type, suggestion FROM suggestions WHERE scan_id=:scan_id"), {"scan_id": scan_id}).fetchall()
-    # Génère suggestions si absentes
-    if not suggestions:
-        await generate_suggestions(scan_id, json_dict)
-        suggestions = session.execute(sa.text("SELECT type, suggestion FROM suggestions WHERE scan_id=:scan_id"), {"scan_id": scan_id}).fetchall()
-    return {
-        "dot": dot_str,
-        "json": json_dict,
-        "metrics": [{"file": m[0], "score": m[1]} for m in metrics],
-        "suggestions": [{"type": s[0], "suggestion": s[1]} for s in suggestions],
-    }
+    index = await _index_or_404(scan_id)
+    return index.list_nodes(type, q, offset, limit)
 
 @app.get("/secure-example")
 @limiter.limit("10/minute")
@@ -0,0 +1,207 @@
+"""
+Schema upgrades for databases created before the current models.
+
+Every module creates its tables with `create_all`, which never alters a
+table that already exists: columns added to a model since then have to be
+added here. Steps run once, in order, and are recorded in
+`schema_migrations`. Each one is also a no-op on a schema that already has
+its columns, so a fresh database only records them.
+
+Run automatically by the modules that own the tables, or by hand:
+    python -m app.scanner.migrations
+"""
+import os
+import argparse
+from datetime import datetime
+import sqlalchemy as sa
+
+LOCK_ID = 7_146_313  # pg_advisory_xact_lock key: one upgrader at a time
+
+
+def _columns(conn, table):
+    inspector = sa.inspect(conn)
+    if not inspector.has_table(table):
+        return None
+    return {c['name'] for c in inspector.get_columns(table)}
+
+
+def _add_columns(conn, table, columns):
+    """
+    Add the missing columns (nullable, no default) to table. Returns the
+    names added, or None when the table does not exist yet (create_all
+    will create it with every column).
+    """
+    existing = _columns(conn, table)
+    if existing is None:
+        return None
+    added = []
+    for column in columns:
+        if column.name in existing:
+            continue
+        ddl = column.type.compile(dialect=conn.dialect)
+        conn.execute(sa.text(f'ALTER TABLE {table} ADD COLUMN {column.name} {ddl}'))
+        added.append(column.name)
+    return added
+
+
+def _index(conn, name, table, columns, unique=False):
+    # Same names as create_all, so a fresh schema already has them
+    conn.execute(sa.text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def scan_summary(conn):
+    # Per-scan counters and timings (ScannerEngine._finish)
+    _add_columns(conn, 'scans', [
+        sa.Column('started_at', sa.DateTime),
+        sa.Column('finished_at', sa.DateTime),
+        sa.Column('n_files', sa.Integer),
+        sa.Column('n_parsed', sa.Integer),
+        sa.Column('n_reused', sa.Integer),
+        sa.Column('raw_bytes', sa.BigInteger),
+        sa.Column('ast_bytes', sa.BigInteger),
+        sa.Column('compressed_bytes', sa.BigInteger),
+        sa.Column('timings', sa.JSON),
+    ])
+
+
+def ast_chunk_columns(conn):
+    # Incremental reuse, complexity, lexical terms and code chunks. Rows
+    # parsed before are left NULL: never reused, complexity recomputed by
+    # the graph builder, file left out of the lexical index.
+    added = _add_columns(conn, 'ast_chunks', [
+        sa.Column('content_sha256', sa.String),
+        sa.Column('complexity', sa.Integer),
+        sa.Column('lexical', sa.LargeBinary),
+        sa.Column('n_code_chunks', sa.Integer),
+    ])
+    if added and 'content_sha256' in added:
+        _index(conn, 'ix_ast_chunks_content_sha256', 'ast_chunks', ['content_sha256'])
+
+
+def metrics_columns(conn):
+    # Graph analytics per file (app.graph.analytics)
+    _add_columns(conn, 'metrics', [
+        sa.Column('complexity', sa.Integer),
+        sa.Column('fan_in', sa.Integer),
+        sa.Column('fan_out', sa.Integer),
+        sa.Column('pagerank', sa.Float),
+        sa.Column('scc_size', sa.Integer),
+    ])
+
+
+def embedding_columns(conn):
+    """
+    Content keys and compact vector storage. Older versions embedded every
+    copy of a file: duplicates of the same AST are dropped (same vector)
+    before file_sha256 is filled in and made unique. The FAISS index is
+    rebuilt from the table on the next embed run (positional legacy index).
+    """
+    added = _add_columns(conn, 'embeddings', [
+        sa.Column('chunk_sha256', sa.String),
+        sa.Column('file_sha256', sa.String),
+        sa.Column('vector_blob', sa.LargeBinary),
+        sa.Column('vector_dtype', sa.String(8)),
+    ])
+    if not added:
+        return
+    if 'file_sha256' in added and _columns(conn, 'ast_chunks') is not None:
+        conn.execute(sa.text(
+            "DELETE FROM embeddings WHERE chunk_sha256 IS NULL AND file_sha256 IS NULL "
+            "AND chunk_id IN (SELECT id FROM ast_chunks WHERE file_sha256 IS NOT NULL) "
+            "AND id NOT IN ("
+            "  SELECT MIN(e.id) FROM embeddings e JOIN ast_chunks c ON c.id = e.chunk_id "
+            "  WHERE e.chunk_sha256 IS NULL AND c.file_sha256 IS NOT NULL GROUP BY c.file_sha256)"
+        ))
+        conn.execute(sa.text(
+            "UPDATE embeddings SET file_sha256 = "
+            "(SELECT file_sha256 FROM ast_chunks WHERE ast_chunks.id = embeddings.chunk_id) "
+            "WHERE file_sha256 IS NULL AND chunk_sha256 IS NULL "
+            "AND NOT EXISTS (SELECT 1 FROM embeddings d JOIN ast_chunks c ON c.id = embeddings.chunk_id "
+            "                WHERE d.file_sha256 = c.file_sha256)"
+        ))
+    for name in ('chunk_sha256', 'file_sha256'):
+        if name in added:
+            _index(conn, f'embeddings_{name}_key', 'embeddings', [name], unique=True)
+
+
+def go_type_table(conn):
+    # AST encoding v1 shifted Go type ids (a node type is '\n'): chunks and
+    # complexity derived from it are wrong. NULL n_code_chunks makes those
+    # files parsed again instead of reused; NULL complexity is recomputed
+    # from the stored AST, which still decodes correctly.
+    if _columns(conn, 'ast_chunks') is not None:
+        conn.execute(sa.text("UPDATE ast_chunks SET n_code_chunks = NULL, complexity = NULL WHERE lang = 'go'"))
+
+
+def python_from_imports(conn):
+    # Symbol extraction v2 records `from X import name` as 'X.name' (was X
+    # alone): NULL n_code_chunks makes Python files parsed again instead of
+    # reusing their edges.
+    if _columns(conn, 'ast_chunks') is not None:
+        conn.execute(sa.text("UPDATE ast_chunks SET n_code_chunks = NULL WHERE lang = 'python'"))
+
+
+def findings_not_before(conn):
+    # Retry backoff of the batch analysis queue (batch_analysis.Finding)
+    _add_columns(conn, 'findings', [sa.Column('not_before', sa.DateTime)])
+
+
+MIGRATIONS = [
+    ('0001_scan_summary', scan_summary),
+    ('0002_ast_chunk_columns', ast_chunk_columns),
+    ('0003_metrics_columns', metrics_columns),
+    ('0004_embedding_columns', embedding_columns),
+    ('0005_go_type_table', go_type_table),
+    ('0006_python_from_imports', python_from_imports),
+    ('0007_findings_not_before', findings_not_before),
+]
+
+_metadata = sa.MetaData()
+schema_migrations = sa.Table(
+    'schema_migrations', _metadata,
+    sa.Column('name', sa.String(64), primary_key=True),
+    sa.Column('applied_at', sa.DateTime),
+)
+
+
+def pending(engine):
+    _metadata.create_all(engine)
+    with engine.connect() as conn:
+        applied = set(conn.execute(sa.select(schema_migrations.c.name)).scalars())
+    return [name for name, _ in MIGRATIONS if name not in applied]
+
+
+def upgrade(engine):
+    """Apply pending migrations in one transaction. Returns their names."""
+    if not pending(engine):
+        return []
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(sa.text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+        # Re-read under the lock: another process may have just upgraded
+        applied = set(conn.execute(sa.select(schema_migrations.c.name)).scalars())
+        done = []
+        for name, step in MIGRATIONS:
+            if name in applied:
+                continue
+            step(conn)
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+            done.append(name)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument('--list', action='store_true', help="Only list pending migrations")
+    args = parser.parse_args()
+    engine = sa.create_engine(os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse"))
+    if args.list:
+        print('\n'.join(pending(engine)) or 'Up to date')
+        return
+    for name in upgrade(engine):
+        print(f"Applied {name}")
+
+
+if __name__ == '__main__':
+    main()
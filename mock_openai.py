@@ -0,0 +1,102 @@
+import os
+import asyncio
+import hashlib
+import json
+import random
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Serveur local compatible OpenAI pour les tests et benchmarks sans réseau:
+#   uvicorn app.ml.mock_openai:app --port 8900
+#   EMBEDDING_URL=http://localhost:8900/v1/embeddings python -m app.ml.embed
+#   LLM_URL=http://localhost:8900/v1/chat/completions (agents, chat WebSocket)
+MOCK_DIM = int(os.getenv("MOCK_EMBEDDING_DIM", 3072))
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", 50))
+MOCK_FAIL_RATE = float(os.getenv("MOCK_FAIL_RATE", 0.0))  # part de réponses 429/503
+MOCK_MAX_INPUTS = int(os.getenv("MOCK_MAX_INPUTS", 2048))
+MOCK_TOKEN_LATENCY_MS = float(os.getenv("MOCK_TOKEN_LATENCY_MS", 20))  # délai entre deux tokens
+MOCK_COMPLETION_TOKENS = int(os.getenv("MOCK_COMPLETION_TOKENS", 64))
+
+app = FastAPI()
+app.state.requests = 0
+app.state.inputs = 0
+app.state.completions = 0
+
+
+def fake_embedding(text, dim=MOCK_DIM):
+    """
+    Vecteur unitaire déterministe: même texte, même vecteur. `dim` tronque
+    et renormalise comme le paramètre `dimensions` de l'API.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'little')
+    v = np.random.default_rng(seed).standard_normal(MOCK_DIM).astype(np.float32)[:dim]
+    return (v / np.linalg.norm(v)).tolist()
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    app.state.requests += 1
+    await asyncio.sleep(MOCK_LATENCY_MS / 1000)
+    if random.random() < MOCK_FAIL_RATE:
+        if random.random() < 0.5:
+            return JSONResponse({"error": {"message": "Rate limit"}}, status_code=429, headers={"Retry-After": "0.1"})
+        return JSONResponse({"error": {"message": "Unavailable"}}, status_code=503)
+    if len(inputs) > MOCK_MAX_INPUTS:
+        return JSONResponse({"error": {"message": "Too many inputs"}}, status_code=400)
+    app.state.inputs += len(inputs)
+    dim = int(body.get("dimensions") or MOCK_DIM)
+    return {
+        "object": "list",
+        "model": body.get("model"),
+        "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t, dim)} for i, t in enumerate(inputs)],
+        "usage": {"prompt_tokens": sum(len(t) // 4 for t in inputs), "total_tokens": sum(len(t) // 4 for t in inputs)},
+    }
+
+
+def fake_completion(messages, n_tokens=MOCK_COMPLETION_TOKENS):
+    """Réponse déterministe: mêmes messages, mêmes tokens."""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(messages).encode()).digest()[:8], 'little')
+    rng = random.Random(seed)
+    words = ("the", "function", "returns", "None", "when", "input", "is", "empty", "check", "bounds", "patch", "line")
+    return [("" if i == 0 else " ") + rng.choice(words) for i in range(n_tokens)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests += 1
+    await asyncio.sleep(MOCK_LATENCY_MS / 1000)
+    if random.random() < MOCK_FAIL_RATE:
+        return JSONResponse({"error": {"message": "Rate limit"}}, status_code=429, headers={"Retry-After": "0.1"})
+    app.state.completions += 1
+    tokens = fake_completion(body["messages"], int(body.get("max_tokens") or MOCK_COMPLETION_TOKENS))
+    usage = {"prompt_tokens": sum(len(m["content"]) // 4 for m in body["messages"]), "completion_tokens": len(tokens)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    if not body.get("stream"):
+        return {
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def events():
+        for token in tokens:
+            chunk = {"object": "chat.completion.chunk", "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(MOCK_TOKEN_LATENCY_MS / 1000)
+        yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return {"requests": app.state.requests, "inputs": app.state.inputs, "completions": app.state.completions}
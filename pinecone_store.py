@@ -3,12 +3,14 @@ try:
     import pinecone
 except ImportError:
     pinecone = None
-import faiss
+from app.ml import vector_index
 
 class VectorStore:
     def __init__(self):
         try:
-            self.faiss_index = faiss.read_index("faiss_index/ast.index")
+            self.faiss = vector_index.resident()
+            if self.faiss.get() is None:
+                raise FileNotFoundError(self.faiss.path)
             self.use_faiss = True
         except Exception:
             if pinecone:
@@ -18,9 +20,14 @@ class VectorStore:
             else:
                 raise RuntimeError("No vector store available (FAISS and Pinecone unavailable)")
 
-    def search(self, vector, top_k=5):
+    def search(self, vector, top_k=5, ids=None, scan_id=None):
+        """
+        ids: embeddings.id auxquels limiter la recherche FAISS
+        (vector_index.scan_embedding_ids); scan_id: filtre de métadonnées Pinecone.
+        """
         if self.use_faiss:
-            D, I = self.faiss_index.search(vector, top_k)
+            D, I = self.faiss.search(vector, top_k, ids)
             return I
         else:
-            return self.index.query(vector.tolist(), top_k=top_k)["matches"]
+            filter = {"scan_id": scan_id} if scan_id is not None else None
+            return self.index.query(vector.tolist(), top_k=top_k, filter=filter)["matches"]
@@ -0,0 +1,81 @@
+import os
+import atexit
+import threading
+import multiprocessing as mp
+try:
+    # Celery prefork children are daemonic: only billiard lets them own a pool
+    from billiard import Pool
+except ImportError:
+    from multiprocessing import Pool
+
+POOL_SIZE = int(os.getenv("SCAN_POOL_SIZE", mp.cpu_count()))
+CHUNKSIZE = int(os.getenv("SCAN_CHUNKSIZE", 32))
+MAX_TASKS_PER_CHILD = int(os.getenv("SCAN_MAX_TASKS_PER_CHILD", 0)) or None
+
+_pool = None
+_pool_key = None
+_lock = threading.Lock()
+
+
+def configure(children):
+    """
+    Size the pool for one of `children` processes sharing the machine, e.g.
+    each Celery prefork child: cpu_count // children workers rather than
+    cpu_count each. SCAN_POOL_SIZE, when set, still wins.
+    """
+    global POOL_SIZE
+    if "SCAN_POOL_SIZE" not in os.environ:
+        POOL_SIZE = max(1, mp.cpu_count() // max(1, children))
+
+
+def get_pool(initializer=None, processes=None):
+    """
+    Process-wide pool, created on first use and kept warm between scans so
+    each worker runs `initializer` (parser setup) only once.
+    """
+    global _pool, _pool_key
+    key = (initializer, processes or POOL_SIZE)
+    with _lock:
+        if _pool is not None and _pool_key != key:
+            _close(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = Pool(processes=key[1], initializer=initializer,
+                         maxtasksperchild=MAX_TASKS_PER_CHILD)
+            _pool_key = key
+        return _pool
+
+
+def imap_unordered(func, tasks, initializer=None, chunksize=CHUNKSIZE):
+    """Stream results back as soon as each chunk of tasks is done."""
+    return get_pool(initializer).imap_unordered(func, tasks, chunksize=chunksize)
+
+
+def shutdown(**kwargs):
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _close(_pool)
+            _pool = None
+
+
+def terminate():
+    """
+    Drop the pool along with the tasks still queued on it (abandoned scan).
+    Stops the feeder thread from pulling more tasks; the next get_pool
+    starts a fresh pool.
+    """
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool.join()
+            _pool = None
+
+
+def _close(pool):
+    pool.close()
+    pool.join()
+
+
+atexit.register(shutdown)
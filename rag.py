@@ -1,43 +1,192 @@
 import os
-import faiss
+import re
+import asyncio
+import threading
+from collections import OrderedDict
 import numpy as np
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
 import httpx
+from app.ml import vector_index, embed, llm
+from app.scanner import lexical
 
 DB_URL = os.getenv("DB_URL", "postgresql://user:pass@db:5432/reverse")
 engine = sa.create_engine(DB_URL)
 Session = sessionmaker(bind=engine)
-FAISS_DIR = os.path.join(os.path.dirname(__file__), 'faiss_index')
-INDEX_PATH = os.path.join(FAISS_DIR, 'ast.index')
-EMBEDDING_DIM = 3072
-
-async def retrieve(query, top_k=5):
-    # Embedding requête
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            "https://api.openai.com/v1/embeddings",
-            headers={"Authorization": f"Bearer {os.getenv('OPENAI_KEY')}"},
-            json={"input": query, "model": "text-embedding-3-large"}
-        )
-        qvec = np.array(resp.json()["data"][0]["embedding"], dtype=np.float32)
-    # Recherche FAISS
-    if not os.path.exists(INDEX_PATH):
+CANDIDATES = int(os.getenv("RAG_CANDIDATES", 50))  # résultats par source avant fusion
+RRF_K = int(os.getenv("RAG_RRF_K", 60))
+LEXICAL_CACHE_SIZE = int(os.getenv("RAG_LEXICAL_CACHE_SIZE", 16))
+CONTEXT_CHUNKS_PER_FILE = int(os.getenv("RAG_CONTEXT_CHUNKS_PER_FILE", 2))
+# La recherche web ne sert qu'aux questions qui sortent du code scanné:
+# seuls ces identifiants sont envoyés au moteur, jamais la question entière
+WEB_PATTERN = re.compile(r'\b(?:CVE-\d{4}-\d{4,}|CWE-\d+|GHSA(?:-[0-9a-z]{4}){3})\b|https?://[^\s<>"\'`)\]]+', re.IGNORECASE)
+
+_lexical_indexes = OrderedDict()
+_lexical_lock = threading.Lock()
+
+def web_terms(query):
+    """Identifiants (CVE, CWE, GHSA, URL) d'une question en langage naturel, sans doublons."""
+    return list(dict.fromkeys(m.rstrip('.,;:') for m in WEB_PATTERN.findall(query)))
+
+def _lexical_index(scan_id):
+    """Index BM25 d'un scan (table lexical_index), gardé en mémoire: il ne change plus après le scan."""
+    with _lexical_lock:
+        if scan_id in _lexical_indexes:
+            _lexical_indexes.move_to_end(scan_id)
+            return _lexical_indexes[scan_id]
+    with engine.connect() as conn:
+        body = conn.execute(sa.text("SELECT body FROM lexical_index WHERE scan_id = :scan_id"), {"scan_id": scan_id}).scalar()
+    if body is None:
+        return None  # scan antérieur à l'index ou encore en cours: pas de cache
+    index = lexical.LexicalIndex.loads(body)
+    with _lexical_lock:
+        _lexical_indexes[scan_id] = index
+        while len(_lexical_indexes) > LEXICAL_CACHE_SIZE:
+            _lexical_indexes.popitem(last=False)
+    return index
+
+def lexical_search(query, scan_id, k=CANDIDATES):
+    index = _lexical_index(scan_id)
+    return index.search(query, k) if index is not None else []
+
+def _hits_metadata(session, hits, scan_id=None):
+    """Métadonnées de tous les résultats en une requête, dans l'ordre du classement."""
+    ids = [i for i, _ in hits]
+    if scan_id is None:
+        # Chunk d'origine du contenu; les vecteurs historiques (fichier entier) sont ignorés
+        rows = session.execute(sa.text(
+            "SELECT e.id, c.id, c.scan_id, e.chunk_sha256, c.relpath, c.start_line, c.end_line, c.kind, c.name, c.text "
+            "FROM embeddings e JOIN code_chunks c ON c.id = e.chunk_id "
+            "WHERE e.id IN :ids AND e.chunk_sha256 IS NOT NULL"
+        ).bindparams(sa.bindparam('ids', expanding=True)), {"ids": ids}).fetchall()
+    else:
+        # Chunks du scan partageant ce contenu (code identique inclus)
+        rows = session.execute(sa.text(
+            "SELECT e.id, c.id, c.scan_id, e.chunk_sha256, c.relpath, c.start_line, c.end_line, c.kind, c.name, c.text "
+            "FROM embeddings e JOIN code_chunks c ON c.chunk_sha256 = e.chunk_sha256 AND c.scan_id = :scan_id "
+            "WHERE e.id IN :ids ORDER BY c.id"
+        ).bindparams(sa.bindparam('ids', expanding=True)), {"ids": ids, "scan_id": scan_id}).fetchall()
+    by_id = {}
+    for emb_id, chunk_id, chunk_scan, sha, relpath, start, end, kind, name, text in rows:
+        hit = by_id.setdefault(emb_id, {"chunk_id": chunk_id, "scan_id": chunk_scan, "chunk_sha256": sha,
+                                        "kind": kind, "name": name, "text": text, "locations": []})
+        hit["locations"].append({"chunk_id": chunk_id, "relpath": relpath, "start_line": start, "end_line": end})
+    return [dict(by_id[i], distance=d) for i, d in hits if i in by_id]
+
+async def _embed_query(query):
+    # Même modèle, même dimension et même serveur que le corpus (embed), pool partagé
+    resp = await llm.http_client().post(
+        embed.EMBEDDING_URL,
+        headers={"Authorization": f"Bearer {os.getenv('OPENAI_KEY')}"},
+        json=embed.request_payload(query),
+    )
+    resp.raise_for_status()
+    return np.array(resp.json()["data"][0]["embedding"], dtype=np.float32)
+
+async def vector_search(query, top_k=5, scan_id=None):
+    # Recherche FAISS: index résident (mmap), rechargé seulement quand embed publie
+    resident = vector_index.resident()
+    if resident.get() is None:
         return []
-    index = faiss.read_index(INDEX_PATH)
-    D, I = index.search(qvec.reshape(1, -1), top_k)
+    qvec = await _embed_query(query)
+    # FAISS et SQL hors de la boucle d'événements
+    return await asyncio.to_thread(_vector_hits, resident, qvec, top_k, scan_id)
+
+def _vector_hits(resident, qvec, top_k, scan_id):
     session = Session()
-    # Récupère les chunks correspondants
-    results = []
-    for idx in I[0]:
-        if idx < 0:
-            continue
-        chunk = session.execute(sa.text("SELECT chunk_id, scan_id FROM embeddings WHERE id=:id"), {"id": int(idx)+1}).fetchone()
-        if chunk:
-            results.append(dict(chunk))
-    # Fallback GoogleSearch si rien
-    if not results:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"https://www.googleapis.com/customsearch/v1?q={query}&key={os.getenv('GOOGLE_KEY')}")
-            return resp.json().get('items', [])
+    try:
+        # Limitée aux vecteurs du scan demandé plutôt que filtrée après coup
+        ids = vector_index.scan_embedding_ids(session, scan_id, resident.version) if scan_id is not None else None
+        D, I = resident.search(qvec, top_k, ids)
+        hits = [(int(i), float(d)) for i, d in zip(I[0], D[0]) if i >= 0]
+        return _hits_metadata(session, hits, scan_id) if hits else []
+    finally:
+        session.close()
+
+async def web_search(query):
+    resp = await llm.http_client().get("https://www.googleapis.com/customsearch/v1",
+                                       params={"q": query, "key": os.getenv('GOOGLE_KEY')})
+    return resp.json().get('items', [])
+
+def fuse(lexical_hits, vector_hits, top_k):
+    """
+    Reciprocal rank fusion par fichier: (relpath, bm25) du lexical et
+    chunks FAISS (un contenu peut se retrouver dans plusieurs fichiers du scan).
+    """
+    fused = {}
+    for rank, (relpath, score) in enumerate(lexical_hits):
+        hit = fused.setdefault(relpath, {"relpath": relpath, "score": 0.0})
+        hit["score"] += 1 / (RRF_K + rank + 1)
+        hit["bm25"] = score
+    for rank, v in enumerate(vector_hits):
+        for loc in v["locations"]:
+            hit = fused.setdefault(loc["relpath"], {"relpath": loc["relpath"], "score": 0.0})
+            if "chunks" not in hit:
+                # Meilleur rang vectoriel du fichier seulement, comme pour le lexical
+                hit["score"] += 1 / (RRF_K + rank + 1)
+                hit["distance"] = v["distance"]
+            hit.setdefault("chunks", []).append(dict(loc, kind=v["kind"], name=v["name"], text=v["text"]))
+    return sorted(fused.values(), key=lambda h: -h["score"])[:top_k]
+
+async def retrieve(query, top_k=5, scan_id=None, web=False):
+    """
+    Lexical (BM25 en mémoire) et FAISS en parallèle, fusionnés par RRF quand
+    un scan est donné. Web sur demande seulement: web=True cherche la requête
+    telle quelle, web='auto' les identifiants de web_terms(query) s'il y en a
+    (questions des utilisateurs; jamais pour du code, qui resterait privé).
+    """
+    if scan_id is None:
+        lexical_task = asyncio.sleep(0, [])
+    else:
+        lexical_task = asyncio.to_thread(lexical_search, query, scan_id, max(top_k, CANDIDATES))
+    lexical_hits, vector_hits = await asyncio.gather(
+        lexical_task,
+        vector_search(query, max(top_k, CANDIDATES) if scan_id is not None else top_k, scan_id),
+        return_exceptions=True,
+    )
+    if isinstance(lexical_hits, Exception):
+        raise lexical_hits
+    if isinstance(vector_hits, Exception):
+        # API d'embedding indisponible: le lexical répond seul
+        if scan_id is None or not isinstance(vector_hits, httpx.HTTPError):
+            raise vector_hits
+        vector_hits = []
+    results = fuse(lexical_hits, vector_hits, top_k) if scan_id is not None else vector_hits
+    web_query = " ".join(web_terms(query)) if web == 'auto' else query if web else None
+    if web_query:
+        results = results + await web_search(web_query)
     return results
+
+def _symbols(scan_id, relpaths):
+    with engine.connect() as conn:
+        rows = conn.execute(sa.text(
+            "SELECT relpath, kind, qualname, start_line FROM symbols "
+            "WHERE scan_id = :scan_id AND relpath IN :relpaths ORDER BY relpath, start_line"
+        ).bindparams(sa.bindparam('relpaths', expanding=True)), {"scan_id": scan_id, "relpaths": relpaths}).fetchall()
+    by_file = {}
+    for relpath, kind, qualname, line in rows:
+        by_file.setdefault(relpath, []).append(f"{kind} {qualname} (l.{line})")
+    return by_file
+
+async def context_for(query, scan_id=None, web=False, top_k=5):
+    """
+    Contexte texte pour les prompts des agents: code des chunks trouvés
+    (fichier et lignes), symboles des fichiers trouvés par le lexical seul,
+    puis web si demandé (voir retrieve).
+    """
+    results = await retrieve(query, top_k, scan_id, web)
+    lexical_only = [r["relpath"] for r in results if "relpath" in r and "chunks" not in r]
+    symbols = await asyncio.to_thread(_symbols, scan_id, lexical_only) if lexical_only else {}
+    lines = []
+    for r in results:
+        if "chunks" in r:
+            for c in r["chunks"][:CONTEXT_CHUNKS_PER_FILE]:
+                lines.append(f"{r['relpath']}:{c['start_line']}-{c['end_line']} ({c['kind']} {c['name']})\n{c['text']}")
+        elif "relpath" in r:
+            lines.append(f"{r['relpath']}: " + ", ".join(symbols.get(r['relpath'], [])[:20]))
+        elif "locations" in r:
+            loc = r["locations"][0]
+            lines.append(f"{loc['relpath']}:{loc['start_line']}-{loc['end_line']} ({r['kind']} {r['name']})\n{r['text']}")
+        elif "snippet" in r:
+            lines.append(f"{r.get('link', '')}\n{r['snippet']}")
+    return "\n\n".join(lines)
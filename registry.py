@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import functools
+import importlib
+import threading
+import yaml
+from app.ml import llm
+
+PROMPTS_DIR = os.path.join(os.path.dirname(__file__), 'prompts')
+
+# Agents par type de requête, importés et construits à la première utilisation
+AGENTS = {
+    'bug': ('.bug_hunter', 'BugHunterAgent'),
+    'vuln': ('.vuln_seeker', 'VulnSeekerAgent'),
+    'intent': ('.intent_guru', 'IntentGuruAgent'),
+    'chat': ('.chat_central', 'ChatCentralAgent'),
+}
+
+_agents = {}
+_client = None
+_lock = threading.RLock()
+
+
+@functools.lru_cache(maxsize=None)
+def prompt(name):
+    """Prompt YAML lu une seule fois par process."""
+    with open(os.path.join(PROMPTS_DIR, f'{name}.yaml'), encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def prompt_version(name):
+    """`version` du YAML, ou empreinte de son contenu: toute modification invalide le cache LLM."""
+    data = prompt(name)
+    if data.get('version'):
+        return str(data['version'])
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def chat_client():
+    """ChatClient partagé: un seul pool de connexions pour tous les agents."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = llm.ChatClient()
+        return _client
+
+
+def get_agent(kind):
+    """Agent du type demandé, créé au premier appel puis partagé (sans état par requête)."""
+    if kind not in AGENTS:
+        raise ValueError(f"Unknown query type: {kind}")
+    agent = _agents.get(kind)
+    if agent is None:
+        module, name = AGENTS[kind]
+        cls = getattr(importlib.import_module(module, __package__), name)
+        with _lock:
+            agent = _agents.get(kind)
+            if agent is None:
+                agent = _agents[kind] = cls()
+    return agent
+
+
+async def aclose():
+    # À l'arrêt du process: fin de worker Celery (batch_analysis). Côté API,
+    # le lifespan de main ferme le pool partagé (llm.aclose)
+    global _client
+    with _lock:
+        client, _client = _client, None
+        _agents.clear()
+    if client is not None:
+        await client.aclose()
+    await llm.aclose()  # pool partagé avec rag
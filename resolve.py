@@ -0,0 +1,72 @@
+"""
+Résolution des imports bruts extraits au scan (table edges, kind='import')
+vers les fichiers du scan.
+"""
+import posixpath
+from collections import defaultdict
+
+
+def suffix_index(paths):
+    # 'a/b/c.py' -> indexé sous 'a/b/c.py', 'b/c.py', 'c.py'
+    index = defaultdict(list)
+    for p in paths:
+        parts = p.split('/')
+        for i in range(len(parts)):
+            index['/'.join(parts[i:])].append(p)
+    return index
+
+def _exact(candidates, suffixes):
+    return [c for c in candidates if c in suffixes.get(c, ())][:1]
+
+def _python(base, module, suffixes):
+    if module.startswith('.'):
+        dots = len(module) - len(module.lstrip('.'))
+        parts = base.split('/') if base else []
+        parts = parts[:len(parts) - (dots - 1)] if dots > 1 else parts
+        rest = module.lstrip('.').replace('.', '/')
+        stem = '/'.join(parts + ([rest] if rest else []))
+        return _exact([stem + '.py', stem + '/__init__.py'], suffixes)
+    stem = module.replace('.', '/')
+    for c in (stem + '.py', stem + '/__init__.py'):
+        matches = suffixes.get(c)
+        if matches:
+            return matches[:1]
+    return []
+
+def _python_parent(module):
+    # 'pkg.name' -> 'pkg', '..name' -> '..', 'os' -> None
+    rest = module.lstrip('.')
+    prefix = module[:len(module) - len(rest)]
+    if not rest:
+        return None
+    parent = prefix + rest.rpartition('.')[0]
+    return parent or None
+
+def resolve_import(relpath, module, suffixes, packages):
+    """
+    Fichiers du scan correspondant à un import (chemin brut extrait au scan).
+    Les imports externes (stdlib, node_modules, ...) ne résolvent rien.
+    """
+    ext = relpath.rsplit('.', 1)[-1]
+    base = posixpath.dirname(relpath)
+    if ext == 'py':
+        # `from pkg import name` arrive sous la forme 'pkg.name': name est un
+        # module (pkg/name.py) ou un attribut de pkg, d'où le repli sur pkg
+        found = _python(base, module, suffixes)
+        parent = _python_parent(module)
+        if not found and parent:
+            found = _python(base, parent, suffixes)
+        return found
+    if ext in ('js', 'ts'):
+        if not module.startswith('.'):
+            return []
+        stem = posixpath.normpath(posixpath.join(base, module))
+        candidates = [stem, stem + '.ts', stem + '.js', stem + '/index.ts', stem + '/index.js']
+        if stem.endswith('.js'):
+            candidates.append(stem[:-3] + '.ts')
+        return _exact(candidates, suffixes)
+    if ext == 'go':
+        # Un import Go désigne un package (répertoire): plus long suffixe commun
+        dirs = [d for d in packages if d and (module == d or module.endswith('/' + d))]
+        return packages[max(dirs, key=len)] if dirs else []
+    return []
@@ -1,24 +1,12 @@
 import asyncio
 from langchain.agents import initialize_agent, AgentType
 from langchain.schema import AgentAction
-from .bug_hunter import BugHunterAgent
-from .vuln_seeker import VulnSeekerAgent
-from .intent_guru import IntentGuruAgent
-from .chat_central import ChatCentralAgent
+from . import registry
 
 class RouterAgent:
-    def __init__(self):
-        self.agents = {
-            'bug': BugHunterAgent(),
-            'vuln': VulnSeekerAgent(),
-            'intent': IntentGuruAgent(),
-            'chat': ChatCentralAgent(),
-        }
-
+    # Agents créés à la première requête de leur type, partagés par le process
     async def route(self, query_type: str, **kwargs):
-        agent = self.agents.get(query_type)
-        if not agent:
-            raise ValueError(f"Unknown query type: {query_type}")
+        agent = registry.get_agent(query_type)
         return await agent.run(**kwargs)
 
 # Example usage:
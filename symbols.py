@@ -0,0 +1,155 @@
+"""
+Scan-time extraction of definitions, imports and call sites with
+tree-sitter queries. Captures used by every language:
+  @class / @function   definition node      @name   its name
+  @import              imported module       @call   called name
+  @from                module of `from X import name` (@import is name)
+"""
+import numpy as np
+
+VERSION = 2  # 2: `from X import name` records 'X.name'
+
+QUERIES = {
+    'py': """
+        (class_definition name: (identifier) @name) @class
+        (function_definition name: (identifier) @name) @function
+        (import_statement name: (dotted_name) @import)
+        (import_statement name: (aliased_import name: (dotted_name) @import))
+        (import_from_statement module_name: (_) @from name: (dotted_name) @import)
+        (import_from_statement module_name: (_) @from name: (aliased_import name: (dotted_name) @import))
+        (import_from_statement module_name: (_) @import (wildcard_import))
+        (call function: (identifier) @call)
+        (call function: (attribute attribute: (identifier) @call))
+    """,
+    'js': """
+        (class_declaration name: (identifier) @name) @class
+        (function_declaration name: (identifier) @name) @function
+        (generator_function_declaration name: (identifier) @name) @function
+        (method_definition name: (property_identifier) @name) @function
+        (variable_declarator name: (identifier) @name value: (arrow_function)) @function
+        (import_statement source: (string) @import)
+        (call_expression function: (identifier) @call)
+        (call_expression function: (member_expression property: (property_identifier) @call))
+    """,
+    'ts': """
+        (class_declaration name: (type_identifier) @name) @class
+        (interface_declaration name: (type_identifier) @name) @class
+        (function_declaration name: (identifier) @name) @function
+        (method_definition name: (property_identifier) @name) @function
+        (variable_declarator name: (identifier) @name value: (arrow_function)) @function
+        (import_statement source: (string) @import)
+        (call_expression function: (identifier) @call)
+        (call_expression function: (member_expression property: (property_identifier) @call))
+    """,
+    'go': """
+        (type_spec name: (type_identifier) @name) @class
+        (function_declaration name: (identifier) @name) @function
+        (method_declaration name: (field_identifier) @name) @function
+        (import_spec path: (interpreted_string_literal) @import)
+        (call_expression function: (identifier) @call)
+        (call_expression function: (selector_expression field: (field_identifier) @call))
+    """,
+}
+
+
+# Decision points counted for cyclomatic complexity (all languages share
+# one set: node type names do not collide across the grammars we parse)
+DECISION_TYPES = frozenset({
+    'if_statement', 'elif_clause', 'for_statement', 'for_in_statement', 'while_statement',
+    'do_statement', 'except_clause', 'catch_clause', 'case_clause', 'switch_case',
+    'expression_case', 'type_case', 'communication_case', 'conditional_expression',
+    'ternary_expression', 'for_in_clause', 'if_clause', 'and', 'or', '&&', '||', '??',
+})
+
+
+def compile_queries(ts_langs):
+    return {ext: ts_langs[ext].query(src) for ext, src in QUERIES.items() if ext in ts_langs}
+
+
+def _text(code, node):
+    return code[node.start_byte:node.end_byte].decode('utf-8', 'replace')
+
+
+def _go_receiver(code, node):
+    # func (s *Server) Handle() -> "Server"
+    receiver = node.child_by_field_name('receiver')
+    stack = [receiver] if receiver else []
+    while stack:
+        n = stack.pop()
+        if n.type == 'type_identifier':
+            return _text(code, n)
+        stack.extend(reversed(n.children))
+    return None
+
+
+def extract(query, tree, code):
+    """
+    Returns (symbols, edges) for one file.
+    symbols: dicts kind/name/qualname/start_line/end_line, qualname nests
+    definitions (Class.method). edges: dicts src/dst/kind where src is a
+    qualname ('' for module level) and dst the raw import or callee name.
+    Python `from X import name` imports 'X.name', resolved to X/name.py or X.
+    """
+    defs, imports, calls = [], [], []
+    for _, captures in query.matches(tree.root_node):
+        if 'name' in captures:
+            kind = 'class' if 'class' in captures else 'function'
+            node = captures[kind]
+            name = _text(code, captures['name'])
+            owner = _go_receiver(code, node) if node.type == 'method_declaration' else None
+            defs.append((node.start_byte, node.end_byte, kind, name, owner, node))
+        elif 'import' in captures:
+            module = _text(code, captures['import']).strip('\'"`')
+            if 'from' in captures:
+                # from pkg import mod -> 'pkg.mod', from . import mod -> '.mod'
+                package = _text(code, captures['from'])
+                module = package + module if package.endswith('.') else f"{package}.{module}"
+            imports.append(module)
+        elif 'call' in captures:
+            node = captures['call']
+            calls.append((node.start_byte, _text(code, node)))
+
+    defs.sort(key=lambda d: (d[0], -d[1]))
+    symbols, spans, stack = [], [], []
+    for start, end, kind, name, owner, node in defs:
+        while stack and stack[-1][0] <= start:
+            stack.pop()
+        parent = stack[-1][1] if stack else owner
+        qualname = f"{parent}.{name}" if parent else name
+        symbols.append({
+            'kind': kind,
+            'name': name,
+            'qualname': qualname,
+            'start_line': node.start_point[0] + 1,
+            'end_line': node.end_point[0] + 1,
+        })
+        spans.append((start, end, qualname))
+        stack.append((end, qualname))
+
+    edges = [{'src': '', 'dst': module, 'kind': 'import'} for module in dict.fromkeys(imports)]
+    seen = set()
+    open_spans, i = [], 0
+    calls.sort()
+    for pos, callee in calls:
+        # sweep: keep the stack of definitions enclosing pos (spans nest)
+        while i < len(spans) and spans[i][0] <= pos:
+            while open_spans and open_spans[-1][1] <= spans[i][0]:
+                open_spans.pop()
+            open_spans.append(spans[i])
+            i += 1
+        while open_spans and open_spans[-1][1] <= pos:
+            open_spans.pop()
+        caller = open_spans[-1][2] if open_spans else ''
+        if (caller, callee) not in seen:
+            seen.add((caller, callee))
+            edges.append({'src': caller, 'dst': callee, 'kind': 'call'})
+    return symbols, edges
+
+
+def cyclomatic(ast):
+    """File-level McCabe complexity of a CompactAST: 1 + decision points."""
+    wanted = [tid for tid, name in enumerate(ast.types) if name in DECISION_TYPES]
+    if not wanted or not len(ast):
+        return 1
+    counts = np.bincount(np.asarray(ast.type_id), minlength=len(ast.types))
+    return 1 + int(counts[wanted].sum())
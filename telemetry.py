@@ -0,0 +1,110 @@
+import os
+import time
+from contextlib import contextmanager
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, start_http_server, multiprocess
+
+tracer = trace.get_tracer("app.scanner")
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+STAGE_SECONDS = Histogram(
+    'scanner_stage_seconds', 'Wall time per scan stage',
+    ['stage'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+PARSE_SECONDS = Histogram(
+    'scanner_parse_seconds', 'Per-file tree-sitter parse time',
+    ['lang'], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+ENCODE_SECONDS = Histogram(
+    'scanner_encode_seconds', 'Per-file AST serialize + compress time',
+    ['lang'], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+AST_BYTES = Histogram(
+    'scanner_ast_bytes', 'Per-file size: raw source, encoded AST, compressed AST',
+    ['lang', 'form'], buckets=SIZE_BUCKETS,
+)
+WRITE_SECONDS = Histogram(
+    'scanner_write_seconds', 'Latency of one batched write',
+    ['backend'], buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+FILES_TOTAL = Counter('scanner_files_total', 'Files handled by outcome', ['lang', 'outcome'])
+SCANS_TOTAL = Counter('scanner_scans_total', 'Finished scans by status', ['status'])
+POOL_QUEUE_DEPTH = Gauge('scanner_pool_queue_depth', 'Files submitted to the parse pool and not yet returned')
+
+
+@contextmanager
+def stage(name, summary=None, **attributes):
+    """OTel span + histogram sample for one scan stage; adds seconds to summary."""
+    with tracer.start_as_current_span(f"scan.{name}", attributes=attributes) as span:
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.labels(name).observe(elapsed)
+            if summary is not None:
+                summary[name] = round(summary.get(name, 0) + elapsed, 4)
+
+
+@contextmanager
+def timed_write(backend):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        WRITE_SECONDS.labels(backend).observe(time.perf_counter() - start)
+
+
+def timed_iter(iterable, name, summary):
+    """Yield from iterable, accounting the time spent producing items to `name`."""
+    it = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        STAGE_SECONDS.labels(name).observe(total)
+        summary[name] = round(summary.get(name, 0) + total, 4)
+
+
+def observe_file(lang, stats):
+    PARSE_SECONDS.labels(lang).observe(stats['parse_s'])
+    ENCODE_SECONDS.labels(lang).observe(stats['encode_s'])
+    AST_BYTES.labels(lang, 'raw').observe(stats['raw_bytes'])
+    AST_BYTES.labels(lang, 'encoded').observe(stats['ast_bytes'])
+    AST_BYTES.labels(lang, 'compressed').observe(stats['compressed_bytes'])
+    FILES_TOTAL.labels(lang, 'parsed').inc()
+
+
+def start_metrics_server(**kwargs):
+    """
+    Expose scanner metrics from the Celery worker (SCANNER_METRICS_PORT).
+    With PROMETHEUS_MULTIPROC_DIR set, samples from prefork children are merged.
+    """
+    port = int(os.getenv("SCANNER_METRICS_PORT", 0))
+    if not port:
+        return
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
+
+
+def setup_worker_tracing(**kwargs):
+    # Same exporter as the API (otel_setup.setup_otel), for Celery workers
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    provider = TracerProvider()
+    endpoint = os.getenv("OTEL_TRACES_ENDPOINT", "http://tempo:4318/v1/traces")
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    trace.set_tracer_provider(provider)
@@ -0,0 +1,114 @@
+import pytest
+
+import ast_codec
+
+# Grammar packages (tree-sitter >= 0.22 bindings); core.py builds the same
+# grammars into a shared library.
+GRAMMARS = {
+    'py': ('tree_sitter_python', 'language', b'''
+import os
+
+@decorator
+class A(Base):
+    def f(self, x):
+        if x and not self.y:
+            return [i for i in x]
+        return None
+'''),
+    'js': ('tree_sitter_javascript', 'language', b'''
+export function f(items) {
+  for (const item of items) { if (item > 1) { return `v${item}`; } }
+}
+class A { m() { return /re/g.test("s"); } }
+'''),
+    'ts': ('tree_sitter_typescript', 'language_typescript', b'''
+interface S { run(n: number): string }
+export class A implements S {
+  run(n: number): string { return n > 0 ? "a" : "b"; }
+}
+'''),
+    'go': ('tree_sitter_go', 'language', b'''package main
+
+import "fmt"
+
+type T struct {
+	name string
+}
+
+func (t T) Run(items []int) int {
+	total := 0
+	for _, item := range items {
+		if item > 1 {
+			total += item
+		}
+	}
+	fmt.Println(t.name)
+	return total
+}
+'''),
+}
+
+
+def parse(ext):
+    tree_sitter = pytest.importorskip('tree_sitter')
+    module, attr, code = GRAMMARS[ext]
+    grammar = pytest.importorskip(module)
+    parser = tree_sitter.Parser(tree_sitter.Language(getattr(grammar, attr)()))
+    return parser.parse(code), code
+
+
+def walk(node):
+    # Reference pre-order traversal straight from tree-sitter
+    out = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        out.append((n.type, n.is_named, n.start_byte, n.end_byte, tuple(n.start_point), tuple(n.end_point)))
+        stack.extend(reversed(n.children))
+    return out
+
+
+@pytest.mark.parametrize('ext', sorted(GRAMMARS))
+def test_round_trip(ext):
+    tree, _ = parse(ext)
+    ast = ast_codec.loads(ast_codec.dumps(tree.root_node))
+    decoded = [
+        (ast.type(i), bool(ast.named[i]), ast.start_byte[i], ast.end_byte[i], ast.start(i), ast.stop(i))
+        for i in range(len(ast))
+    ]
+    assert decoded == walk(tree.root_node)
+    assert len(ast.types) == len(set(ast.types))
+
+
+def test_go_newline_node_type():
+    tree, _ = parse('go')
+    ast = ast_codec.CompactAST(ast_codec.encode_tree(tree.root_node))
+    assert '\n' in ast.types
+    assert ast.find({'function_declaration', 'method_declaration'})
+
+
+def legacy_v1(ast):
+    # Re-encode with the version 1 type table (names joined by '\n')
+    names = '\n'.join(ast.types).encode()
+    columns = memoryview(ast.parent).tobytes()
+    columns += b''.join(memoryview(getattr(ast, name)).tobytes() for name in ast_codec.U32_FIELDS)
+    columns += memoryview(ast.type_id).tobytes() + memoryview(ast.named).tobytes()
+    header = ast_codec.HEADER.pack(ast_codec.MAGIC, 1, len(ast), len(ast.types), len(names))
+    return header + names + b'\0' * (-len(names) % 4) + columns
+
+
+def test_legacy_v1_go():
+    tree, _ = parse('go')
+    ast = ast_codec.CompactAST(ast_codec.encode_tree(tree.root_node))
+    legacy = ast_codec.CompactAST(legacy_v1(ast))
+    assert legacy.types == ast.types
+    assert [legacy.type(i) for i in range(len(legacy))] == [ast.type(i) for i in range(len(ast))]
+
+
+def test_corrupt_type_table():
+    tree, _ = parse('py')
+    data = bytearray(ast_codec.encode_tree(tree.root_node))
+    magic, version, n_nodes, n_types, types_len = ast_codec.HEADER.unpack_from(data)
+    ast_codec.HEADER.pack_into(data, 0, magic, version, n_nodes, n_types + 1, types_len)
+    with pytest.raises(ValueError):
+        ast_codec.CompactAST(bytes(data))
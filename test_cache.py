@@ -0,0 +1,55 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+cache = pytest.importorskip('app.scanner.cache')
+
+
+def make(**kwargs):
+    return cache.ASTCache(fakeredis.FakeRedis(), ttl=60, batch_size=1000, **kwargs)
+
+
+def test_set_nx_keeps_existing_value():
+    c = make()
+    c.client.set('a', b'old')
+    c.put('a', b'new')
+    c.put('b', b'value')
+    assert c.flush() == 1
+    assert c.get_many(['a', 'b', 'c']) == [b'old', b'value', None]
+    assert 0 < c.client.ttl('b') <= 60
+    # Existing keys only get their TTL refreshed
+    assert 0 < c.client.ttl('a') <= 60
+
+
+def test_flush_in_batches():
+    c = cache.ASTCache(fakeredis.FakeRedis(), batch_size=2)
+    c.put('a', b'1')
+    assert c.client.get('a') is None
+    c.put('b', b'2')
+    assert c.client.mget(['a', 'b']) == [b'1', b'2']
+    assert c.flush() == 0
+
+
+def test_lru_eviction():
+    c = make(max_bytes=25)
+    for key in ('a', 'b', 'c'):
+        c.put(key, b'x' * 10)
+        c.flush()
+    # 30 bytes > 25: the least recently used entry goes
+    assert c.client.get('a') is None
+    assert c.stats()['bytes'] == 20
+    c.get('b')  # b becomes more recent than c
+    c.put('d', b'x' * 10)
+    c.flush()
+    assert c.get_many(['b', 'c', 'd']) == [b'x' * 10, None, b'x' * 10]
+    assert c.stats()['evictions'] == 2
+
+
+def test_stats_add_up_across_instances():
+    client = fakeredis.FakeRedis()
+    first, second = cache.ASTCache(client), cache.ASTCache(client)
+    first.put('a', b'1')
+    first.flush()
+    second.put('a', b'1')
+    second.flush()
+    second.get_many(['a', 'missing'])
+    assert first.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'writes': 1, 'skipped': 1}
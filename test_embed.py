@@ -0,0 +1,99 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+httpx = pytest.importorskip('httpx')
+os.environ.setdefault('DB_URL', 'sqlite://')
+embed = pytest.importorskip('app.ml.embed')
+mock_openai = pytest.importorskip('app.ml.mock_openai')
+
+
+class Flaky(httpx.AsyncBaseTransport):
+    """mock_openai in process, after answering the given (status, headers) first."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.inner = httpx.ASGITransport(app=mock_openai.app)
+        self.requests = 0
+
+    async def handle_async_request(self, request):
+        self.requests += 1
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return httpx.Response(status, headers=headers, json={"error": {"message": "injected"}})
+        return await self.inner.handle_async_request(request)
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    # No real waiting; records the backoff delays (jitter pinned to its minimum)
+    recorded = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args):
+        if delay:
+            recorded.append(delay)
+        await sleep(0)
+    monkeypatch.setattr(embed.asyncio, 'sleep', fake_sleep)
+    monkeypatch.setattr(embed.random, 'random', lambda: 0.0)
+    monkeypatch.setattr(mock_openai, 'MOCK_LATENCY_MS', 0)
+    return recorded
+
+
+def embed_with(transport, texts, **kwargs):
+    async def run():
+        async with embed.EmbeddingClient(url='http://mock/v1/embeddings', **kwargs) as client:
+            await client.client.aclose()
+            client.client = httpx.AsyncClient(transport=transport)
+            return await client.embed(texts)
+    return asyncio.run(run())
+
+
+def test_vectors_in_input_order(delays):
+    texts = ['def f(): pass', 'class A: pass', 'x = 1']
+    vectors = embed_with(Flaky(), texts, dimensions=256)
+    expected = np.array([mock_openai.fake_embedding(t, 256) for t in texts], dtype=np.float32)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors, expected)
+    assert delays == []
+
+
+def test_retry_after_then_backoff(delays):
+    transport = Flaky([(429, {'Retry-After': '0.5'}), (503, {})])
+    vectors = embed_with(transport, ['a'], dimensions=8)
+    assert vectors.shape == (1, 8)
+    assert transport.requests == 3
+    # Retry-After first, then exponential backoff (attempt 1: 2s, halved by the jitter floor)
+    assert delays == [0.5, 1.0]
+
+
+def test_gives_up_after_max_retries(delays):
+    transport = Flaky([(503, {})] * 3)
+    with pytest.raises(httpx.HTTPStatusError):
+        embed_with(transport, ['a'], max_retries=1)
+    assert transport.requests == 2
+
+
+def test_no_retry_on_client_error(delays):
+    transport = Flaky([(400, {})])
+    with pytest.raises(httpx.HTTPStatusError):
+        embed_with(transport, ['a'])
+    assert transport.requests == 1
+
+
+def test_pending_one_chunk_per_content():
+    engine = sa.create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE code_chunks (id INTEGER PRIMARY KEY, scan_id INT, chunk_sha256 TEXT, text TEXT)"))
+        conn.execute(sa.text("CREATE TABLE embeddings (id INTEGER PRIMARY KEY, chunk_sha256 TEXT)"))
+        conn.execute(sa.text(
+            "INSERT INTO code_chunks VALUES (1, 1, 'a', 'A'), (2, 1, 'b', 'B'), (3, 2, 'a', 'A'), (4, 2, 'c', 'C')"))
+        conn.execute(sa.text("INSERT INTO embeddings (chunk_sha256) VALUES ('c')"))
+    with Session(engine) as session:
+        # Same content in two scans: embedded once, from its oldest chunk
+        assert [tuple(r) for r in embed._pending(session, 0, 10)] == [(1, 'a', 'A', 1), (2, 'b', 'B', 1)]
+        assert [r[0] for r in embed._pending(session, 1, 10)] == [2]
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+# builder (imported by exporter) creates its tables on import
+os.environ.setdefault('DB_URL', 'sqlite://')
+exporter = pytest.importorskip('app.graph.exporter')
+
+GRAPH = {
+    'nodes': [
+        {'id': 'a.py', 'type': 'file'},
+        {'id': 'b.py', 'type': 'file'},
+        {'id': 'c.py', 'type': 'file'},
+        {'id': 'a.py::f', 'type': 'function'},
+        {'id': 'a.py::C', 'type': 'class'},
+    ],
+    'links': [
+        {'source': 'a.py', 'target': 'a.py::f', 'type': 'contains'},
+        {'source': 'a.py', 'target': 'a.py::C', 'type': 'contains'},
+        {'source': 'a.py', 'target': 'b.py', 'type': 'import'},
+        {'source': 'b.py', 'target': 'c.py', 'type': 'import'},
+        {'source': 'c.py', 'target': 'a.py', 'type': 'import'},
+        {'source': 'a.py::f', 'target': 'missing.py::g', 'type': 'call'},
+    ],
+}
+
+
+def test_constraints_first_one_per_label():
+    statements = exporter.export_neo4j(7, GRAPH, batch_size=2, dry_run=True)
+    constraints = [q for q, _ in statements if q.startswith('CREATE CONSTRAINT')]
+    assert constraints == [
+        f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:`{label}`) REQUIRE n.id IS UNIQUE"
+        for label in ('class', 'file', 'function')
+    ]
+    assert [q for q, _ in statements[:3]] == constraints
+
+
+def test_unwind_batches():
+    statements = exporter.export_neo4j(7, GRAPH, batch_size=2, dry_run=True)
+    files = [p for q, p in statements if q.startswith('UNWIND $ids') and '(n:`file`' in q]
+    assert [p['ids'] for p in files] == [['a.py', 'b.py'], ['c.py']]
+    assert all(p['scan_id'] == 7 for p in files)
+    imports = [p['rows'] for q, p in statements if '[:`import`]' in q]
+    assert [len(rows) for rows in imports] == [2, 1]
+    # Links to nodes outside the graph are dropped
+    assert not [q for q, _ in statements if '[:`call`]' in q]
+
+
+def test_relationships_grouped_by_labels():
+    statements = exporter.export_neo4j(7, GRAPH, batch_size=10, dry_run=True)
+    contains = [q for q, _ in statements if '[:`contains`]' in q]
+    assert len(contains) == 2
+    assert any('(a:`file` {id: r.s}) MATCH (b:`class` {id: r.t})' in q for q in contains)
+
+
+def test_labels_are_escaped():
+    graph = {'nodes': [{'id': 'x', 'type': 'we`ird'}], 'links': []}
+    query, _ = next(exporter.cypher_statements(1, graph))
+    assert '(n:`we``ird`)' in query
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('fastapi')
+import llm
+import mock_openai
+
+PROMPT = [{"role": "user", "content": "explain f"}]
+
+
+class Upstream(httpx.AsyncBaseTransport):
+    """Both endpoints served by mock_openai in process; `down` hosts answer `status`."""
+
+    def __init__(self, down=(), status=503):
+        self.down = set(down)
+        self.status = status
+        self.inner = httpx.ASGITransport(app=mock_openai.app)
+        self.hosts = []
+
+    async def handle_async_request(self, request):
+        self.hosts.append(request.url.host)
+        if request.url.host in self.down:
+            return httpx.Response(self.status, json={"error": {"message": "injected"}})
+        return await self.inner.handle_async_request(request)
+
+
+PRIMARY = httpx.URL(llm.LLM_URL).host
+FALLBACK = httpx.URL(llm.FALLBACK_URL).host
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    sleep = asyncio.sleep
+
+    async def no_wait(delay, *args):
+        await sleep(0)
+    monkeypatch.setattr(llm.asyncio, 'sleep', no_wait)
+    monkeypatch.setattr(mock_openai, 'MOCK_LATENCY_MS', 0)
+    monkeypatch.setattr(mock_openai, 'MOCK_TOKEN_LATENCY_MS', 0)
+
+
+def run(transport, *calls, **kwargs):
+    """Runs each call(client) in turn on one ChatClient; returns their results and the client."""
+    async def main():
+        async with llm.ChatClient(client=httpx.AsyncClient(transport=transport), **kwargs) as client:
+            return [await call(client) for call in calls], client
+    return asyncio.run(main())
+
+
+async def tokens(client, models=None):
+    return [t async for t in client.stream(PROMPT, on_model=models.append if models is not None else None)]
+
+
+def test_sse_tokens_in_order():
+    models = []
+    (out,), _ = run(Upstream(), lambda c: tokens(c, models))
+    assert out == mock_openai.fake_completion(PROMPT)
+    assert models == [llm.LLM_MODEL]
+
+
+def test_complete_joins_tokens():
+    (text,), _ = run(Upstream(), lambda c: c.complete("hello"))
+    assert text == "".join(mock_openai.fake_completion([{"role": "user", "content": "hello"}]))
+
+
+def test_fallback_after_retries():
+    upstream = Upstream(down={PRIMARY})
+    models = []
+    (out,), client = run(upstream, lambda c: tokens(c, models), max_retries=2)
+    assert out == mock_openai.fake_completion(PROMPT)
+    assert models == [llm.FALLBACK_MODEL]
+    assert upstream.hosts == [PRIMARY] * 3 + [FALLBACK]
+    assert not client.primary_healthy()
+    assert client.primary_down_until > time.monotonic() + llm.PRIMARY_COOLDOWN - 5
+
+
+def test_no_retry_on_client_error():
+    upstream = Upstream(down={PRIMARY}, status=400)
+    run(upstream, tokens, max_retries=2)
+    assert upstream.hosts == [PRIMARY, FALLBACK]
+
+
+def test_error_when_every_endpoint_fails():
+    upstream = Upstream(down={PRIMARY, FALLBACK})
+    with pytest.raises(httpx.HTTPStatusError):
+        run(upstream, tokens, max_retries=1)
+    assert upstream.hosts == [PRIMARY] * 2 + [FALLBACK] * 2
+
+
+def test_primary_healthy_again_once_it_answers():
+    upstream = Upstream(down={PRIMARY})
+
+    async def recover(client):
+        assert not client.primary_healthy()
+        upstream.down.clear()
+        return await tokens(client)
+    (_, out), client = run(upstream, tokens, recover, max_retries=0)
+    assert out == mock_openai.fake_completion(PROMPT)
+    assert client.primary_healthy()
+    assert client.primary_down_until == 0.0
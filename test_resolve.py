@@ -0,0 +1,34 @@
+import pytest
+
+import symbols
+from resolve import suffix_index, resolve_import
+
+FILES = ['pkg/a.py', 'pkg/b.py', 'pkg/sub/c.py', 'lib/__init__.py', 'lib/util.py', 'main.py']
+
+
+def resolve(relpath, module, files=FILES):
+    return resolve_import(relpath, module, suffix_index(files), {})
+
+
+@pytest.mark.parametrize('relpath, module, expected', [
+    ('pkg/a.py', '.b', ['pkg/b.py']),               # from . import b
+    ('pkg/sub/c.py', '..a', ['pkg/a.py']),          # from .. import a
+    ('pkg/sub/c.py', '..b.g', ['pkg/b.py']),        # from ..b import g
+    ('pkg/b.py', 'pkg.a', ['pkg/a.py']),            # from pkg import a (no __init__.py)
+    ('main.py', 'lib.util', ['lib/util.py']),       # from lib import util
+    ('main.py', 'lib.helper', ['lib/__init__.py']),  # from lib import helper (attribute)
+    ('lib/util.py', '.helper', ['lib/__init__.py']),
+    ('main.py', 'os.path', []),
+])
+def test_python_imports(relpath, module, expected):
+    assert resolve(relpath, module) == expected
+
+
+def test_from_import_names():
+    tree_sitter = pytest.importorskip('tree_sitter')
+    grammar = pytest.importorskip('tree_sitter_python')
+    language = tree_sitter.Language(grammar.language())
+    code = b'from . import b, c as d\nfrom ..x import y\nfrom pkg import a\nfrom os.path import *\nimport z.w as q\n'
+    tree = tree_sitter.Parser(language).parse(code)
+    _, edges = symbols.extract(language.query(symbols.QUERIES['py']), tree, code)
+    assert [e['dst'] for e in edges if e['kind'] == 'import'] == ['.b', '.c', '..x.y', 'pkg.a', 'os.path', 'z.w']
@@ -0,0 +1,428 @@
+import os
+import argparse
+import json
+import math
+import time
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
+import sqlalchemy as sa
+
+# Types d'index FAISS (chaînes index_factory). Les identifiants stockés sont
+# toujours les embeddings.id: IDMap2 pour flat/HNSW, ids natifs pour IVF.
+INDEX_KIND = os.getenv("FAISS_INDEX_KIND", "flat")  # flat | hnsw | ivfpq
+INDEX_SPEC = os.getenv("FAISS_INDEX_SPEC")  # chaîne index_factory explicite, prioritaire
+HNSW_M = int(os.getenv("FAISS_HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", 200))
+IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", 0))  # 0: 4*sqrt(n) au rebuild
+PQ_M = int(os.getenv("FAISS_PQ_M", 64))  # sous-quantifieurs, doit diviser la dimension
+PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", 8))
+TRAIN_SIZE = int(os.getenv("FAISS_TRAIN_SIZE", 200000))
+NPROBE = int(os.getenv("FAISS_NPROBE", 32))
+EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 128))
+PCA_DIM = int(os.getenv("FAISS_PCA_DIM", 0))  # >0: PCA intégrée à l'index (entraînée au rebuild)
+PAGE_SIZE = 10000
+# Stockage des vecteurs en base: 'array' (ARRAY(Float), historique) ou bytea float32/float16
+VECTOR_STORAGE = os.getenv("EMBED_VECTOR_STORAGE", "f32")
+DTYPES = {'f32': np.float32, 'f16': np.float16}
+VECTOR_COLUMNS = "vector, vector_blob, vector_dtype"
+INDEX_PATH = os.getenv("FAISS_INDEX_PATH", os.path.join(os.path.dirname(__file__), 'faiss_index', 'ast.index'))
+RELOAD_INTERVAL = float(os.getenv("FAISS_RELOAD_INTERVAL", 5))  # secondes entre deux stat() du fichier
+EXACT_SUBSET = int(os.getenv("FAISS_EXACT_SUBSET", 50000))  # sous-ensemble cherché en exact sous ce seuil
+SCAN_CACHE_SIZE = 64
+
+
+def index_spec(kind=INDEX_KIND, n_vectors=0, pca_dim=PCA_DIM):
+    if INDEX_SPEC:
+        return INDEX_SPEC
+    pca = f"PCA{pca_dim}," if pca_dim else ""
+    if kind == 'flat':
+        return f"IDMap2,{pca}Flat"
+    if kind == 'hnsw':
+        return f"IDMap2,{pca}HNSW{HNSW_M},Flat"
+    if kind == 'ivfpq':
+        nlist = IVF_NLIST or max(16, min(65536, int(4 * math.sqrt(max(n_vectors, 1)))))
+        return f"{pca}IVF{nlist},PQ{PQ_M}x{PQ_NBITS}"
+    raise ValueError(f"Type d'index FAISS inconnu: {kind}")
+
+
+def create(dim, kind=INDEX_KIND, n_vectors=0, pca_dim=PCA_DIM):
+    index = faiss.index_factory(dim, index_spec(kind, n_vectors, pca_dim))
+    hnsw = _hnsw(index)
+    if hnsw is not None:
+        hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return index
+
+
+def _hnsw(index):
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index.hnsw if isinstance(index, faiss.IndexHNSW) else None
+
+
+def train_size(index):
+    """Nombre de vecteurs d'entraînement souhaité (0 si l'index n'en a pas besoin)."""
+    if index.is_trained:
+        return 0
+    ivf = faiss.try_extract_index_ivf(index)
+    wanted = 39 * max(ivf.nlist if ivf else 0, 2 ** PQ_NBITS)
+    return min(max(wanted, 1), TRAIN_SIZE)
+
+
+def set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    hnsw = _hnsw(index)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def write_index(index, path=INDEX_PATH):
+    """
+    Publie une nouvelle version: écriture puis rename atomique. Les
+    processus qui ont mappé l'ancienne version la gardent jusqu'au swap.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+
+def load(path=INDEX_PATH):
+    # mmap en lecture seule: les workers d'une même machine partagent les pages.
+    # IO_FLAG_MMAP ne mappe que les listes inversées IVF; IO_FLAG_MMAP_IFC lit
+    # tous les tableaux (Flat, HNSW, IVF) directement dans le fichier mappé.
+    # Les deux combinés échouent sur les listes IVF en mémoire.
+    try:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return set_search_params(index)
+
+
+class ResidentIndex:
+    """
+    Index chargé une fois par processus. get() ne bloque jamais: une
+    nouvelle version publiée (autre inode/mtime) est chargée dans un thread
+    pendant que les lectures continuent sur l'ancienne, puis la référence
+    est remplacée d'un coup.
+    """
+
+    def __init__(self, path=INDEX_PATH, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index = None
+        self.version = None
+        self._checked = 0.0
+        self._loading = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load(self, version):
+        try:
+            index = load(self.path)
+            self.index, self.version = index, version
+        finally:
+            self._loading.release()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval:
+            self._checked = now
+            version = self._stat()
+            if version is not None and version != self.version and self._loading.acquire(blocking=False):
+                if self.index is None:
+                    self._load(version)  # premier chargement: rien d'autre à servir
+                else:
+                    threading.Thread(target=self._load, args=(version,), daemon=True).start()
+        return self.index
+
+    def search(self, queries, k, ids=None):
+        index = self.get()
+        if index is None:
+            return None, None
+        return search(index, queries, k, ids)
+
+    def reload(self):
+        """Swap immédiat (synchrone), par ex. après un rebuild dans ce processus."""
+        self._loading.acquire()
+        self._load(self._stat())
+        return self.index
+
+
+def search(index, queries, k, ids=None):
+    """
+    Recherche limitée à `ids` (embeddings.id) si fourni. Petit sous-ensemble
+    d'un index IDMap2 (flat/HNSW): distances exactes sur les vecteurs
+    reconstruits, un filtre très sélectif dégradant le parcours HNSW.
+    Sinon sélecteur d'ids FAISS passé à la recherche.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, index.d)
+    if ids is None:
+        return index.search(queries, k)
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.full((len(queries), k), np.inf, dtype=np.float32), np.full((len(queries), k), -1, dtype=np.int64)
+    if len(ids) <= EXACT_SUBSET and isinstance(index, faiss.IndexIDMap2):
+        try:
+            vectors = index.reconstruct_batch(ids)
+        except RuntimeError:
+            # Ids en base mais pas encore dans cette version de l'index (embed
+            # vient de committer, rechargement pas encore fait): le sélecteur
+            # ignore les ids inconnus
+            vectors = None
+    else:
+        vectors = None
+    if vectors is not None:
+        D, I = faiss.knn(queries, vectors, min(k, len(ids)))
+        found = np.where(I >= 0, ids[np.maximum(I, 0)], -1)
+        if found.shape[1] < k:
+            pad = k - found.shape[1]
+            D = np.pad(D, ((0, 0), (0, pad)), constant_values=np.inf)
+            found = np.pad(found, ((0, 0), (0, pad)), constant_values=-1)
+        return D, found
+    selector = faiss.IDSelectorBatch(ids)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif _hnsw(index) is not None:
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=_hnsw(index).efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+_scan_ids = OrderedDict()
+_scan_ids_lock = threading.Lock()
+
+
+def scan_embedding_ids(session, scan_id, version=None):
+    """
+    embeddings.id des contenus d'un scan (les vecteurs sont partagés entre
+    scans via chunk_sha256). Mis en cache par (scan, version de l'index).
+    """
+    key = (scan_id, version)
+    with _scan_ids_lock:
+        if key in _scan_ids:
+            _scan_ids.move_to_end(key)
+            return _scan_ids[key]
+    ids = np.array(session.execute(sa.text(
+        "SELECT DISTINCT e.id FROM embeddings e JOIN code_chunks c ON c.chunk_sha256 = e.chunk_sha256 "
+        "WHERE c.scan_id = :scan_id"
+    ), {"scan_id": scan_id}).scalars().all(), dtype=np.int64)
+    with _scan_ids_lock:
+        _scan_ids[key] = ids
+        while len(_scan_ids) > SCAN_CACHE_SIZE:
+            _scan_ids.popitem(last=False)
+    return ids
+
+
+_resident = {}
+_resident_lock = threading.Lock()
+
+
+def resident(path=INDEX_PATH):
+    with _resident_lock:
+        if path not in _resident:
+            _resident[path] = ResidentIndex(path)
+        return _resident[path]
+
+
+def encode_vector(v, storage=VECTOR_STORAGE):
+    """Colonnes embeddings (vector, vector_blob, vector_dtype) pour un vecteur."""
+    if storage == 'array':
+        return {'vector': v.tolist(), 'vector_blob': None, 'vector_dtype': None}
+    return {'vector': None, 'vector_blob': v.astype(DTYPES[storage]).tobytes(), 'vector_dtype': storage}
+
+
+def decode_vectors(rows, dim):
+    """Matrice float32 depuis des lignes (vector, vector_blob, vector_dtype), formats mélangés."""
+    out = np.empty((len(rows), dim), dtype=np.float32)
+    for i, (vector, blob, dtype) in enumerate(rows):
+        out[i] = np.frombuffer(blob, dtype=DTYPES[dtype]) if blob is not None else vector
+    return out
+
+
+def _iter_vectors(session, dim):
+    # Pages keyset (id, vecteur): le corpus complet ne tient pas en mémoire
+    after = 0
+    while True:
+        rows = session.execute(
+            sa.text(f"SELECT id, {VECTOR_COLUMNS} FROM embeddings WHERE id > :after ORDER BY id LIMIT :n"),
+            {"after": after, "n": PAGE_SIZE}).fetchall()
+        if not rows:
+            return
+        after = rows[-1][0]
+        yield np.array([r[0] for r in rows], dtype=np.int64), decode_vectors([r[1:] for r in rows], dim)
+
+
+def rebuild(session, dim, kind=INDEX_KIND):
+    """
+    Reconstruit l'index depuis la table embeddings: entraînement sur un
+    échantillon aléatoire si nécessaire, puis ajout par pages avec les ids.
+    """
+    n = session.execute(sa.text("SELECT COUNT(*) FROM embeddings")).scalar()
+    index = create(dim, kind, n)
+    wanted = train_size(index)
+    if wanted:
+        sample = session.execute(
+            sa.text(f"SELECT {VECTOR_COLUMNS} FROM embeddings ORDER BY random() LIMIT :n"), {"n": wanted}).fetchall()
+        if not sample:
+            raise ValueError(f"Index {kind} à entraîner mais aucun embedding en base")
+        index.train(decode_vectors(sample, dim))
+    for ids, vectors in _iter_vectors(session, dim):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def _synthetic(n, dim, seed=0, n_clusters=64):
+    # Données groupées (plus réalistes qu'un bruit uniforme pour IVF/PQ)
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def benchmark(vectors, queries, k=10, kinds=('flat', 'hnsw', 'ivfpq'), nprobes=(1, 8, 32, 128), ef_searches=(16, 64, 256)):
+    """
+    recall@k (contre une recherche exacte) et latence par requête
+    unitaire, pour chaque type d'index et chaque réglage de recherche.
+    """
+    dim = vectors.shape[1]
+    ids = np.arange(1, len(vectors) + 1, dtype=np.int64)
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    truth = exact.search(queries, k)[1] + 1
+    results = []
+    for kind in kinds:
+        index = create(dim, kind, len(vectors))
+        start = time.perf_counter()
+        wanted = train_size(index)
+        if wanted:
+            index.train(vectors[np.random.default_rng(0).permutation(len(vectors))[:wanted]])
+        index.add_with_ids(vectors, ids)
+        build_s = time.perf_counter() - start
+        settings = [{}]
+        if faiss.try_extract_index_ivf(index) is not None:
+            settings = [{'nprobe': p} for p in nprobes]
+        elif _hnsw(index) is not None:
+            settings = [{'ef_search': ef} for ef in ef_searches]
+        for params in settings:
+            set_search_params(index, **params)
+            latencies = []
+            found = np.empty_like(truth)
+            for i, q in enumerate(queries):
+                t = time.perf_counter()
+                found[i] = index.search(q.reshape(1, -1), k)[1][0]
+                latencies.append(time.perf_counter() - t)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            results.append({
+                'kind': kind,
+                'spec': index_spec(kind, len(vectors)),
+                **params,
+                'build_s': round(build_s, 3),
+                f'recall@{k}': round(float(recall), 4),
+                'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+                'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 3),
+            })
+    return results
+
+
+def reduction_benchmark(vectors, queries, k=10, dims=(256, 512, 1024)):
+    """
+    recall@k d'une recherche exacte sur vecteurs réduits (troncature
+    renormalisée, PCA, float16) contre la recherche pleine dimension, et
+    octets stockés par vecteur.
+    """
+    full_dim = vectors.shape[1]
+    exact = faiss.IndexFlatL2(full_dim)
+    exact.add(vectors)
+    truth = exact.search(queries, k)[1]
+
+    def recall(xb, xq):
+        index = faiss.IndexFlatL2(xb.shape[1])
+        index.add(np.ascontiguousarray(xb, dtype=np.float32))
+        found = index.search(np.ascontiguousarray(xq, dtype=np.float32), k)[1]
+        return round(float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])), 4)
+
+    def unit(x):
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    f16 = lambda x: x.astype(np.float16).astype(np.float32)
+    results = [{'method': 'f16', 'dim': full_dim, 'bytes': full_dim * 2, f'recall@{k}': recall(f16(vectors), f16(queries))}]
+    for d in dims:
+        if d >= full_dim:
+            continue
+        # Troncature: valable pour text-embedding-3 (paramètre `dimensions` de l'API)
+        results.append({'method': 'truncate', 'dim': d, 'bytes': d * 4,
+                        f'recall@{k}': recall(unit(vectors[:, :d]), unit(queries[:, :d]))})
+        pca = faiss.PCAMatrix(full_dim, d)
+        pca.train(vectors)
+        results.append({'method': 'pca', 'dim': d, 'bytes': d * 4,
+                        f'recall@{k}': recall(pca.apply(vectors), pca.apply(queries))})
+        results.append({'method': 'pca+f16', 'dim': d, 'bytes': d * 2,
+                        f'recall@{k}': recall(f16(pca.apply(vectors)), f16(pca.apply(queries)))})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index FAISS des embeddings: rebuild et benchmark")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rb = sub.add_parser('rebuild', help="Entraîne et reconstruit l'index depuis la table embeddings")
+    rb.add_argument('--kind', default=INDEX_KIND, choices=['flat', 'hnsw', 'ivfpq'])
+    bench = sub.add_parser('bench', help="recall@k vs latence par type d'index")
+    bench.add_argument('--synthetic', type=int, default=0, help="N vecteurs synthétiques au lieu de la base")
+    bench.add_argument('--dim', type=int, default=3072)
+    bench.add_argument('--limit', type=int, default=200000, help="Vecteurs lus depuis la base")
+    bench.add_argument('--queries', type=int, default=200)
+    bench.add_argument('--k', type=int, default=10)
+    bench.add_argument('--kinds', default='flat,hnsw,ivfpq')
+    bench.add_argument('--reduce', action='store_true', help="Compare float16, troncature et PCA au lieu des types d'index")
+    bench.add_argument('--dims', default='256,512,1024')
+    args = parser.parse_args()
+
+    # Imports tardifs: le benchmark synthétique n'a pas besoin de la base
+    if args.command == 'rebuild':
+        from app.ml.embed import Session, EMBEDDING_DIM
+        session = Session()
+        try:
+            start = time.perf_counter()
+            index = rebuild(session, EMBEDDING_DIM, args.kind)
+            write_index(index)
+            print(f"Index {index_spec(args.kind, index.ntotal)} reconstruit: {index.ntotal} vecteurs en {time.perf_counter() - start:.1f}s")
+        finally:
+            session.close()
+        return
+
+    if args.synthetic:
+        data = _synthetic(args.synthetic + args.queries, args.dim)
+    else:
+        from app.ml.embed import Session, EMBEDDING_DIM
+        session = Session()
+        try:
+            rows = session.execute(
+                sa.text(f"SELECT {VECTOR_COLUMNS} FROM embeddings ORDER BY random() LIMIT :n"),
+                {"n": args.limit + args.queries}).fetchall()
+        finally:
+            session.close()
+        data = decode_vectors(rows, EMBEDDING_DIM)
+    queries, vectors = data[:args.queries], data[args.queries:]
+    if args.reduce:
+        results = reduction_benchmark(vectors, queries, args.k, [int(d) for d in args.dims.split(',')])
+    else:
+        results = benchmark(vectors, queries, args.k, args.kinds.split(','))
+    print(json.dumps({'n_vectors': len(vectors), 'n_queries': len(queries), 'k': args.k, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import io
+import os
+import queue
+import struct
+import threading
+import sqlalchemy as sa
+from .telemetry import timed_write
+
+COMMIT_EVERY = int(os.getenv("SCAN_COMMIT_EVERY", 5000))
+MAX_PENDING_BATCHES = int(os.getenv("SCAN_WRITER_QUEUE", 4))
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\0' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+NULL = struct.pack('>i', -1)
+
+
+def _encoder(column_type):
+    if isinstance(column_type, sa.BigInteger):
+        return lambda v: struct.pack('>q', v)
+    if isinstance(column_type, sa.Integer):
+        return lambda v: struct.pack('>i', v)
+    if isinstance(column_type, sa.LargeBinary):
+        return bytes
+    if isinstance(column_type, sa.String):
+        return lambda v: v.encode()
+    raise TypeError(f"No binary COPY encoder for {column_type!r}")
+
+
+class ChunkWriter:
+    """
+    Streams rows into a table from a background thread, committing every
+    `batch_size` rows. PostgreSQL gets a binary COPY per batch; other
+    backends (e.g. SQLite) fall back to executemany.
+
+    The caller only appends to an in-memory buffer, so the loop draining
+    parse results never waits on a database round trip (unless more than
+    `max_pending` batches are queued).
+    """
+
+    def __init__(self, engine, table, defaults=None, batch_size=COMMIT_EVERY, max_pending=MAX_PENDING_BATCHES):
+        self.engine = engine
+        self.table = table
+        self.defaults = defaults or {}
+        self.batch_size = batch_size
+        self.columns = [c for c in table.columns if not c.primary_key]
+        self.use_copy = engine.dialect.name == 'postgresql'
+        if self.use_copy:
+            self._encoders = [(c.name, _encoder(c.type)) for c in self.columns]
+        self.rows_written = 0
+        self._buffer = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._drain, name=f"{table.name}-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, row):
+        if self._error:
+            raise self._error
+        self._buffer.append(dict(self.defaults, **row))
+        if len(self._buffer) >= self.batch_size:
+            self._queue.put(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        if self._buffer:
+            self._queue.put(self._buffer)
+            self._buffer = []
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+    def _drain(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            if self._error:
+                continue
+            try:
+                with timed_write('db'):
+                    self._flush(batch)
+                self.rows_written += len(batch)
+            except Exception as e:
+                self._error = e
+
+    def _flush(self, rows):
+        if self.use_copy:
+            self._copy(rows)
+        else:
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert(), rows)
+
+    def _copy(self, rows):
+        buf = io.BytesIO()
+        buf.write(PGCOPY_HEADER)
+        n_fields = struct.pack('>h', len(self._encoders))
+        for row in rows:
+            buf.write(n_fields)
+            for name, encode in self._encoders:
+                value = row.get(name)
+                if value is None:
+                    buf.write(NULL)
+                    continue
+                data = encode(value)
+                buf.write(struct.pack('>i', len(data)))
+                buf.write(data)
+        buf.write(PGCOPY_TRAILER)
+        cols = ', '.join(c.name for c in self.columns)
+        sql = f"COPY {self.table.name} ({cols}) FROM STDIN WITH (FORMAT binary)"
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            if hasattr(cursor, 'copy_expert'):  # psycopg2
+                buf.seek(0)
+                cursor.copy_expert(sql, buf)
+            else:  # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buf.getvalue())
+            raw.commit()
+        finally:
+            raw.close()